@@ -1,36 +1,155 @@
+from __future__ import annotations
+import time
+APP_IMPORT_STARTED = time.perf_counter()
 from flask import Flask, request, jsonify, make_response, Response
+import json
+import gzip
+import hashlib
+import functools
 from data_processing.main import *
-from threading import Thread
-from typing import Union, Callable
-import yaml
-from data_processing.postgres_handler import get_db_all_users, init_db, drop_users_table
+from threading import Thread, Lock
+from typing import TYPE_CHECKING, Callable, Hashable, Union
+import math
+from data_processing.notifications import BucketEventsIngestion
+from data_processing.coordination import IngestionCoordinator, process_shards_minio, process_resync_minio
+from data_processing.cache import LRUCache, get_dataset_version
+from data_processing.read_model import UsersReadModel
+from data_processing.jobs import IngestionJobs
+from data_processing.metrics import DATA_GET_SECONDS, DB_POOL, DATA_CACHE, APP_STARTUP_SECONDS, render_metrics
+from data_processing.postgres_handler import get_db_users, iter_db_users, init_db, get_db_pool_stats, \
+    get_source_rejects, get_data_generation
 
-docker_compose = yaml.load(open('docker-compose.yml'))
+if TYPE_CHECKING:
+    from minio import Minio
 
 IP = '0.0.0.0'
 PORT = 3001
 PERIODIC_TIME = 10 * 60
+COMPOSE_FILE = os.getenv("Compose_file", "docker-compose.yml")
+INGESTION_MODE = os.getenv("Ingestion_mode", "periodic")
+DB_BATCH_SIZE = int(os.getenv("DB_batch_size", DB_BATCH_SIZE))
+FETCH_CONCURRENCY = int(os.getenv("Fetch_concurrency", FETCH_CONCURRENCY))
+OUTPUT_PARQUET = os.getenv("Output_parquet", OUTPUT_PARQUET)
+OUTPUT_LAYOUT = os.getenv("Output_layout", OUTPUT_LAYOUT)
+PARSE_PROCESSES = int(os.getenv("Parse_processes", PARSE_PROCESSES))
+INGESTION_SHARDS = int(os.getenv("Ingestion_shards", 0))
+QUARANTINE = os.getenv("Quarantine", QUARANTINE)
+MAX_PAGE_LIMIT = 10000
+NDJSON_MIMETYPE = 'application/x-ndjson'
+DATA_CACHE_MAX_SIZE = int(os.getenv("Data_cache_size", 256))
 app = Flask(__name__)
+data_cache = LRUCache(DATA_CACHE_MAX_SIZE, ttl=PERIODIC_TIME)
+_read_model = None
+_read_model_lock = Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def get_compose_service(service: str) -> dict:
+    """
+    A method to get the definition of a service in the docker compose file (COMPOSE_FILE), which is the fallback of the
+    configuration not given by environment variables. The file is only parsed (and yaml only imported) the first time a
+    value is missing.
+    :param service: the service's name in the compose file.
+    :return: the service's definition as a dictionary, or an empty dictionary if the file or the service does not exist.
+    """
+    if not os.path.isfile(COMPOSE_FILE):
+        return {}
+    import yaml
+    with open(COMPOSE_FILE) as f:
+        compose = yaml.safe_load(f) or {}
+    return compose.get('services', {}).get(service, {}) or {}
+
+
+def get_compose_environment(service: str) -> dict:
+    """
+    A method to get the environment of a service in the docker compose file (see get_compose_service).
+    :param service: the service's name in the compose file.
+    :return: the service's environment as a dictionary (the 'KEY=value' entries are split), or an empty dictionary if
+    the file or the service does not exist.
+    """
+    environment = get_compose_service(service).get('environment', {}) or {}
+    if isinstance(environment, list):
+        environment = dict(entry.split('=', 1) for entry in environment if '=' in entry)
+    return {key: str(value) for key, value in environment.items()}
+
+
+def get_compose_port(service: str, default: str) -> str:
+    """
+    A method to get the port of a service in the docker compose file (see get_compose_service), i.e. the container
+    port of its first 'ports' entry.
+    :param service: the service's name in the compose file.
+    :param default: the port used if the service has no ports.
+    :return: the port.
+    """
+    ports = get_compose_service(service).get('ports', []) or []
+    return str(ports[0]).split(':')[-1] if ports else default
+
+
+def get_config(name: str, service: str, compose_name: str, default: str) -> str:
+    """
+    A method to get a configuration value from the environment variable name, falling back on the variable compose_name
+    of a service in the docker compose file, then on a default value.
+    :param name: the environment variable's name.
+    :param service: the service's name in the compose file.
+    :param compose_name: the variable's name in the service's environment.
+    :param default: the value used if neither is given.
+    :return: the configuration value.
+    """
+    value = os.getenv(name, None)
+    if value is None:
+        value = get_compose_environment(service).get(compose_name, default)
+    return value
+
 
 minio_info = {
-    'endpoint': os.getenv("Minio_host", "localhost") + ':' + docker_compose['services']['minio']['ports'][0].split(':')[-1],
-    'access_key': docker_compose['services']['minio']['environment'][0].split('=')[-1],
-    'secret_key': docker_compose['services']['minio']['environment'][1].split('=')[-1],
+    'endpoint': os.getenv("Minio_host", "localhost") + ':' + (os.getenv("Minio_port", None) or
+                                                              get_compose_port('minio', '9000')),
+    'access_key': get_config("Minio_access_key", 'minio', 'MINIO_ACCESS_KEY', 'minio-access-key'),
+    'secret_key': get_config("Minio_secret_key", 'minio', 'MINIO_SECRET_KEY', 'minio-secret-key'),
 }
-minio_client = Minio(
-    endpoint=minio_info['endpoint'],
-    access_key=minio_info['access_key'],
-    secret_key=minio_info['secret_key'],
-    secure=False
-)
 
 db_info = {
-    'db_name': docker_compose['services']['db']['environment']['POSTGRES_DB'],
-    'db_user': docker_compose['services']['db']['environment']['POSTGRES_USER'],
-    'db_password': docker_compose['services']['db']['environment']['POSTGRES_PASSWORD'],
-    'db_host': os.getenv("DB_host", "localhost")
+    'db_name': get_config("DB_name", 'db', 'POSTGRES_DB', 'internship'),
+    'db_user': get_config("DB_user", 'db', 'POSTGRES_USER', 'postgres'),
+    'db_password': get_config("DB_password", 'db', 'POSTGRES_PASSWORD', 'postgres'),
+    'db_host': os.getenv("DB_host", "localhost"),
+    'db_port': int(os.getenv("DB_port", 5432)),
+    'db_pool_min_size': int(os.getenv("DB_pool_min_size", 1)),
+    'db_pool_max_size': int(os.getenv("DB_pool_max_size", 10)),
 }
 
+if INGESTION_MODE == 'events' and INGESTION_SHARDS > 0:
+    raise ValueError("Ingestion_shards can not be used with Ingestion_mode=events, since every replica would process "
+                     "every notification and publish the output.")
+coordinator = IngestionCoordinator(db_info, INGESTION_SHARDS) if INGESTION_SHARDS > 0 else None
+
+_minio_client = None
+_minio_client_lock = Lock()
+
+
+def get_minio_client() -> Minio:
+    """
+    A method to get the MinIO client of the app. The client (and the minio package) is created on the first use rather
+    than when the app is imported.
+    :return: the MinIO client.
+    """
+    global _minio_client
+    with _minio_client_lock:
+        if _minio_client is None:
+            import urllib3
+            from minio import Minio
+            _minio_client = Minio(
+                endpoint=minio_info['endpoint'],
+                access_key=minio_info['access_key'],
+                secret_key=minio_info['secret_key'],
+                secure=False,
+                http_client=urllib3.PoolManager(
+                    timeout=urllib3.Timeout(connect=300, read=300),
+                    maxsize=max(10, FETCH_CONCURRENCY),
+                    retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+                )
+            )
+        return _minio_client
 
 
 def fix_values_data_get(is_image_exists: Union[str, None], min_age: Union[str, None], max_age: Union[str, None]) \
@@ -38,7 +157,7 @@ def fix_values_data_get(is_image_exists: Union[str, None], min_age: Union[str, N
     """
     A method to fix the values received in a /data get request as strings (or Nones). The None values will stay None,
     while the valid values will convert to their corresponding types. An error will occur if the types do not match
-    their conditions.
+    their conditions (e.g. an age which is not a finite number).
     :param is_image_exists: a string representing a boolean flag to filter the data returned according to the existence
     images in their data.
     :param min_age: a string representing a float representing the minimum age of the data returned.
@@ -51,37 +170,182 @@ def fix_values_data_get(is_image_exists: Union[str, None], min_age: Union[str, N
         is_image_exists = is_image_exists == 'True'
     if min_age is not None:
         min_age = float(min_age)
+        assert math.isfinite(min_age)
     if max_age is not None:
         max_age = float(max_age)
+        assert math.isfinite(max_age)
     return is_image_exists, min_age, max_age
 
 
+def fix_values_page_get(limit: Union[str, None], after: Union[str, None]) -> Tuple[Union[int, None], Union[str, None]]:
+    """
+    A method to fix the pagination values received in a /data get request as strings (or Nones). The None values will
+    stay None. An error will occur if the limit is not a positive integer up to MAX_PAGE_LIMIT or if the cursor is not
+    valid.
+    :param limit: a string representing the maximum number of users returned.
+    :param after: an opaque cursor (returned by the previous page) after which the users are returned.
+    :return: the limit as an integer, and the user_id which the cursor points to.
+    """
+    if limit is not None:
+        limit = int(limit)
+        assert 0 < limit <= MAX_PAGE_LIMIT
+    if after is not None:
+        after = decode_page_cursor(after)
+    return limit, after
+
+
 def generate_conditions_get(is_image_exists: Union[bool, None], min_age: Union[float, None],
-                            max_age: Union[float, None]) -> List[Callable]:
+                            max_age: Union[float, None]) -> dict:
     """
     A method to generate the conditions of the returned value in the /data get request according the value of its
-    parameters. The conditions are for the 'value' elements in the dictionary.
+    parameters. The conditions are translated to filters on the users' columns, so that the read model (or the database)
+    only returns the matching users. The ages are converted to birth date bounds once per request.
     :param is_image_exists: a boolean flag to filter the data returned according to the existence images in their data.
     :param min_age: a string representing a float representing the minimum age of the data returned.
     :param max_age: a string representing a float representing the maximum age of the data returned.
-    :return: a list of conditions.
+    :return: a dictionary of the filters (is_image_exists, min_birthts, max_birthts) as expected by get_db_users and
+    UsersReadModel.select.
     """
-    ret = []
-    if is_image_exists is not None:
-        ret.append(lambda arg: 'img_path' in arg.keys() and (arg['img_path'] != '') == is_image_exists)
+    now_ms = time.time() * 1000
+    ret = {'is_image_exists': is_image_exists}
     if min_age is not None:
-        min_age_ms = years_to_ms(min_age)
-        ret.append(lambda arg: 'birthts' in arg.keys() and get_ms_age(float(arg['birthts'])) >= min_age_ms)
+        ret['max_birthts'] = math.floor(now_ms - years_to_ms(min_age))
     if max_age is not None:
-        max_age_ms = years_to_ms(max_age)
-        ret.append(lambda arg: 'birthts' in arg.keys() and get_ms_age(float(arg['birthts'])) <= max_age_ms)
+        ret['min_birthts'] = math.ceil(now_ms - years_to_ms(max_age))
+    return ret
+
+
+def generate_ndjson_response(conditions: dict, limit: Union[int, None], after: Union[str, None],
+                            filters: str) -> Response:
+    """
+    A method to generate a streamed /data get response in NDJSON format, i.e. one JSON object per user per line. The
+    users are read from the database through a server-side cursor and sent as they arrive, so the request's latency is
+    observed once the last line is sent rather than when the response is returned.
+    :param conditions: the filters of the users table generated by generate_conditions_get.
+    :param limit: the maximum number of users returned.
+    :param after: the user_id after which the users are returned.
+    :param filters: the label of the request in DATA_GET_SECONDS (see get_data_get_filters).
+    :return: the streamed response.
+    """
+    def generate_lines():
+        with DATA_GET_SECONDS.time(filters=filters):
+            for user_id, values in iter_db_users(db_info, after_user_id=after, limit=limit, **conditions):
+                yield json.dumps({'user_id': user_id, **values}) + '\n'
+    return Response(generate_lines(), 200, mimetype=NDJSON_MIMETYPE)
+
+
+def get_read_model_cached(version: Hashable) -> UsersReadModel:
+    """
+    A method to get the in-memory read model of all the users in the database (see UsersReadModel). The model is built
+    once per version of the data, so the database is only queried once per version, and the filtered requests are
+    answered from the model. It is kept in its own slot rather than in data_cache, so the responses cached there never
+    evict it.
+    :param version: the current version of the data (e.g. its generation, see get_data_generation).
+    :return: the read model of the users.
+    """
+    global _read_model
+    with _read_model_lock:
+        if _read_model is None or _read_model[0] != version:
+            _read_model = (version, UsersReadModel(get_db_users(db_info)))
+        return _read_model[1]
+
+
+def clear_data_caches() -> None:
+    """
+    A method to drop the cached /data responses and the read model, e.g. before timing cold requests.
+    :return: None.
+    """
+    global _read_model
+    data_cache.clear()
+    with _read_model_lock:
+        _read_model = None
+
+
+def get_age_period(min_age: Union[float, None], max_age: Union[float, None]) -> Union[int, None]:
+    """
+    A method to get the current PERIODIC_TIME period of the /data get responses filtered by age. The ages of the users
+    grow with time, so the responses filtered by age are only valid for one period.
+    :param min_age: the minimum age of the data returned.
+    :param max_age: the maximum age of the data returned.
+    :return: the number of the current period, or None if the ages are not filtered.
+    """
+    return int(time.time() // PERIODIC_TIME) if min_age is not None or max_age is not None else None
+
+
+def generate_data_etag(generation: int, is_image_exists: Union[bool, None], min_age: Union[float, None],
+                       max_age: Union[float, None], limit: Union[int, None], after: Union[str, None]) -> str:
+    """
+    A method to generate the (strong) ETag of a /data get response from the generation of the data and the normalized
+    arguments, without reading the users. The generation is shared by all the replicas of the app and survives their
+    restarts (see get_data_generation), so every replica gives the same data the same tag. When the ages are filtered,
+    the tag also changes every PERIODIC_TIME seconds, since the ages of the users grow with time.
+    :param generation: the generation of the data.
+    :param is_image_exists: a boolean flag to filter the data returned according to the existence images in their data.
+    :param min_age: the minimum age of the data returned.
+    :param max_age: the maximum age of the data returned.
+    :param limit: the maximum number of users returned.
+    :param after: the user_id after which the users are returned.
+    :return: the ETag as a string (without quotes).
+    """
+    period = get_age_period(min_age, max_age)
+    key = repr((generation, period, is_image_exists, min_age, max_age, limit, after))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def generate_data_body(generation: int, is_image_exists: Union[bool, None], min_age: Union[float, None],
+                       max_age: Union[float, None], limit: Union[int, None], after: Union[str, None]) \
+        -> Tuple[bytes, bytes, Union[str, None]]:
+    """
+    A method to generate the serialized body of a /data get response, alongside its gzip compressed version. The bodies
+    are cached per generation of the data and normalized arguments, so that repeated requests between two data
+    processing runs do not filter the users nor compress the body again, and a change made by another replica is seen
+    by the next request. The users are filtered by the read model of the generation (see get_read_model_cached),
+    without querying the users table. The cached bodies also expire after PERIODIC_TIME seconds, and the bodies
+    filtered by age are cached per period (see get_age_period), like their ETag.
+    :param generation: the generation of the data (see get_data_generation).
+    :param is_image_exists: a boolean flag to filter the data returned according to the existence images in their data.
+    :param min_age: the minimum age of the data returned.
+    :param max_age: the maximum age of the data returned.
+    :param limit: the maximum number of users returned.
+    :param after: the user_id after which the users are returned.
+    :return: a tuple of three elements, the body in JSON format, the compressed body, and the cursor of the next page
+    (or None).
+    """
+    key = ('response', generation, get_age_period(min_age, max_age), is_image_exists, min_age, max_age, limit, after)
+    cached = data_cache.get(key)
+    if cached is not None:
+        return cached
+    conditions = generate_conditions_get(is_image_exists, min_age, max_age)
+    res_dict = get_read_model_cached(generation).select(after_user_id=after, limit=None if limit is None else limit + 1,
+                                                     **conditions)
+    next_cursor = None
+    if limit is not None and len(res_dict) > limit:
+        res_dict = dict(list(res_dict.items())[:limit])
+        next_cursor = encode_page_cursor(next(reversed(res_dict.keys())))
+    body = jsonify(res_dict).get_data()
+    ret = body, gzip.compress(body), next_cursor
+    data_cache.put(key, ret)
     return ret
 
 
+def get_data_get_filters(args: dict) -> str:
+    """
+    A method to get the label of a /data get request in DATA_GET_SECONDS, i.e. the combination of its arguments.
+    :param args: a dictionary containing the arguments passed to the get request.
+    :return: the names of the given arguments joined by '+', or 'none'.
+    """
+    return '+'.join(arg for arg in ['is_image_exists', 'min_age', 'max_age', 'limit', 'after', 'format']
+                    if arg in args) or 'none'
+
+
 def handle_data_get_request(args: dict) -> Response:
     """
     A method to handle /data get requests. It includes checking if the arguments are valid, construct the proper
-    conditions, and finally returns the response that meets the arguments conditions.
+    conditions, and finally returns the response that meets the arguments conditions. If a limit is given, only one page
+    of users (ordered by user_id) is returned, and the cursor of the next page is sent in the X-Next-Cursor header. If
+    format=ndjson is given (or NDJSON is the accepted type), the users are streamed one per line. Otherwise, the
+    response has an ETag derived from the generation of the data, a request whose If-None-Match matches it gets 304
+    (Not Modified) without reading the users, and the body is gzip compressed for the clients which accept it.
     :param args: a dictionary containing the arguments passed to the get request.
     :return: the proper response to the get request.
     """
@@ -90,23 +354,96 @@ def handle_data_get_request(args: dict) -> Response:
     max_age = args.get('max_age', None)
     try:
         is_image_exists, min_age, max_age = fix_values_data_get(is_image_exists, min_age, max_age)
+        limit, after = fix_values_page_get(args.get('limit', None), args.get('after', None))
     except:
-        return make_response(400)
-    conditions = generate_conditions_get(is_image_exists, min_age, max_age)
-    res_dict = get_db_all_users(db_info)
-    res_dict = {key: val for key, val in res_dict.items() if all(condition(val) for condition in conditions)}
-    res = make_response(jsonify(res_dict), 200)
+        return make_response("Invalid arguments", 400)
+    if args.get('format', None) == 'ndjson' or request.accept_mimetypes.best == NDJSON_MIMETYPE:
+        return generate_ndjson_response(generate_conditions_get(is_image_exists, min_age, max_age), limit, after,
+                                        get_data_get_filters(args))
+    use_gzip = request.accept_encodings['gzip'] > 0
+    generation = get_data_generation(db_info)
+    etag = generate_data_etag(generation, is_image_exists, min_age, max_age, limit, after) + \
+        ('-gzip' if use_gzip else '')
+    if request.if_none_match.contains(etag):
+        res = Response(status=304)
+    else:
+        body, gzip_body, next_cursor = generate_data_body(generation, is_image_exists, min_age, max_age, limit, after)
+        res = Response(gzip_body if use_gzip else body, 200, mimetype='application/json')
+        if use_gzip:
+            res.headers['Content-Encoding'] = 'gzip'
+        if next_cursor is not None:
+            res.headers['X-Next-Cursor'] = next_cursor
+    res.set_etag(etag)
+    res.vary.add('Accept-Encoding')
     return res
 
 
-def handle_data_post_request() -> Response:
+def run_data_processing(with_print: bool = False, full: bool = False,
+                        progress: Union[Callable[[int, int, int, int], None], None] = None,
+                        resync: str = RESYNC) -> Tuple[int, int]:
+    """
+    A method to run the whole data processing from the src bucket with the app's configuration. When the ingestion is
+    sharded between replicas (Ingestion_shards), only the shards claimed by this replica are processed, except for a
+    resync which processes all the files while the runs of the other replicas are held off (see process_resync_minio).
+    :param with_print: a boolean to indicate if the processing should print while processing.
+    :param full: a boolean to indicate that all the files should be processed regardless of the manifest.
+    :param progress: a function reporting the progress of the processing (see process_all_data_minio).
+    :param resync: the resync's mode, one of RESYNC_MODES (see process_all_data_minio).
+    :return: a tuple of two integers. The first is the successfully processed files, the other is for the total number
+    of csv files in the src.
+    """
+    if coordinator is not None and resync == 'off':
+        return process_shards_minio(db_info, get_minio_client(), coordinator, with_print, DB_BATCH_SIZE, full,
+                                    FETCH_CONCURRENCY, progress, OUTPUT_PARQUET, PARSE_PROCESSES, OUTPUT_LAYOUT,
+                                    QUARANTINE)
+    if coordinator is not None:
+        return process_resync_minio(db_info, get_minio_client(), coordinator, with_print, DB_BATCH_SIZE,
+                                    FETCH_CONCURRENCY, progress, OUTPUT_PARQUET, PARSE_PROCESSES, OUTPUT_LAYOUT,
+                                    QUARANTINE, resync)
+    return process_all_data_minio(db_info, get_minio_client(), with_print, DB_BATCH_SIZE, full, FETCH_CONCURRENCY,
+                                  progress, OUTPUT_PARQUET, PARSE_PROCESSES, OUTPUT_LAYOUT, quarantine=QUARANTINE,
+                                  resync=resync)
+
+
+ingestion_jobs = IngestionJobs(run_data_processing)
+
+
+def is_covered_by_job(job: dict, full: bool, resync: str) -> bool:
     """
-    A method to handle the /data post request. It is responsible for manually running the data processing from the src
-    to the output.
-    :return: a message showing how files were successfully processed.
+    A method to check if a data processing job does everything a new job with some options would do, i.e. it runs
+    the same resync, or a normal run is requested and the job processes at least the same files.
+    :param job: the state of the job.
+    :param full: a boolean to indicate that all the files should be processed regardless of the manifest.
+    :param resync: the resync's mode, one of RESYNC_MODES.
+    :return: a boolean value representing if the job covers the new one.
     """
-    success, all_files = process_all_data_minio(db_info, minio_client, True)
-    return make_response(f"Out of {all_files} files for the users, {success} were successfully processed.", 200)
+    job_resync = job['options'].get('resync', RESYNC)
+    job_full = job['options'].get('full', False) or job_resync != 'off'
+    return (resync == job_resync or resync == 'off') and (job_full or not full)
+
+
+def handle_data_post_request(args: dict) -> Response:
+    """
+    A method to handle the /data post request. It is responsible for manually triggering the data processing from the
+    src to the output. The processing runs in the background: the response is returned right away with the id of the
+    job, whose progress can be followed on /jobs/<job_id>. If a data processing job is already in flight (e.g. the
+    periodic one), that job is returned instead of starting a duplicate, unless it does not do what was requested
+    (e.g. a resync is requested while an incremental run is in flight): then the request is refused with 409
+    (Conflict), and it can be sent again once the in-flight job is finished. Only the files which changed since the
+    last run are processed, unless full=True is passed. With resync=merge (or resync=replace, which also deletes the
+    users whose files do not exist anymore), the database is rebuilt from all the files with a bulk load (see
+    resync_users_copy).
+    :param args: a dictionary containing the arguments passed to the post request.
+    :return: the state of the job in JSON format.
+    """
+    full = args.get('full', 'False') == 'True'
+    resync = args.get('resync', RESYNC)
+    if resync not in RESYNC_MODES:
+        return make_response("Invalid arguments", 400)
+    job, created = ingestion_jobs.submit(with_print=True, full=full, resync=resync)
+    res = make_response(jsonify(job), 202 if created or is_covered_by_job(job, full, resync) else 409)
+    res.headers['Location'] = f"/jobs/{job['id']}"
+    return res
 
 
 @app.route("/data", methods=['GET', 'POST'])
@@ -117,27 +454,132 @@ def handle_data_requests() -> Response:
     :return: the proper response depending on the type of the request.
     """
     if request.method == 'GET':
-        return handle_data_get_request(request.args.to_dict())
+        args = request.args.to_dict()
+        start = time.perf_counter()
+        res = handle_data_get_request(args)
+        if not res.is_streamed:
+            DATA_GET_SECONDS.observe(time.perf_counter() - start, filters=get_data_get_filters(args))
+        return res
     if request.method == 'POST':
-        return handle_data_post_request()
+        return handle_data_post_request(request.args.to_dict())
     else:
         return make_response("No such request is available", 404)
 
 
+@app.route("/output", methods=['GET', 'POST'])
+def handle_output_requests() -> Response:
+    """
+    A method for handling requests on /output, when the output is published in the 'delta' layout. A get request
+    streams the consolidated output (the base snapshot with the deltas applied) as a csv file, while a post request
+    writes it as output.csv in the processed bucket.
+    :return: the consolidated csv file, or the number of rows written in JSON format.
+    """
+    if OUTPUT_LAYOUT != 'delta':
+        return make_response("The output is not published in the delta layout, see output.csv", 404)
+    if request.method == 'POST':
+        return make_response(jsonify({'rows': consolidate_output_minio(get_minio_client())}), 200)
+
+    def generate_lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in itertools.chain([OUTPUT_HEADERS], iter_output_rows_minio(get_minio_client())):
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    return Response(generate_lines(), 200, mimetype='text/csv')
+
+
+@app.route("/rejects", methods=['GET'])
+def handle_rejects_request() -> Response:
+    """
+    A method for handling requests on /rejects. It returns the source files which were rejected as invalid, with their
+    etag and size when they were rejected, the reason of the rejection, and the name of their copy in quarantine (if
+    any). The rejected files are not processed again until they change.
+    :return: the rejected files ordered by name in JSON format.
+    """
+    rejects = [{'object_name': object_name, 'etag': etag, 'size': size, 'reason': reason,
+                'quarantine_object': quarantine_object, 'rejected_at': rejected_at.isoformat()}
+               for object_name, (etag, size, reason, quarantine_object, rejected_at) in
+               get_source_rejects(db_info).items()]
+    return make_response(jsonify(rejects), 200)
+
+
+@app.route("/jobs/<job_id>", methods=['GET'])
+def handle_jobs_request(job_id: str) -> Response:
+    """
+    A method for handling requests on /jobs/<job_id>. It returns the state of a data processing job: its status, the
+    number of files done out of the total, the successes and the errors.
+    :param job_id: the job's id.
+    :return: the state of the job in JSON format.
+    """
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        return make_response("No such job", 404)
+    return make_response(jsonify(job), 200)
+
+
+@app.route("/db/pool", methods=['GET'])
+def handle_db_pool_request() -> Response:
+    """
+    A method for handling requests on /db/pool. It returns the statistics of the postgres connection pool shared by the
+    requests and the periodic data processing.
+    :return: the pool statistics in JSON format.
+    """
+    return make_response(jsonify(get_db_pool_stats(db_info)), 200)
+
+
+@app.route("/data/cache", methods=['GET'])
+def handle_data_cache_request() -> Response:
+    """
+    A method for handling requests on /data/cache. It returns the statistics of the cache of the /data get responses.
+    :return: the cache statistics (and the current dataset version) in JSON format.
+    """
+    return make_response(jsonify({'dataset_version': get_dataset_version(), **data_cache.get_stats()}), 200)
+
+
+@app.route("/metrics", methods=['GET'])
+def handle_metrics_request() -> Response:
+    """
+    A method for handling requests on /metrics. It returns the timing histograms and counters of the data processing
+    stages and of the /data get requests, alongside the statistics of the connection pool and the cache, in the
+    Prometheus text format. The pool statistics are only read if the pool exists, so the metrics never open
+    connections and are still served when the database is down.
+    :return: the metrics as plain text.
+    """
+    for stat, value in data_cache.get_stats().items():
+        DATA_CACHE.set(value, stat=stat)
+    for stat, value in get_db_pool_stats(db_info, create=False).items():
+        DB_POOL.set(value, stat=stat)
+    return Response(render_metrics(), 200, mimetype='text/plain; version=0.0.4')
+
+
 def periodic_update() -> None:
     """
     A method for running periodic data processing in the background.
     :return: None.
     """
     while True:
-        process_all_data_minio(db_info, minio_client)
+        ingestion_jobs.run_and_wait()
         time.sleep(PERIODIC_TIME)
 
 
+APP_STARTUP_SECONDS.set(time.perf_counter() - APP_IMPORT_STARTED, phase='import')
+
 if __name__ == '__main__':
-    create_bucket_minio(minio_client, SRC_DATA_BUCKET)
-    create_bucket_minio(minio_client, PROCESSED_DATA_BUCKET)
+    create_bucket_minio(get_minio_client(), SRC_DATA_BUCKET)
+    create_bucket_minio(get_minio_client(), PROCESSED_DATA_BUCKET)
     init_db(db_info)
-    periodic_process = Thread(target=periodic_update)
-    periodic_process.start()
+    if coordinator is not None:
+        coordinator.start()
+    if INGESTION_MODE == 'events':
+        events_ingestion = BucketEventsIngestion(db_info, get_minio_client(), ingestion_jobs.run_and_wait,
+                                                 reconcile_time=PERIODIC_TIME, parquet=OUTPUT_PARQUET,
+                                                 layout=OUTPUT_LAYOUT, quarantine=QUARANTINE,
+                                                 lock=ingestion_jobs.run_lock)
+        events_ingestion.start()
+    else:
+        periodic_process = Thread(target=periodic_update)
+        periodic_process.start()
+    APP_STARTUP_SECONDS.set(time.perf_counter() - APP_IMPORT_STARTED, phase='ready')
     app.run(host=IP, port=PORT)
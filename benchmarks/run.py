@@ -0,0 +1,301 @@
+"""
+The benchmark suite of the data processing and the /data endpoint. It generates synthetic sources, times
+process_all_data_minio, process_all_data and GET /data for each number of users, and writes the results as JSON so
+that they can be compared across commits, e.g.
+
+    python -m benchmarks.run --users 1000,10000 --output bench.json
+    python -m benchmarks.run --users 1000,10000 --baseline bench.json
+
+MinIO is replaced by an in-memory stand-in (FakeMinio of tests/fakes.py, shared with the unit tests), and so is
+postgres (FakeDB) unless --postgres is given, in which case the database described by the DB_host, DB_port, DB_name,
+DB_user and DB_password environment variables is used (its users, source_objects, output_changes and source_rejects
+tables are emptied).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from contextlib import ExitStack
+from typing import Callable, List, Union
+from unittest import mock
+
+import data_processing.main as main
+from data_processing import postgres_handler
+from data_processing.cache import bump_dataset_version
+from tests.fakes import FakeDB, FakeMinio, patch_db
+from benchmarks.sources import generate_sources, put_sources_minio, write_sources_dir
+
+USERS = [1000, 10000, 100000]
+QUERY_REQUESTS = 20
+TOLERANCE = 0.2
+QUERIES = {
+    'data_get_all': '/data',
+    'data_get_filtered': '/data?is_image_exists=True&min_age=20&max_age=60',
+    'data_get_page': '/data?limit=100',
+    'data_get_ndjson': '/data?format=ndjson',
+}
+
+
+def get_db_info_postgres() -> dict:
+    """
+    A method to get the information of the postgres database used by the benchmarks from the environment.
+    :return: a dictionary containing the database info.
+    """
+    return {
+        'db_name': os.getenv('DB_name', 'internship'),
+        'db_user': os.getenv('DB_user', 'postgres'),
+        'db_password': os.getenv('DB_password', 'postgres'),
+        'db_host': os.getenv('DB_host', 'localhost'),
+        'db_port': int(os.getenv('DB_port', 5432)),
+    }
+
+
+class Database:
+    """
+    The database used by a benchmark: either a FakeDB replacing the postgres functions of the given modules, or the
+    postgres database itself.
+    """
+
+    def __init__(self, use_postgres: bool, modules: list):
+        """
+        :param use_postgres: a boolean to indicate if postgres is used instead of FakeDB.
+        :param modules: the modules whose postgres functions are replaced by FakeDB.
+        """
+        self.use_postgres = use_postgres
+        self.modules = modules
+        self.db_info = get_db_info_postgres() if use_postgres else {}
+        self._stack = ExitStack()
+
+    def reset(self) -> None:
+        """
+        A method to empty the database.
+        :return: None.
+        """
+        self._stack.close()
+        if self.use_postgres:
+            postgres_handler.init_db(self.db_info)
+            postgres_handler.run_db_command(self.db_info,
+                                            "TRUNCATE users, source_objects, output_changes, source_rejects;")
+        else:
+            self._stack.enter_context(patch_db(FakeDB(), *self.modules))
+        bump_dataset_version()
+
+    def close(self) -> None:
+        self._stack.close()
+
+
+def summarize(scenario: str, users: int, seconds: List[float], items: int) -> dict:
+    """
+    A method to summarize the timings of a scenario.
+    :param scenario: the scenario's name.
+    :param users: the number of generated users.
+    :param seconds: the durations of the scenario's runs.
+    :param items: the number of items (files or requests) handled by one run.
+    :return: a dictionary of the results.
+    """
+    median = statistics.median(seconds)
+    return {'scenario': scenario, 'users': users, 'runs': len(seconds), 'min_seconds': min(seconds),
+            'median_seconds': median, 'max_seconds': max(seconds),
+            'items_per_second': items / median if median > 0 else None}
+
+
+def time_runs(run: Callable[[], object], repeat: int, setup: Union[Callable[[], object], None] = None) -> List[float]:
+    """
+    A method to time a function several times.
+    :param run: the timed function.
+    :param repeat: the number of runs.
+    :param setup: a function called before each run, which is not timed.
+    :return: the durations of the runs in seconds.
+    """
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def bench_minio(users: int, args: argparse.Namespace) -> List[dict]:
+    """
+    A method to time process_all_data_minio on all the sources (full), again when nothing changed (unchanged), and on
+    all the sources loaded with COPY into an empty database (resync).
+    :param users: the number of generated users.
+    :param args: the command line arguments.
+    :return: the results of the scenarios.
+    """
+    minio_client = FakeMinio(latency=args.latency)
+    put_sources_minio(minio_client, generate_sources(users, args.invalid_ratio, args.image_ratio, args.seed,
+                                                     args.users_per_file))
+    database = Database(args.postgres, [main])
+    try:
+        def run(resync: str = 'off'):
+            main.process_all_data_minio(database.db_info, minio_client, concurrency=args.concurrency,
+                                        processes=args.processes, resync=resync)
+        full = time_runs(run, args.repeat, setup=database.reset)
+        unchanged = time_runs(run, args.repeat)
+        resync = time_runs(lambda: run('replace'), args.repeat, setup=database.reset)
+    finally:
+        database.close()
+    return [summarize('minio_full', users, full, users), summarize('minio_unchanged', users, unchanged, users),
+            summarize('minio_resync', users, resync, users)]
+
+
+def bench_local(users: int, args: argparse.Namespace) -> List[dict]:
+    """
+    A method to time process_all_data on all the sources in a local directory.
+    :param users: the number of generated users.
+    :param args: the command line arguments.
+    :return: the results of the scenario.
+    """
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as processed:
+        src += '/'
+        write_sources_dir(src, generate_sources(users, args.invalid_ratio, args.image_ratio, args.seed,
+                                                args.users_per_file))
+        with mock.patch.object(main, 'SRC_DATA_PATH', src), \
+                mock.patch.object(main, 'OUTPUT_FILE_PATH', os.path.join(processed, main.OUTPUT_FILE_NAME)):
+            seconds = time_runs(main.process_all_data, args.repeat)
+    return [summarize('local_full', users, seconds, users)]
+
+
+def bench_data_get(users: int, args: argparse.Namespace) -> List[dict]:
+    """
+    A method to time the GET /data requests in QUERIES, with an empty cache (cold) and a filled one (warm).
+    :param users: the number of generated users.
+    :param args: the command line arguments.
+    :return: the results of the scenarios, or a skipped entry if the app could not be imported.
+    """
+    try:
+        import app
+    except Exception as e:
+        return [{'scenario': 'data_get', 'users': users, 'skipped': f'The app could not be imported: {e!r}'}]
+    minio_client = FakeMinio()
+    put_sources_minio(minio_client, generate_sources(users, args.invalid_ratio, args.image_ratio, args.seed,
+                                                     args.users_per_file))
+    database = Database(args.postgres, [main, app])
+    results = []
+    try:
+        database.reset()
+        with mock.patch.object(app, 'db_info', database.db_info):
+            main.process_all_data_minio(database.db_info, minio_client, concurrency=args.concurrency)
+            client = app.app.test_client()
+            for scenario, url in QUERIES.items():
+                def run():
+                    response = client.get(url)
+                    assert response.status_code == 200, response.status_code
+                    response.get_data()
+                cold = time_runs(run, args.requests, setup=app.clear_data_caches)
+                warm = time_runs(run, args.requests)
+                results.append(summarize(scenario + '_cold', users, cold, 1))
+                results.append(summarize(scenario + '_warm', users, warm, 1))
+    finally:
+        database.close()
+    return results
+
+
+def get_git_commit() -> Union[str, None]:
+    """
+    A method to get the commit of the benchmarked code.
+    :return: the commit's hash, or None if it is not known.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare_results(results: List[dict], baseline: List[dict], tolerance: float = TOLERANCE) -> List[str]:
+    """
+    A method to compare the results of the benchmarks with the results of a previous commit.
+    :param results: the current results.
+    :param baseline: the previous results.
+    :param tolerance: the share by which the median time can grow before it counts as a regression.
+    :return: a list of messages describing the regressions.
+    """
+    previous = {(result['scenario'], result['users']): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get((result['scenario'], result['users']), None)
+        if old is None or not old['median_seconds']:
+            continue
+        ratio = result['median_seconds'] / old['median_seconds']
+        if ratio > 1 + tolerance:
+            regressions.append(f"{result['scenario']} ({result['users']} users): {old['median_seconds']:.6f}s -> "
+                               f"{result['median_seconds']:.6f}s (x{ratio:.2f})")
+    return regressions
+
+
+SCENARIOS = {'minio': bench_minio, 'local': bench_local, 'data_get': bench_data_get}
+
+
+def parse_args(argv: Union[List[str], None] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmarks of the data processing and the /data endpoint.')
+    parser.add_argument('--users', default=','.join(map(str, USERS)),
+                        help='comma separated numbers of generated users.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated scenarios to run.')
+    parser.add_argument('--repeat', type=int, default=1, help='the number of runs of each ingestion scenario.')
+    parser.add_argument('--requests', type=int, default=QUERY_REQUESTS,
+                        help='the number of runs of each GET /data scenario.')
+    parser.add_argument('--invalid-ratio', type=float, default=0.05, help='the share of invalid csv files.')
+    parser.add_argument('--image-ratio', type=float, default=0.8, help='the share of users with an image.')
+    parser.add_argument('--users-per-file', type=int, default=1,
+                        help='the number of users in each generated csv file (batch files if more than one).')
+    parser.add_argument('--seed', type=int, default=0, help='the seed of the generated sources.')
+    parser.add_argument('--latency', type=float, default=0.0, help='the latency of each MinIO request in seconds.')
+    parser.add_argument('--concurrency', type=int, default=main.FETCH_CONCURRENCY,
+                        help='the number of files fetched at the same time.')
+    parser.add_argument('--processes', type=int, default=main.PARSE_PROCESSES,
+                        help='the number of worker processes parsing the files (0 to parse them in-process).')
+    parser.add_argument('--postgres', action='store_true', help='use postgres instead of the in-memory database.')
+    parser.add_argument('--output', default=None, help='the path of the JSON results (stdout if not given).')
+    parser.add_argument('--baseline', default=None, help='the path of previous JSON results to compare with.')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='the allowed growth of the median times compared with the baseline.')
+    return parser.parse_args(argv)
+
+
+def run_benchmarks(args: argparse.Namespace) -> dict:
+    """
+    A method to run the chosen scenarios for each number of users.
+    :param args: the command line arguments.
+    :return: a dictionary of the environment's information ('meta') and the scenarios' results ('results').
+    """
+    warnings.simplefilter('ignore')
+    results = []
+    for users in [int(users) for users in args.users.split(',')]:
+        for scenario in args.scenarios.split(','):
+            results.extend(SCENARIOS[scenario](users, args))
+    meta = {'commit': get_git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'options': vars(args)}
+    return {'meta': meta, 'results': results}
+
+
+def main_cli(argv: Union[List[str], None] = None) -> int:
+    args = parse_args(argv)
+    report = run_benchmarks(args)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_results([result for result in report['results'] if 'skipped' not in result],
+                                      [result for result in baseline if 'skipped' not in result], args.tolerance)
+        for regression in regressions:
+            print('Regression:', regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,89 @@
+import io
+import os
+import random
+from typing import Iterator, List, Tuple
+
+from data_processing.main import ORG_HEADERS, BATCH_HEADERS, IMG_EXTENSION, SRC_DATA_BUCKET, PROCESSED_DATA_BUCKET
+
+MIN_BIRTHTS = -631152000000
+MAX_BIRTHTS = 1262304000000
+INVALID_KINDS = ['headers', 'empty_value', 'birthts', 'rows']
+IMG_CONTENTS = b'\x89PNG\r\n\x1a\n'
+
+
+def generate_sources(users: int, invalid_ratio: float = 0.05, image_ratio: float = 0.8, seed: int = 0,
+                     users_per_file: int = 1) -> Iterator[Tuple[str, bytes]]:
+    """
+    A method to generate the source files of synthetic users, i.e. a <user_id>.csv file per user (or batch csv files
+    holding users_per_file users each), and a <user_id>.png image for a share of them. The same arguments always
+    generate the same files.
+    :param users: the number of users.
+    :param invalid_ratio: the share of the csv files (or of the rows of the batch files) which are not valid (wrong
+    headers, empty values, a birthts which is not an integer, or extra rows).
+    :param image_ratio: the share of the users who have an image.
+    :param seed: the seed of the random generator.
+    :param users_per_file: the number of users in each csv file. With more than one user per file, the files are batch
+    files named batch_<index>.csv whose headers are BATCH_HEADERS.
+    :return: an iterator of tuples of two elements, the file's name and its contents.
+    """
+    rnd = random.Random(seed)
+    width = len(str(users))
+    batch = []
+    for i in range(users):
+        user_id = str(i).zfill(width)
+        values = [f'first{i}', f'last{i}', str(rnd.randint(MIN_BIRTHTS, MAX_BIRTHTS))]
+        rows = [ORG_HEADERS, values]
+        if rnd.random() < invalid_ratio:
+            kind = rnd.choice(INVALID_KINDS)
+            if kind == 'headers' and users_per_file == 1:
+                rows[0] = ['name'] + ORG_HEADERS[1:]
+            elif kind == 'empty_value':
+                rows[1] = [''] + values[1:]
+            elif kind == 'birthts':
+                rows[1] = values[:2] + [values[2] + 'x']
+            else:
+                rows.append(values)
+        if users_per_file == 1:
+            yield user_id + '.csv', format_rows(rows)
+        else:
+            batch.extend([user_id] + row for row in rows[1:])
+        if rnd.random() < image_ratio:
+            yield user_id + IMG_EXTENSION, IMG_CONTENTS
+        if users_per_file > 1 and ((i + 1) % users_per_file == 0 or i + 1 == users):
+            yield f'batch_{i // users_per_file}.csv', format_rows([BATCH_HEADERS] + batch)
+            batch = []
+
+
+def format_rows(rows: List[List[str]]) -> bytes:
+    """
+    A method to format the rows of a csv file.
+    :param rows: the rows including the headers.
+    :return: the contents of the file.
+    """
+    return ('\n'.join(', '.join(row) for row in rows) + '\n').encode()
+
+
+def put_sources_minio(minio_client, sources: Iterator[Tuple[str, bytes]]) -> None:
+    """
+    A method to upload generated source files to the src bucket, creating the src and processed buckets if needed.
+    :param minio_client: the MinIO client (or its stand-in).
+    :param sources: the files' names and contents (see generate_sources).
+    :return: None.
+    """
+    for bucket in [SRC_DATA_BUCKET, PROCESSED_DATA_BUCKET]:
+        if not minio_client.bucket_exists(bucket):
+            minio_client.make_bucket(bucket)
+    for name, contents in sources:
+        minio_client.put_object(SRC_DATA_BUCKET, name, io.BytesIO(contents), len(contents))
+
+
+def write_sources_dir(dir_path: str, sources: Iterator[Tuple[str, bytes]]) -> None:
+    """
+    A method to write generated source files to a local directory.
+    :param dir_path: the directory path.
+    :param sources: the files' names and contents (see generate_sources).
+    :return: None.
+    """
+    for name, contents in sources:
+        with open(os.path.join(dir_path, name), 'wb') as f:
+            f.write(contents)
@@ -0,0 +1,100 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Hashable, Union
+
+DATA_CACHE_MAX_SIZE = 256
+
+_dataset_generation = 0
+_dataset_generation_lock = threading.Lock()
+_process_token = uuid.uuid4().hex[:8]
+
+
+def get_dataset_version() -> str:
+    """
+    A method to get the current version of the users' data. The version changes every time a data processing run
+    changes the data (see bump_dataset_version), and it is unique across restarts of the app.
+    :return: the version as a string.
+    """
+    return f'{_process_token}-{_dataset_generation}'
+
+
+def bump_dataset_version() -> str:
+    """
+    A method to mark that the users' data changed, so that everything cached for the previous version is not used
+    anymore.
+    :return: the new version as a string.
+    """
+    global _dataset_generation
+    with _dataset_generation_lock:
+        _dataset_generation += 1
+    return get_dataset_version()
+
+
+class LRUCache:
+    """
+    A thread-safe in-memory cache with a bounded number of entries. When it is full, the least recently used entry is
+    evicted. Entries can optionally expire after ttl seconds.
+    """
+
+    def __init__(self, max_size: int = DATA_CACHE_MAX_SIZE, ttl: Union[float, None] = None):
+        """
+        :param max_size: the maximum number of entries.
+        :param ttl: the number of seconds after which an entry expires, or None if the entries do not expire.
+        """
+        assert max_size > 0
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key: Hashable, default=None):
+        """
+        A method to get the value of a key and mark it as the most recently used.
+        :param key: the key.
+        :param default: the value returned if the key is not cached (or expired).
+        :return: the cached value, or default.
+        """
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value) -> None:
+        """
+        A method to cache the value of a key, evicting the least recently used entries if the cache is full.
+        :param key: the key.
+        :param value: the value.
+        :return: None.
+        """
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def clear(self) -> None:
+        """
+        A method to remove all the entries.
+        :return: None.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        """
+        A method to get the size of the cache and its counters.
+        :return: a dictionary containing the size, the maximum size, and the hits, misses and evictions counters.
+        """
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size, **self._stats}
@@ -0,0 +1,341 @@
+from __future__ import annotations
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+import warnings
+import zlib
+from typing import TYPE_CHECKING, Callable, List, Tuple, Union
+from data_processing.main import *
+from data_processing.cache import bump_dataset_version
+from data_processing.postgres_handler import acquire_lease, get_leases, release_leases, get_data_generation
+
+if TYPE_CHECKING:
+    from minio import Minio
+
+INGESTION_SHARDS = 16
+LEASE_TTL = 60.0
+MEMBER_LEASE_PREFIX = 'member:'
+SHARD_LEASE_PREFIX = 'shard:'
+PUBLISHER_LEASE = 'publisher'
+RUN_LEASE_PREFIX = 'run:'
+RESYNC_LEASE = 'resync'
+RESYNC_WAIT_POLL = 1.0
+PUBLISHER_WAIT_POLL = 1.0
+
+
+def get_replica_id() -> str:
+    """
+    A method to generate a unique id for a replica of the app.
+    :return: the id, made of the host name, the process id and a random suffix.
+    """
+    return f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+
+class IngestionCoordinator:
+    """
+    The coordination of the data processing between the replicas of the app, through leases in the postgres database
+    (see acquire_lease). The source files are split into shard_count shards by the hash of their names (see
+    get_source_shard), and each replica claims a fair share of the shards, i.e. the number of shards divided by the
+    number of live replicas, so the replicas process disjoint sets of files. A replica is live while it renews its
+    member lease: a heartbeat thread renews the member lease and the held shards every lease_ttl / 3 seconds, so the
+    shards of a replica which died expire after lease_ttl seconds and are claimed by the others on their next run. The
+    heartbeat also syncs the dataset version with the changes of the other replicas (see sync_dataset_version). A
+    replica holds a run lease while it runs, and the output is published for all the replicas by the last one to finish
+    its run, while it holds the publisher lease. A resync processes all the files, so it holds the exclusive resync
+    lease: the runs are skipped while the resync lease is held, and a resync waits until the runs of the other replicas
+    are finished.
+    """
+
+    def __init__(self, db_info: dict, shard_count: int = INGESTION_SHARDS, lease_ttl: float = LEASE_TTL,
+                 replica_id: Union[str, None] = None):
+        """
+        :param db_info: a dictionary containing the postgres database info.
+        :param shard_count: the number of shards of the source files.
+        :param lease_ttl: the number of seconds a lease is held without being renewed.
+        :param replica_id: the id of this replica (a unique one is generated if not given).
+        """
+        assert shard_count > 0 and lease_ttl > 0
+        self.db_info = db_info
+        self.shard_count = shard_count
+        self.lease_ttl = lease_ttl
+        self.replica_id = replica_id or get_replica_id()
+        self.shards = []
+        self._held_leases = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def get_shard_order(self) -> List[int]:
+        """
+        A method to get the order in which this replica tries to claim the shards. Every replica has its own order (by
+        the hash of the replica's id and the shard), so the replicas do not all compete for the same shards first.
+        :return: the shards in order.
+        """
+        return sorted(range(self.shard_count), key=lambda shard: zlib.crc32(f'{self.replica_id}:{shard}'.encode()))
+
+    def renew(self) -> List[int]:
+        """
+        A method to renew the member lease of this replica, its run or resync lease (if any) and the leases of its
+        shards. The shards whose leases were lost (e.g. the replica was paused longer than lease_ttl) are dropped.
+        :return: the shards held by this replica.
+        """
+        acquire_lease(self.db_info, MEMBER_LEASE_PREFIX + self.replica_id, self.replica_id, self.lease_ttl)
+        with self._lock:
+            for name in self._held_leases:
+                acquire_lease(self.db_info, name, self.replica_id, self.lease_ttl)
+            self.shards = [shard for shard in self.shards if
+                           acquire_lease(self.db_info, f'{SHARD_LEASE_PREFIX}{shard}', self.replica_id, self.lease_ttl)]
+            return list(self.shards)
+
+    def claim_shards(self) -> List[int]:
+        """
+        A method to rebalance the shards before a run: the replica renews its leases, releases the shards beyond its
+        fair share (so a replica which joined gets some), and claims the free or expired shards up to its fair share.
+        :return: the shards held by this replica, sorted.
+        """
+        self.renew()
+        members = get_leases(self.db_info, MEMBER_LEASE_PREFIX)
+        share = math.ceil(self.shard_count / max(1, len(members)))
+        with self._lock:
+            if len(self.shards) > share:
+                release_leases(self.db_info, self.replica_id,
+                               [f'{SHARD_LEASE_PREFIX}{shard}' for shard in self.shards[share:]])
+                self.shards = self.shards[:share]
+            held = get_leases(self.db_info, SHARD_LEASE_PREFIX)
+            for shard in self.get_shard_order():
+                if len(self.shards) >= share:
+                    break
+                name = f'{SHARD_LEASE_PREFIX}{shard}'
+                if name not in held and acquire_lease(self.db_info, name, self.replica_id, self.lease_ttl):
+                    self.shards.append(shard)
+            return sorted(self.shards)
+
+    def hold_lease(self, name: str) -> bool:
+        """
+        A method to acquire a lease which is then renewed with the other leases of this replica until release_lease is
+        called.
+        :param name: the lease's name.
+        :return: a boolean representing if the lease was acquired.
+        """
+        if not acquire_lease(self.db_info, name, self.replica_id, self.lease_ttl):
+            return False
+        with self._lock:
+            self._held_leases.add(name)
+        return True
+
+    def release_lease(self, name: str) -> None:
+        """
+        A method to release a lease acquired with hold_lease.
+        :param name: the lease's name.
+        :return: None.
+        """
+        with self._lock:
+            self._held_leases.discard(name)
+        release_leases(self.db_info, self.replica_id, [name])
+
+    def wait_lease(self, name: str, poll: float) -> None:
+        """
+        A method to wait until a lease is acquired with hold_lease, e.g. while another replica holds it.
+        :param name: the lease's name.
+        :param poll: the number of seconds between two attempts.
+        :return: None.
+        """
+        while not self.hold_lease(name):
+            time.sleep(poll)
+
+    def is_running_elsewhere(self) -> bool:
+        """
+        A method to check if another replica holds a run lease, i.e. it has not finished its run.
+        :return: a boolean representing if another replica is running.
+        """
+        return any(holder != self.replica_id for holder in get_leases(self.db_info, RUN_LEASE_PREFIX).values())
+
+    def begin_run(self) -> bool:
+        """
+        A method to mark the start of a run of this replica with its run lease, unless another replica holds the resync
+        lease. The run lease is taken before checking the resync lease, so a resync always sees the runs which started.
+        :return: a boolean representing if the run can start. If it is True, end_run must be called after the run.
+        """
+        self.hold_lease(RUN_LEASE_PREFIX + self.replica_id)
+        if get_leases(self.db_info, RESYNC_LEASE).get(RESYNC_LEASE, self.replica_id) != self.replica_id:
+            self.end_run()
+            return False
+        return True
+
+    def end_run(self) -> None:
+        """
+        A method to mark the end of a run of this replica.
+        :return: None.
+        """
+        self.release_lease(RUN_LEASE_PREFIX + self.replica_id)
+
+    def begin_publish(self, poll: float = PUBLISHER_WAIT_POLL) -> bool:
+        """
+        A method to acquire the publisher lease after a run (waiting while another replica publishes), unless another
+        replica has not finished its run: then that replica publishes the output once it is done, with the changes of
+        this one. It must be called after end_run, so the last two replicas to finish do not wait for each other.
+        :param poll: the number of seconds between two attempts to acquire the publisher lease.
+        :return: a boolean representing if this replica publishes the output. If it is True, end_publish must be called
+        after the output is published.
+        """
+        self.wait_lease(PUBLISHER_LEASE, poll)
+        if self.is_running_elsewhere():
+            self.end_publish()
+            return False
+        return True
+
+    def end_publish(self) -> None:
+        """
+        A method to release the publisher lease.
+        :return: None.
+        """
+        self.release_lease(PUBLISHER_LEASE)
+
+    def begin_resync(self, poll: float = RESYNC_WAIT_POLL) -> bool:
+        """
+        A method to acquire the resync lease, then wait until the runs of the other replicas are finished (the new runs
+        are skipped meanwhile, see begin_run), and until the publisher lease is acquired, since the resync publishes
+        the output itself.
+        :param poll: the number of seconds between two checks of the other replicas' runs and publications.
+        :return: a boolean representing if the resync can start, i.e. no other replica holds the resync lease. If it is
+        True, end_resync must be called after the resync.
+        """
+        if not self.hold_lease(RESYNC_LEASE):
+            return False
+        while self.is_running_elsewhere():
+            time.sleep(poll)
+        self.wait_lease(PUBLISHER_LEASE, poll)
+        return True
+
+    def end_resync(self) -> None:
+        """
+        A method to release the resync and publisher leases, so the replicas' runs start again.
+        :return: None.
+        """
+        self.release_lease(PUBLISHER_LEASE)
+        self.release_lease(RESYNC_LEASE)
+
+    def heartbeat(self) -> None:
+        """
+        A method for renewing the leases of this replica, and syncing the dataset version with the changes of the other
+        replicas (see sync_dataset_version), every lease_ttl / 3 seconds until stop is called.
+        :return: None.
+        """
+        while not self._stopped.wait(self.lease_ttl / 3):
+            try:
+                self.renew()
+                sync_dataset_version(self.db_info)
+            except Exception as e:
+                warnings.warn(f'The leases of the replica {self.replica_id} could not be renewed: {e!r}')
+
+    def start(self) -> None:
+        """
+        A method to start the heartbeat thread in the background.
+        :return: None.
+        """
+        threading.Thread(target=self.heartbeat, daemon=True).start()
+
+    def stop(self) -> None:
+        """
+        A method to stop the heartbeat and release all the leases of this replica, so the other replicas can claim its
+        shards right away.
+        :return: None.
+        """
+        self._stopped.set()
+        with self._lock:
+            names = [f'{SHARD_LEASE_PREFIX}{shard}' for shard in self.shards] + list(self._held_leases) + \
+                    [MEMBER_LEASE_PREFIX + self.replica_id]
+            self.shards = []
+            self._held_leases = set()
+        release_leases(self.db_info, self.replica_id, names)
+
+
+_seen_generation = None
+
+
+def sync_dataset_version(db_info: dict) -> None:
+    """
+    A method to bump the dataset version (see bump_dataset_version) if the data changed since the last call, possibly
+    by another replica, so the cached responses of this replica are not used anymore.
+    :param db_info: a dictionary containing the postgres database info.
+    :return: None.
+    """
+    global _seen_generation
+    generation = get_data_generation(db_info)
+    if generation != _seen_generation:
+        _seen_generation = generation
+        bump_dataset_version()
+
+
+def process_shards_minio(db_info: dict, minio_client: Minio, coordinator: IngestionCoordinator,
+                         with_print: bool = False, batch_size: int = DB_BATCH_SIZE, full: bool = False,
+                         concurrency: int = FETCH_CONCURRENCY,
+                         progress: Union[Callable[[int, int, int, int], None], None] = None,
+                         parquet: str = OUTPUT_PARQUET, processes: int = PARSE_PROCESSES,
+                         layout: str = OUTPUT_LAYOUT, quarantine: str = QUARANTINE) -> Tuple[int, int]:
+    """
+    A method for running the data processing of one replica of the app: it claims its shards (see
+    IngestionCoordinator.claim_shards) and processes their files with process_all_data_minio. Then, if no other replica
+    is still running, it holds the publisher lease (see IngestionCoordinator.begin_publish) and publishes the output if
+    any replica changed it (or if it was never published), and the dataset version is synced with the changes of the
+    other replicas. The run is skipped while another replica runs a
+    resync (see IngestionCoordinator.begin_run). The other parameters are the ones of process_all_data_minio.
+    :param db_info: a dictionary containing the postgres database info.
+    :param minio_client: the MinIO client which handles the read / write operations.
+    :param coordinator: the coordinator of this replica.
+    :return: a tuple of two integers. The first is the successfully processed files, the other is for the total number
+    of csv files in the shards of this replica (both are 0 if the run was skipped).
+    """
+    if not coordinator.begin_run():
+        if with_print:
+            print("The data processing was skipped, since another replica is running a resync.")
+        return 0, 0
+    try:
+        shards = coordinator.claim_shards()
+        result = process_all_data_minio(db_info, minio_client, with_print, batch_size, full, concurrency, progress,
+                                        parquet, processes, layout, shards, coordinator.shard_count, False, quarantine)
+    finally:
+        coordinator.end_run()
+    if coordinator.begin_publish():
+        try:
+            output_name = OUTPUT_DELTA_MANIFEST_NAME if layout == 'delta' else OUTPUT_FILE_NAME
+            if get_output_changes_version(db_info) > 0 or \
+                    get_object_info_minio(minio_client, PROCESSED_DATA_BUCKET, output_name) is None:
+                publish_output_minio(db_info, minio_client, parquet, layout)
+        finally:
+            coordinator.end_publish()
+    sync_dataset_version(db_info)
+    return result
+
+
+def process_resync_minio(db_info: dict, minio_client: Minio, coordinator: IngestionCoordinator,
+                         with_print: bool = False, batch_size: int = DB_BATCH_SIZE,
+                         concurrency: int = FETCH_CONCURRENCY,
+                         progress: Union[Callable[[int, int, int, int], None], None] = None,
+                         parquet: str = OUTPUT_PARQUET, processes: int = PARSE_PROCESSES,
+                         layout: str = OUTPUT_LAYOUT, quarantine: str = QUARANTINE, resync: str = 'merge') \
+        -> Tuple[int, int]:
+    """
+    A method for running a resync (see process_all_data_minio) of all the files when the data processing is shared
+    between replicas. It holds the resync lease (see IngestionCoordinator.begin_resync), so it waits until the other
+    replicas' runs and publications are finished and their next runs are skipped until it is done, then it publishes
+    the output itself.
+    The other parameters are the ones of process_all_data_minio.
+    :param db_info: a dictionary containing the postgres database info.
+    :param minio_client: the MinIO client which handles the read / write operations.
+    :param coordinator: the coordinator of this replica.
+    :return: a tuple of two integers. The first is the successfully processed files, the other is for the total number
+    of csv files in the src. An error is raised if another replica is running a resync.
+    """
+    assert resync != 'off'
+    if not coordinator.begin_resync():
+        raise RuntimeError("Another replica is running a resync.")
+    try:
+        result = process_all_data_minio(db_info, minio_client, with_print, batch_size, True, concurrency, progress,
+                                        parquet, processes, layout, quarantine=quarantine, resync=resync)
+    finally:
+        coordinator.end_resync()
+    sync_dataset_version(db_info)
+    return result
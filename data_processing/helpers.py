@@ -1,7 +1,17 @@
+import base64
+import codecs
 import csv
+import io
+import multiprocessing
 import os
+import pickle
+import threading
 import time
-from typing import List
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable, Iterator, List
 from datetime import timezone
 import datetime
 
@@ -102,3 +112,216 @@ def years_to_ms(years: float) -> float:
     """
     assert float(years) >= 0
     return 31556952000 * years
+
+
+def encode_page_cursor(last_key: str) -> str:
+    """
+    A method to encode the key of the last returned item of a page as an opaque cursor for the next page.
+    :param last_key: the key of the last item in the page.
+    :return: the cursor as a url-safe string.
+    """
+    return base64.urlsafe_b64encode(last_key.encode()).decode().rstrip('=')
+
+
+def decode_page_cursor(cursor: str) -> str:
+    """
+    A method to decode a cursor generated by encode_page_cursor back to the key of the last item of the previous page.
+    An error will occur if the cursor is not valid.
+    :param cursor: the cursor as a string.
+    :return: the key of the last item of the previous page.
+    """
+    if type(cursor) != str:
+        raise TypeError("The cursor should be of type string.")
+    return base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+
+
+def imap_bounded(func: Callable, items: Iterable, workers: int, max_pending: int = 0) -> Iterator:
+    """
+    A method to apply a function to some items concurrently in a pool of threads, while yielding the results in the
+    same order as the items. At most max_pending items are submitted ahead of the consumer, so the memory used does not
+    depend on the number of items. With one worker (or fewer) the function is applied in the caller's thread.
+    :param func: the function applied to each item.
+    :param items: the items.
+    :param workers: the number of threads.
+    :param max_pending: the maximum number of items being processed or waiting to be consumed (twice the number of
+    workers if not given).
+    :return: an iterator of the results in the items' order.
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+    max_pending = max_pending or 2 * workers
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+
+def get_process_pool(processes: int) -> ProcessPoolExecutor:
+    """
+    A method to get the shared pool of a given number of worker processes. The pool is created on the first call (its
+    workers are started with the spawn method, so they do not inherit the threads and locks of the caller), and kept
+    for the next calls, so the workers are only started once.
+    :param processes: the number of worker processes.
+    :return: the process pool.
+    """
+    with _process_pools_lock:
+        if processes not in _process_pools:
+            _process_pools[processes] = ProcessPoolExecutor(max_workers=processes,
+                                                            mp_context=multiprocessing.get_context('spawn'))
+        return _process_pools[processes]
+
+
+def discard_process_pool(processes: int) -> None:
+    """
+    A method to shut down the shared pool of a given number of worker processes (e.g. after it broke), so the next call
+    of get_process_pool creates a new one.
+    :param processes: the number of worker processes.
+    :return: None.
+    """
+    with _process_pools_lock:
+        executor = _process_pools.pop(processes, None)
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+
+def imap_processes(func: Callable, items: Iterable, processes: int, max_pending: int = 0) -> Iterator:
+    """
+    A method to apply a function to some items in the shared pool of worker processes (see get_process_pool), while
+    yielding the results in the same order as the items. At most max_pending items are submitted ahead of the consumer.
+    The function and the items must be picklable, and the function is checked to be before any item is submitted. With
+    no processes, if the function cannot be pickled, or if the pool cannot be started or breaks (e.g. a worker is
+    killed), the function is applied in the caller's process instead, so the results are the same in every case. An
+    error raised by the function itself is raised to the caller.
+    :param func: the function applied to each item, defined at the top level of a module.
+    :param items: the items.
+    :param processes: the number of worker processes.
+    :param max_pending: the maximum number of items being processed or waiting to be consumed (twice the number of
+    processes if not given).
+    :return: an iterator of the results in the items' order.
+    """
+    if processes <= 0:
+        yield from map(func, items)
+        return
+    max_pending = max_pending or 2 * processes
+    try:
+        executor = get_process_pool(processes)
+    except (OSError, ValueError, NotImplementedError) as e:
+        warnings.warn(f'The process pool could not be started, the items are processed in-process: {e}')
+        yield from map(func, items)
+        return
+    if not is_picklable(func):
+        warnings.warn(f'The function {func!r} can not be pickled, the items are processed in-process.')
+        yield from map(func, items)
+        return
+    broken = False
+
+    def get_result(item, future):
+        nonlocal broken
+        if future is not None:
+            try:
+                return future.result()
+            except (BrokenProcessPool, pickle.PicklingError) as e:
+                if not broken:
+                    warnings.warn(f'The process pool failed, the items are processed in-process: {e!r}')
+                    broken = True
+                    if isinstance(e, BrokenProcessPool):
+                        discard_process_pool(processes)
+        return func(item)
+
+    pending = deque()
+    for item in items:
+        future = None
+        if not broken:
+            try:
+                future = executor.submit(func, item)
+            except (BrokenProcessPool, RuntimeError):
+                broken = True
+                discard_process_pool(processes)
+        pending.append((item, future))
+        if len(pending) >= max_pending:
+            yield get_result(*pending.popleft())
+    while pending:
+        yield get_result(*pending.popleft())
+
+
+def is_picklable(value) -> bool:
+    """
+    A helper method to check if a value can be sent to a worker process, i.e. pickled.
+    :param value: the value, e.g. a function.
+    :return: a boolean value representing if the value can be pickled.
+    """
+    try:
+        pickle.dumps(value)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+    return True
+
+
+def iter_csv_rows_stripped(lines: Iterable[str]) -> Iterator[List[str]]:
+    """
+    A method to parse csv lines into rows whose items are stripped of their surrounding spaces. The empty rows are
+    skipped.
+    :param lines: the lines, keeping their line endings (see iter_decoded_lines).
+    :return: an iterator of the rows.
+    """
+    for row in csv.reader(lines):
+        if row:
+            yield [item.strip() for item in row]
+
+
+def write_csv_rows(file_object, rows: Iterable[list], flush_rows: int = 1000) -> int:
+    """
+    A method to write rows in csv format (utf-8 encoded) to a binary file object. The rows are formatted in an in-memory
+    buffer which is written to the file every flush_rows rows.
+    :param file_object: the binary file object, e.g. a temporary file or a BytesIO.
+    :param rows: the rows to write. Each row is a list itself of the row items.
+    :param flush_rows: the number of rows formatted before writing them to the file.
+    :return: the number of rows written.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % flush_rows == 0:
+            file_object.write(buffer.getvalue().encode())
+            buffer.seek(0)
+            buffer.truncate()
+    file_object.write(buffer.getvalue().encode())
+    return count
+
+
+def iter_decoded_lines(chunks: Iterable[bytes], encoding: str = 'utf-8-sig') -> Iterator[str]:
+    """
+    A method to decode a stream of byte chunks into lines of text through an incremental decoder, so a character or a
+    line split between two chunks is decoded correctly, and only one chunk and one line are kept in memory. The lines
+    keep their line endings, as expected by csv.reader.
+    :param chunks: the byte chunks, e.g. the chunks of an HTTP response.
+    :param encoding: the encoding of the text (utf-8 with an optional byte order mark by default).
+    :return: an iterator of the lines.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pieces = []
+    for chunk in chunks:
+        first, *lines = decoder.decode(chunk).split('\n')
+        pieces.append(first)
+        if not lines:
+            # the pieces of a long line are only joined once, when its end is decoded
+            continue
+        yield ''.join(pieces) + '\n'
+        pieces = [lines.pop()]
+        for line in lines:
+            yield line + '\n'
+    pending = ''.join(pieces) + decoder.decode(b'', final=True)
+    if pending:
+        yield pending
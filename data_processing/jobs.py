@@ -0,0 +1,121 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Tuple, Union
+
+MAX_FINISHED_JOBS = 100
+
+
+class IngestionJobs:
+    """
+    A single-flight runner of data processing jobs in the background. At most one job runs at a time: triggering a job
+    while another one is queued or running returns the in-flight job instead of starting a duplicate. The state of each
+    job (its status, progress and result) is kept for the last MAX_FINISHED_JOBS finished jobs. The jobs run while
+    holding run_lock, so other processing of the src (e.g. the bucket events micro-batches) can hold the same lock to
+    never run concurrently with a job.
+    """
+
+    def __init__(self, run: Callable[..., Tuple[int, int]], max_finished_jobs: int = MAX_FINISHED_JOBS):
+        """
+        :param run: a function running the whole data processing. It is called with the job's options as keyword
+        arguments and a progress keyword argument (see process_all_data_minio), and returns the number of successfully
+        processed files and the total number of files.
+        :param max_finished_jobs: the number of finished jobs whose state is kept.
+        """
+        self.run = run
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs = OrderedDict()
+        self._done_events = {}
+        self._in_flight = None
+        self._lock = threading.Lock()
+        self.run_lock = threading.Lock()
+
+    def submit(self, **options) -> Tuple[dict, bool]:
+        """
+        A method to trigger a data processing job, unless one is already in flight.
+        :param options: the job's options passed to the run function (e.g. full=True).
+        :return: a tuple of two elements, the state of the job (the new one or the in-flight one) and a boolean
+        representing if a new job was created.
+        """
+        with self._lock:
+            if self._in_flight is not None:
+                return dict(self._jobs[self._in_flight]), False
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {'id': job_id, 'status': 'queued', 'options': options, 'files_done': 0,
+                                  'files_total': None, 'success': 0, 'errors': 0, 'error_message': None,
+                                  'created_at': time.time(), 'started_at': None, 'finished_at': None}
+            self._done_events[job_id] = threading.Event()
+            self._in_flight = job_id
+            job = dict(self._jobs[job_id])
+        threading.Thread(target=self._run_job, args=(job_id, options), daemon=True).start()
+        return job, True
+
+    def get(self, job_id: str) -> Union[dict, None]:
+        """
+        A method to get the state of a job.
+        :param job_id: the job's id.
+        :return: a copy of the job's state, or None if there is no such job.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id, None)
+            return dict(job) if job is not None else None
+
+    def wait(self, job_id: str, timeout: Union[float, None] = None) -> Union[dict, None]:
+        """
+        A method to wait until a job is finished.
+        :param job_id: the job's id.
+        :param timeout: the maximum number of seconds to wait, or None to wait until the job is finished.
+        :return: the state of the job, or None if there is no such job.
+        """
+        with self._lock:
+            done = self._done_events.get(job_id, None)
+        if done is not None:
+            done.wait(timeout)
+        return self.get(job_id)
+
+    def run_and_wait(self, **options) -> dict:
+        """
+        A method to trigger a data processing job (or join the in-flight one) and wait until it is finished.
+        :param options: the job's options passed to the run function.
+        :return: the state of the finished job.
+        """
+        job, _ = self.submit(**options)
+        return self.wait(job['id'])
+
+    def _update(self, job_id: str, **values) -> None:
+        """
+        A method to update the state of a job.
+        :param job_id: the job's id.
+        :param values: the new values of the job's state.
+        :return: None.
+        """
+        with self._lock:
+            self._jobs[job_id].update(values)
+
+    def _run_job(self, job_id: str, options: dict) -> None:
+        """
+        A method to run a job and record its progress and result.
+        :param job_id: the job's id.
+        :param options: the job's options passed to the run function.
+        :return: None.
+        """
+        def progress(files_done: int, files_total: int, success: int, errors: int) -> None:
+            self._update(job_id, files_done=files_done, files_total=files_total, success=success, errors=errors)
+
+        try:
+            with self.run_lock:
+                self._update(job_id, status='running', started_at=time.time())
+                success, files_total = self.run(progress=progress, **options)
+            self._update(job_id, status='succeeded', success=success, files_total=files_total)
+        except Exception as e:
+            self._update(job_id, status='failed', error_message=str(e))
+        finally:
+            with self._lock:
+                self._jobs[job_id]['finished_at'] = time.time()
+                self._in_flight = None
+                done = self._done_events.pop(job_id)
+                finished = [key for key in self._jobs if key != job_id and self._jobs[key]['finished_at'] is not None]
+                for key in finished[:max(0, len(finished) + 1 - self.max_finished_jobs)]:
+                    del self._jobs[key]
+            done.set()
@@ -1,11 +1,25 @@
+from __future__ import annotations
+import itertools
+import json
+import re
+import tempfile
 import warnings
-from typing import Tuple
-import pandas as pd
-from data_processing.postgres_handler import update_db
+import zlib
+from contextlib import ExitStack, closing
+from typing import TYPE_CHECKING, Callable, Collection, Dict, Iterable, Iterator, Tuple, Union
+from data_processing.postgres_handler import get_source_objects, update_db_batch, iter_db_output_rows, \
+    get_output_changes, get_output_changes_version, clear_output_changes, get_source_rejects, update_source_rejects, \
+    resync_users_copy, get_source_users_images, get_users_source_objects
 from data_processing.minio_handler import *
 from data_processing.helpers import *
+from data_processing.cache import bump_dataset_version
+from data_processing.parquet_handler import OutputParquetWriter, is_parquet_available
+from data_processing.metrics import INGESTION_STAGE_SECONDS, INGESTION_RUN_SECONDS, INGESTION_FILES, INGESTION_ROWS
 import os
 
+if TYPE_CHECKING:
+    from minio import Minio
+
 
 SRC_DATA_PATH = '/home/mohammad/internship/src_data/'
 SRC_DATA_BUCKET = 'srcdata'
@@ -13,11 +27,40 @@ PROCESSED_DATA_PATH = '/home/mohammad/internship/processed_data/'
 PROCESSED_DATA_BUCKET = 'processeddata'
 OUTPUT_FILE_NAME = 'output.csv'
 OUTPUT_FILE_PATH = PROCESSED_DATA_PATH + OUTPUT_FILE_NAME
+OUTPUT_PARQUET_NAME = 'output.parquet'
+OUTPUT_PARQUET_PREFIX = 'output_parquet/'
+OUTPUT_PARQUET_MODES = ['file', 'partitioned', 'off']
+OUTPUT_PARQUET = 'file'
+OUTPUT_LAYOUTS = ['full', 'delta']
+OUTPUT_LAYOUT = 'full'
+OUTPUT_DELTA_PREFIX = 'output/'
+OUTPUT_DELTA_MANIFEST_NAME = OUTPUT_DELTA_PREFIX + 'manifest.json'
+OUTPUT_DELTA_HEADERS = ['op', 'user_id', 'first_name', 'last_name', 'birthts', 'img_path']
+OUTPUT_MAX_DELTAS = 20
+OUTPUT_MAX_DELTA_RATIO = 0.25
+QUARANTINE_PREFIX = 'quarantine/'
+QUARANTINE_MODES = ['off', 'copy', 'move']
+QUARANTINE = 'off'
+RESYNC_MODES = ['off', 'merge', 'replace']
+RESYNC = 'off'
+RESYNC_SPOOL_MAX_SIZE = 64 * 1024 * 1024
 ORG_HEADERS = ['first_name', 'last_name', 'birthts']
-ORG_HEADERS_CONDITIONS = [lambda x: x.strip() != '', lambda x: x.strip() != '', lambda x: x != '' and int(x)]
+BIRTHTS_PATTERN = r'[+-]?[0-9]{1,18}'
+VALUE_MAX_LENGTH = 50
+ORG_HEADERS_CONDITIONS = [lambda x: 0 < len(x.strip()) <= VALUE_MAX_LENGTH,
+                          lambda x: 0 < len(x.strip()) <= VALUE_MAX_LENGTH,
+                          lambda x: re.fullmatch(BIRTHTS_PATTERN, x.strip()) is not None and int(x) != 0]
 OUTPUT_HEADERS = ['user_id', 'first_name', 'last_name', 'birthts', 'img_path']
+BATCH_HEADERS = ['user_id'] + ORG_HEADERS
+BATCH_VALIDATION_ROWS = 10000
 IMG_EXTENSION = '.png'
-OUTPUT_TEMP_FILE_PATH = 'temp.csv'
+BATCH_IMG_ETAG = '*'
+OUTPUT_SPOOL_MAX_SIZE = 64 * 1024 * 1024
+OUTPUT_PART_SIZE = 16 * 1024 * 1024
+DB_BATCH_SIZE = 1000
+FETCH_CONCURRENCY = 8
+PARSE_PROCESSES = 0
+PARSE_FILES_PER_TASK = 64
 
 
 def is_valid_headers_src(headers: List[str]) -> bool:
@@ -68,17 +111,108 @@ def check_csv_rows_src(file_rows: List[List[str]]) -> Tuple[bool, str]:
     return True, ''
 
 
-def create_output() -> None:
+def is_valid_batch_headers_src(headers: List[str]) -> bool:
     """
-    A method to create the output csv in OUTPUT_FILE_PATH file in case it does not exist. And if it does exist, then it
-    clears all its contents, and all the columns' labels row.
-    :return: None
+    A method to check if given headers match BATCH_HEADERS, i.e. the headers of a batch csv file holding many users.
+    Additional spaces in the beginning and ending of each column are discarded.
+    :param headers: the headers which need to be checked.
+    :return: a boolean representing if the headers are valid.
     """
-    if os.path.isfile(OUTPUT_FILE_PATH):
-        f = open(OUTPUT_FILE_PATH, "w+")
-        f.close()
-    df = pd.DataFrame(columns=OUTPUT_HEADERS)
-    df.to_csv(OUTPUT_FILE_PATH, index=False)
+    return [header.strip() for header in headers] == BATCH_HEADERS
+
+
+def check_batch_rows_src(file_rows: List[List[str]], first_index: int = 0, seen_user_ids: Union[set, None] = None) \
+        -> Tuple[bool, str, List[List[str]], List[Tuple[int, str]]]:
+    """
+    A method to check the rows of a batch csv file, i.e. a file whose headers match BATCH_HEADERS and which holds any
+    number of users. The values are checked a whole column at a time: the user_id, first_name and last_name must not
+    be empty nor longer than VALUE_MAX_LENGTH (the size of their columns in the database), the birthts must be a
+    non-zero integer (of at most 18 digits), and a user_id must not appear twice among the rows passing the other
+    checks. The valid rows are kept while each rejected row gets the reason of its
+    rejection. Empty rows are ignored.
+    :param file_rows: The rows in the csv file, including the headers.
+    :param first_index: the index of the headers in the file, if file_rows is a chunk of a larger file.
+    :param seen_user_ids: the user_ids of the valid rows in the previous chunks of the file (if any). The user_ids of
+    the valid rows of file_rows are added to it.
+    :return: A tuple of four elements; the first indicates whether the csv file is valid (its headers are valid and it
+    has at least one row of values), the second represents why it is invalid if the first element is False, and empty
+    string otherwise. The third is the list of the valid rows [user_id, first_name, last_name, birthts] with their
+    values stripped, and the fourth is the list of the rejected rows as tuples (the row's index in the file, the
+    reason).
+    """
+    if len(file_rows) == 0 or not is_valid_batch_headers_src(file_rows[0]):
+        headers = file_rows[0] if len(file_rows) > 0 else []
+        return False, f"The headers {headers} do not match the required headers {BATCH_HEADERS}.", [], []
+    indexes = [i for i in range(1, len(file_rows)) if any(value.strip() for value in file_rows[i])]
+    if len(indexes) == 0:
+        return False, "The file does not contain any user.", [], []
+    import pandas as pd
+    columns = len(BATCH_HEADERS)
+    lengths = pd.Series([len(file_rows[i]) for i in indexes], index=indexes)
+    df = pd.DataFrame([file_rows[i] if len(file_rows[i]) == columns else [''] * columns for i in indexes],
+                      index=indexes, columns=BATCH_HEADERS, dtype=object)
+    df = df.apply(lambda column: column.str.strip())
+    is_integer = df['birthts'].str.fullmatch(BIRTHTS_PATTERN)
+    birthts = pd.to_numeric(df['birthts'].where(is_integer, '1'))
+    invalid_value = [((df[column] == '') | (df[column].str.len() > VALUE_MAX_LENGTH) if column != 'birthts' else
+                      ~is_integer | (birthts == 0),
+                      "The value " + df[column] + f" does not follow {column}'s condition")
+                     for column in BATCH_HEADERS]
+    conditions = [(lengths != columns, "The number of elements in the values row does not match the header."),
+                  *invalid_value]
+    reasons = pd.Series('', index=indexes, dtype=object)
+    for invalid, reason in conditions:
+        reasons = reasons.mask((reasons == '') & invalid, reason)
+    user_ids = df['user_id'].where(reasons == '')
+    is_duplicated = user_ids.notna() & (user_ids.duplicated() | user_ids.isin(seen_user_ids or ()))
+    reasons = reasons.mask(is_duplicated, "The user_id " + df['user_id'] + " appears more than once in the file.")
+    is_valid = reasons == ''
+    rejects = [(index + first_index, reason) for index, reason in reasons[~is_valid].items()]
+    if seen_user_ids is not None:
+        seen_user_ids.update(df.loc[is_valid, 'user_id'])
+    return True, '', df[is_valid].values.tolist(), rejects
+
+
+def get_users_rows_src(csv_file: str, file_rows: Iterable[List[str]]) \
+        -> Tuple[bool, str, List[List[str]], List[Tuple[int, str]]]:
+    """
+    A method to get the users' rows of a source csv file in either of the two supported formats: a batch file whose
+    headers match BATCH_HEADERS and which holds any number of users (see check_batch_rows_src), or a single-user file
+    whose headers match ORG_HEADERS, which holds exactly one row of values, and whose name is the user's id (see
+    check_csv_rows_src). The rows are consumed lazily: at most three rows of a single-user file are read, and a batch
+    file is validated BATCH_VALIDATION_ROWS rows at a time.
+    :param csv_file: the path to the csv file.
+    :param file_rows: The rows in the csv file (e.g. a list, or a stream of rows), including the headers.
+    :return: A tuple of four elements; the first indicates whether the csv file is valid, the second represents why it
+    is invalid if the first element is False, and empty string otherwise. The third is the list of the valid rows
+    [user_id, first_name, last_name, birthts], and the fourth is the list of the rejected rows as tuples (the row's
+    index in the file, the reason).
+    """
+    file_rows = iter(file_rows)
+    head = list(itertools.islice(file_rows, 1))
+    if len(head) > 0 and is_valid_batch_headers_src(head[0]):
+        rows, rejects, seen_user_ids, first_index = [], [], set(), 0
+        while True:
+            chunk = list(itertools.islice(file_rows, BATCH_VALIDATION_ROWS))
+            if len(chunk) == 0:
+                break
+            has_users, _, chunk_rows, chunk_rejects = check_batch_rows_src(head + chunk, first_index, seen_user_ids)
+            rows.extend(chunk_rows)
+            rejects.extend(chunk_rejects)
+            first_index += len(chunk)
+        if len(rows) == 0 and len(rejects) == 0:
+            return False, "The file does not contain any user.", [], []
+        return True, '', rows, rejects
+    head.extend(itertools.islice(file_rows, 2))
+    if len(head) > 2:
+        return False, "The file contains more than two rows. It should contain exactly two rows.", [], []
+    csv_is_valid, msg = check_csv_rows_src(head)
+    if not csv_is_valid:
+        return False, msg, [], []
+    user_id = get_filename(csv_file)
+    if len(user_id) > VALUE_MAX_LENGTH:
+        return False, f"The user_id {user_id} (the file's name) is longer than {VALUE_MAX_LENGTH} characters.", [], []
+    return True, '', [[user_id, *head[1]]], []
 
 
 def update_output_existing_row(user_id: str, row_index: int, org_values: List[Tuple[str, str]], img_path: str) \
@@ -95,6 +229,7 @@ def update_output_existing_row(user_id: str, row_index: int, org_values: List[Tu
     :return: a Tuple of two elements, the first is a boolean representing if the file was updated. The second is for the
     error message.
     """
+    import pandas as pd
     try:
         df = pd.read_csv(OUTPUT_FILE_PATH)
         assert str(df.loc[row_index, OUTPUT_HEADERS[0]]).strip() == user_id
@@ -148,97 +283,271 @@ def update_output(user_id: str, org_values: List[Tuple[str, str]], img_path: str
         return update_output_new_row(user_id, org_values, img_path)
 
 
-def update_output_minio(*new_row_elements) -> Tuple[bool, str]:
+def proc_csv_file(csv_file: str, output_rows: Union[Dict[str, List[str]], None] = None) -> Tuple[bool, str]:
     """
-    a method to add a new row to the temp output csv file and update the postgres database.
-    :param new_row_elements: the new row elements in order.
-    :return: a Tuple of two elements, the first is a boolean representing if the file was updated. The second is for the
-    error message.
+    The main method to process some csv file. It checks if the file is valid, then updates the output with the info
+    obtained from the csv file, i.e. with the row of each of its valid users (see get_users_rows_src).
+    :param csv_file: the path to the targeted csv file.
+    :param output_rows: an in-memory index of the output rows with the user_id as the key. If given, the users' rows are
+    added to (or updated in) this index instead of the output file, and the caller writes the output file (see
+    write_output).
+    :return: a Tuple of two elements, the first is a boolean representing if the file was processed. The second is for
+    the error message, or the reasons of the rejected rows of a batch file.
+    """
+    assert get_extension(csv_file) == '.csv'
+    with open(csv_file, newline='') as f:
+        csv_is_valid, msg, rows, rejects = get_users_rows_src(csv_file, csv.reader(f))
+    if not csv_is_valid:
+        return False, msg
+    for user_id, *values in rows:
+        img_path = SRC_DATA_PATH + user_id + IMG_EXTENSION
+        if not os.path.isfile(img_path):
+            warn_msg = f'Could not find an image for the user with id {user_id}.'
+            warnings.warn(warn_msg)
+            img_path = ''
+        if output_rows is not None:
+            msg = f'Updated the existing row for {user_id}.' if user_id in output_rows else \
+                f'Added a new row for {user_id}'
+            output_rows[user_id] = [user_id, *values, img_path]
+        else:
+            org_values = [(column, value) for column, value in zip(ORG_HEADERS, values)]
+            processed, msg = update_output(user_id, org_values, img_path)
+            if not processed:
+                return False, msg
+    if len(rows) != 1 or rejects:
+        msg = format_rejects_src(len(rows), rejects)
+    return True, msg
+
+
+def format_rejects_src(accepted: int, rejects: List[Tuple[int, str]]) -> str:
+    """
+    A method to describe the result of processing a batch csv file.
+    :param accepted: the number of valid users in the file.
+    :param rejects: the rejected rows as tuples (the row's index in the file, the reason).
+    :return: the description as a string.
+    """
+    return f'Processed {accepted} users and rejected {len(rejects)} rows.' + \
+        ''.join(f' Row {index}: {reason}' for index, reason in rejects)
+
+
+def write_output(output_rows: Dict[str, List[str]]) -> None:
+    """
+    A method to write the output csv in OUTPUT_FILE_PATH at once from an in-memory index of its rows. The file's
+    previous contents are replaced.
+    :param output_rows: the output rows with the user_id as the key, in the order they should be written.
+    :return: None
+    """
+    with open(OUTPUT_FILE_PATH, 'wb') as output:
+        write_csv_rows(output, [OUTPUT_HEADERS])
+        write_csv_rows(output, output_rows.values())
+
+
+def parse_users_rows_src(csv_file: str, file_rows: Iterable[List[str]]) \
+        -> Tuple[bool, str, List[List[str]], List[Tuple[int, str]]]:
+    """
+    A method to get the users' rows of a source csv file (see get_users_rows_src), where a file which cannot be decoded
+    or parsed is not valid.
+    :param csv_file: the path to the csv file.
+    :param file_rows: a stream of the rows in the csv file, including the headers.
+    :return: the same tuple of four elements as get_users_rows_src.
     """
     try:
-        with open(OUTPUT_TEMP_FILE_PATH, 'a') as f_object:
-            writer = csv.writer(f_object)
-            writer.writerow(new_row_elements)
-            f_object.close()
-    except Exception as e:
-        return False, str(e)
-    return True, f'Added a new row for {new_row_elements[0]}'
+        return get_users_rows_src(csv_file, file_rows)
+    except (UnicodeDecodeError, csv.Error) as e:
+        return False, f"The file could not be parsed: {e}", [], []
 
 
-def proc_csv_file(csv_file: str) -> Tuple[bool, str]:
+def parse_csv_files_src(files: List[Tuple[str, bytes]]) \
+        -> List[Tuple[str, Tuple[bool, str, List[List[str]], List[Tuple[int, str]]]]]:
     """
-    The main method to process some csv file. It checks if the file is valid, then updates the output file with the info
-    obtained from the csv file.
+    A method to parse and validate the contents of some source csv files, e.g. in a worker process (see
+    get_users_rows_processes_minio).
+    :param files: a list of tuples (the file's name, its contents or None).
+    :return: a list of tuples (the file's name, the tuple of four elements returned by get_users_rows_src). The result
+    of a file whose contents are None (i.e. it could not be fetched) is None.
+    """
+    return [(csv_file, parse_users_rows_src(csv_file, iter_csv_rows_stripped(iter_decoded_lines([data])))
+             if data is not None else None) for csv_file, data in files]
+
+
+def match_images_minio(minio_client: Minio, csv_file: str, rows: List[List[str]],
+                       img_names: Union[Collection[str], None] = None) -> List[List[str]]:
+    """
+    A method to match the image of each user of a csv file in MinIO.
+    :param minio_client: the minio client which reads the data.
+    :param csv_file: the path to the csv file.
+    :param rows: the users' rows [user_id, first_name, last_name, birthts].
+    :param img_names: the names of the images in the src bucket (e.g. from the listing of the bucket), so that matching
+    the images is a lookup. If not given, the existence of each image is checked with a request to MinIO.
+    :return: the output rows [user_id, first_name, last_name, birthts, img_path], where img_path is empty if the user
+    has no image.
+    """
+    output_rows, missing = [], []
+    with INGESTION_STAGE_SECONDS.time(stage='image_lookup'):
+        for user_id, *values in rows:
+            img_name = user_id + IMG_EXTENSION
+            if img_names is not None:
+                img_exists = img_name in img_names
+            else:
+                img_exists = is_file_exist_minio(minio_client, SRC_DATA_BUCKET, img_name)
+            if not img_exists:
+                missing.append(user_id)
+                img_name = ''
+            output_rows.append([user_id, *values, img_name])
+    if len(missing) == 1:
+        warnings.warn(f'Could not find an image for the user with id {missing[0]}.')
+    elif len(missing) > 1:
+        warnings.warn(f'Could not find an image for {len(missing)} users of {csv_file}.')
+    return output_rows
+
+
+def get_user_rows_minio(minio_client: Minio, csv_file: str, img_names: Union[Collection[str], None] = None) \
+        -> Tuple[bool, str, List[List[str]], List[Tuple[int, str]]]:
+    """
+    A method to read some csv file in MinIO and build its users' output rows from it. It checks if the file is valid
+    (see get_users_rows_src), then matches the image of each user.
+    :param minio_client: the minio client which reads the data.
     :param csv_file: the path to the targeted csv file.
-    :return: a Tuple of two elements, the first is a boolean representing if the file was processed. The second is for
-    the error message.
+    :param img_names: the names of the images in the src bucket (e.g. from the listing of the bucket), so that matching
+    the images is a lookup. If not given, the existence of each image is checked with a request to MinIO.
+    :return: a Tuple of four elements, the first is a boolean representing if the file is valid. The second is for
+    the error message. The third is the list of output rows [user_id, first_name, last_name, birthts, img_path] (an
+    empty list if the file is not valid). The fourth is the list of the rejected rows as tuples (the row's index in the
+    file, the reason). An error is raised if the file could not be fetched, so it is never taken for an invalid file.
     """
     assert get_extension(csv_file) == '.csv'
-    file_rows = get_rows_csv(csv_file)
-    csv_is_valid, msg = check_csv_rows_src(file_rows)
+    with INGESTION_STAGE_SECONDS.time(stage='fetch_validate'), \
+            closing(iter_rows_csv_minio(minio_client, SRC_DATA_BUCKET, csv_file)) as file_rows:
+        csv_is_valid, msg, rows, rejects = parse_users_rows_src(csv_file, file_rows)
     if not csv_is_valid:
-        return False, msg
-    user_id = get_filename(csv_file)
-    img_path = SRC_DATA_PATH + user_id + IMG_EXTENSION
-    if not os.path.isfile(img_path):
-        warn_msg = f'Could not find an image for the user with id {user_id}.'
-        warnings.warn(warn_msg)
-        img_path = ''
-    _, values = file_rows
-    org_values = [(column, value) for column, value in zip(ORG_HEADERS, values)]
-    return update_output(user_id, org_values, img_path)
+        return False, msg, [], []
+    return True, '', match_images_minio(minio_client, csv_file, rows, img_names), rejects
+
+
+def get_users_rows_processes_minio(minio_client: Minio, csv_files: List[str], img_names: Collection[str],
+                                   concurrency: int = FETCH_CONCURRENCY, processes: int = PARSE_PROCESSES,
+                                   files_per_task: int = PARSE_FILES_PER_TASK) \
+        -> Iterator[Tuple[bool, str, List[List[str]], List[Tuple[int, str]]]]:
+    """
+    A method to build the users' output rows of some csv files in MinIO, where the parsing and the validation run in a
+    pool of worker processes, so they do not compete with the caller's threads (e.g. the Flask requests) for the GIL.
+    The files are fetched by a pool of concurrency threads, their contents are shipped to the workers files_per_task
+    files at a time, and the images are matched in the caller's process. If the process pool cannot be used, the files
+    are parsed in-process (see imap_processes). Unlike get_user_rows_minio, which streams a file, each file is read
+    whole to be shipped, so up to 2 * processes * files_per_task files (plus the ones being fetched) are held in memory
+    at once: the process pool trades the bounded memory of streaming for parsing outside of the GIL.
+    :param minio_client: the minio client which reads the data.
+    :param csv_files: the paths to the csv files.
+    :param img_names: the names of the images in the src bucket.
+    :param concurrency: the number of files fetched at the same time.
+    :param processes: the number of worker processes.
+    :param files_per_task: the number of files shipped to a worker at once.
+    :return: an iterator of the results of each file in order (the same tuples as get_user_rows_minio). The result of
+    a file which could not be fetched is the error raised while fetching it instead.
+    """
+    fetch_errors = {}
+
+    def fetch(csv_file: str) -> Tuple[str, Union[bytes, None]]:
+        with INGESTION_STAGE_SECONDS.time(stage='fetch'):
+            try:
+                return csv_file, read_bytes_object_minio(minio_client, SRC_DATA_BUCKET, csv_file)
+            except Exception as e:
+                fetch_errors[csv_file] = e
+                return csv_file, None
+
+    fetched = imap_bounded(fetch, csv_files, concurrency)
+    tasks = iter(lambda: list(itertools.islice(fetched, files_per_task)), [])
+    for task_results in imap_processes(parse_csv_files_src, tasks, processes):
+        for csv_file, result in task_results:
+            if result is None:
+                yield fetch_errors.pop(csv_file)
+                continue
+            csv_is_valid, msg, rows, rejects = result
+            if not csv_is_valid:
+                yield False, msg, [], []
+            else:
+                yield True, '', match_images_minio(minio_client, csv_file, rows, img_names), rejects
 
 
-def proc_csv_file_minio(db_info: dict, minio_client: Minio, csv_file: str) -> Tuple[bool, str]:
+def get_user_rows_or_error_minio(minio_client: Minio, csv_file: str,
+                                 img_names: Union[Collection[str], None] = None) \
+        -> Union[Tuple[bool, str, List[List[str]], List[Tuple[int, str]]], Exception]:
     """
-    The main method to process some csv file in MinIO. It checks if the file is valid, then updates the temp output file
-    with the info obtained from the csv file.
+    A method to build the users' output rows of a csv file in MinIO (see get_user_rows_minio), where the error raised
+    if the file could not be fetched is returned instead.
+    :param minio_client: the minio client which reads the data.
+    :param csv_file: the path to the targeted csv file.
+    :param img_names: the names of the images in the src bucket (see get_user_rows_minio).
+    :return: the tuple of four elements returned by get_user_rows_minio, or the error.
+    """
+    try:
+        return get_user_rows_minio(minio_client, csv_file, img_names)
+    except Exception as e:
+        return e
+
+
+def proc_csv_file_minio(db_info: dict, minio_client: Minio, csv_file: str, quarantine: str = QUARANTINE) \
+        -> Tuple[bool, str]:
+    """
+    The main method to process a single csv file in MinIO, e.g. after a bucket notification. It reads the file's
+    current information, checks if the file is valid, then updates the database and the file's manifest entry with the
+    info obtained from the csv file. If the file does not exist but the user named after it was read from another file
+    (e.g. after the notification of an image whose user lives in a batch file), that file is processed instead. If the
+    file does not exist anymore or is not valid, it is dropped from the manifest, and an invalid file is recorded in
+    source_rejects and optionally put in quarantine, like in process_all_data_minio (see reject_source_minio). If the
+    file could not be fetched, an error is raised and nothing is recorded. output.csv is not regenerated by this method
+    (see publish_output_minio).
     :param db_info: a dictionary containing information about the postgres db.
     :param minio_client: the minio client which reads the data.
     :param csv_file: the path to the targeted csv file.
+    :param quarantine: the quarantine's mode of an invalid file (see quarantine_source_minio).
     :return: a Tuple of two elements, the first is a boolean representing if the file was processed. The second is for
     the error message.
     """
-    assert get_extension(csv_file) == '.csv'
-    file_rows = get_rows_csv_minio(minio_client, SRC_DATA_BUCKET, csv_file)
-    csv_is_valid, msg = check_csv_rows_src(file_rows)
+    csv_info = get_object_info_minio(minio_client, SRC_DATA_BUCKET, csv_file)
+    if csv_info is None:
+        user_id = get_filename(csv_file)
+        source_object = get_users_source_objects(db_info, [user_id]).get(user_id, csv_file)
+        if source_object != csv_file:
+            csv_file = source_object
+            csv_info = get_object_info_minio(minio_client, SRC_DATA_BUCKET, csv_file)
+    if csv_info is None:
+        update_db_batch(db_info, [], [], [csv_file])
+        update_source_rejects(db_info, removed=[csv_file])
+        return False, f'The file {csv_file} does not exist.'
+    img_name = get_filename(csv_file) + IMG_EXTENSION
+    img_info = get_object_info_minio(minio_client, SRC_DATA_BUCKET, img_name)
+    csv_is_valid, msg, rows, rejects = get_user_rows_minio(minio_client, csv_file)
     if not csv_is_valid:
+        update_db_batch(db_info, [], [], [csv_file])
+        update_source_rejects(db_info, [reject_source_minio(minio_client, csv_file, csv_info.etag, csv_info.size, msg,
+                                                            quarantine)])
         return False, msg
-    user_id = get_filename(csv_file)
-    img_name = user_id + IMG_EXTENSION
-    if not is_file_exist_minio(minio_client, SRC_DATA_BUCKET, img_name):
-        warn_msg = f'Could not find an image for the user with id {user_id}.'
-        warnings.warn(warn_msg)
-        img_name = ''
-    _, values = file_rows
-    update_db(db_info, user_id, *values, img_name)
-    return update_output_minio(user_id, *values, img_name)
-
-
-def create_temp_minio() -> None:
-    """
-    a method for creating a local temp csv file (not in MinIO) to store the outputs of the src data processing.
-    :return: None
-    """
-    if os.path.isfile(OUTPUT_TEMP_FILE_PATH):
-        f = open(OUTPUT_TEMP_FILE_PATH, "w+")
-        f.close()
-    df = pd.DataFrame(columns=OUTPUT_HEADERS)
-    df.to_csv(OUTPUT_TEMP_FILE_PATH, index=False)
+    img_etag = get_manifest_img_etag(csv_file, [row[0] for row in rows],
+                                     {img_name: img_info.etag} if img_info is not None else {})
+    with INGESTION_STAGE_SECONDS.time(stage='db_upsert'):
+        update_db_batch(db_info, [row + [csv_file] for row in rows],
+                        [(csv_file, csv_info.etag, csv_info.size, csv_info.last_modified, img_etag)])
+        update_source_rejects(db_info, cleared=[csv_file])
+    if len(rows) != 1 or rejects:
+        return True, format_rejects_src(len(rows), rejects)
+    return True, f'Updated the row for {rows[0][0]}.'
 
 
 def process_all_data(with_print: bool = False) -> Tuple[int, int]:
     """
-    The main method for running the whole data processing from src to output.csv and the postgres database.
+    The main method for running the whole data processing from src to output.csv. The output rows are kept in an
+    in-memory index with the user_id as the key while the files are processed, and the output file is written once at
+    the end, so processing a file does not depend on the size of the output.
     :param with_print: a boolean to indicate if the method should print while processing.
     :return: a tuple of two integers. The first is the successfully processed files, the other is for the total number
     of csv files in the src.
     """
-    create_output()
     src_csv_files = get_files_with_extension(SRC_DATA_PATH, '.csv')
+    output_rows = {}
     success = 0
     for csv_file in src_csv_files:
-        processed, msg = proc_csv_file(csv_file)
+        processed, msg = proc_csv_file(csv_file, output_rows)
         if processed:
             success += 1
             if with_print:
@@ -246,37 +555,496 @@ def process_all_data(with_print: bool = False) -> Tuple[int, int]:
         else:
             if with_print:
                 print(f"The file {csv_file} was not processed. The following error occurred: {msg}")
+    write_output(output_rows)
     return success, len(src_csv_files)
 
 
-def process_all_data_minio(db_info: dict, minio_client: Minio, with_print: bool = False) -> Tuple[int, int]:
+def list_src_objects_minio(minio_client: Minio) -> Tuple[Dict[str, tuple], Dict[str, str]]:
+    """
+    A method to list the source csv files and images in MinIO with one listing of the src bucket.
+    :param minio_client: the MinIO client which reads the data.
+    :return: a tuple of two dictionaries. The first has the csv files' names as keys and tuples (etag, size,
+    last_modified) as values. The second has the images' names as keys and their etags as values.
+    """
+    csv_objects, img_etags = {}, {}
+    for src_object in list_objects_minio(minio_client, SRC_DATA_BUCKET):
+        extension = get_extension(src_object.object_name)
+        if extension == '.csv':
+            csv_objects[src_object.object_name] = (src_object.etag, src_object.size, src_object.last_modified)
+        elif extension == IMG_EXTENSION:
+            img_etags[src_object.object_name] = src_object.etag
+    return csv_objects, img_etags
+
+
+def get_source_shard(object_name: str, shard_count: int) -> int:
+    """
+    A method to get the shard of a source object, i.e. the crc32 hash of its name without the extension (the user_id
+    for a single-user csv file and its image) modulo the number of shards. A csv file and its image are in the same
+    shard.
+    :param object_name: the object's name.
+    :param shard_count: the number of shards.
+    :return: the shard, between 0 and shard_count - 1.
+    """
+    return zlib.crc32(get_filename(object_name).encode()) % shard_count
+
+
+def get_manifest_img_etag(csv_file: str, user_ids: List[str], img_etags: Dict[str, str]) -> str:
+    """
+    A method to get the img_etag of the manifest entry of a processed csv file. For a file holding only the user whose
+    id is the file's name (e.g. a single-user file), it is the etag of the matching image. For a batch file, it is
+    BATCH_IMG_ETAG, and the images of its users are matched against the listing on every run instead (see
+    diff_source_objects).
+    :param csv_file: the csv file's name.
+    :param user_ids: the ids of the users read from the file.
+    :param img_etags: the images' names as keys and their etags as values.
+    :return: the img_etag of the manifest entry.
+    """
+    if list(user_ids) != [get_filename(csv_file)]:
+        return BATCH_IMG_ETAG
+    return img_etags.get(get_filename(csv_file) + IMG_EXTENSION, '')
+
+
+def diff_source_objects(csv_objects: Dict[str, tuple], img_etags: Dict[str, str], manifest: Dict[str, tuple],
+                        full: bool = False, rejects: Union[Dict[str, tuple], None] = None,
+                        source_users: Union[Dict[str, Dict[str, bool]], None] = None) -> Tuple[List[str], List[str]]:
+    """
+    A method to compare the listing of the source csv files with the manifest of the previously processed files. A csv
+    file needs processing if it is not in the manifest, if its etag or size changed, or if its matching image was
+    added, changed or removed. A batch file (whose manifest entry has BATCH_IMG_ETAG) also needs processing if the image
+    of one of its users was added or removed. A file which was rejected as invalid does not need processing until its
+    etag or size changes.
+    :param csv_objects: the csv files' names as keys and tuples (etag, size, last_modified) as values.
+    :param img_etags: the images' names as keys and their etags as values.
+    :param manifest: the processed files' names as keys and tuples (etag, size, img_etag) as values.
+    :param full: a boolean to indicate that all the csv files need processing regardless of the manifest and the
+    rejects.
+    :param rejects: the rejected files' names as keys and tuples starting with (etag, size) as values (see
+    get_source_rejects).
+    :param source_users: the batch files' names as keys and their users as values, i.e. dictionaries with the users'
+    ids as keys and booleans representing if the user has an image as values (see get_source_users_images).
+    :return: a tuple of two lists. The first contains the csv files which need processing (in the listing order), the
+    other contains the files in the manifest which do not exist anymore.
+    """
+    rejects = rejects or {}
+    source_users = source_users or {}
+    changed = []
+    for csv_file, (etag, size, _) in csv_objects.items():
+        if manifest.get(csv_file, (None, None, None))[2] == BATCH_IMG_ETAG:
+            users = source_users.get(csv_file, {}).items()
+            is_matched = all((user_id + IMG_EXTENSION in img_etags) == has_image for user_id, has_image in users)
+            img_etag = BATCH_IMG_ETAG if is_matched else None
+        else:
+            img_etag = img_etags.get(get_filename(csv_file) + IMG_EXTENSION, '')
+        if full or (manifest.get(csv_file, None) != (etag, size, img_etag) and
+                    tuple(rejects.get(csv_file, ())[:2]) != (etag, size)):
+            changed.append(csv_file)
+    removed = [csv_file for csv_file in manifest if csv_file not in csv_objects]
+    return changed, removed
+
+
+def quarantine_source_minio(minio_client: Minio, csv_file: str, quarantine: str = QUARANTINE) -> Union[str, None]:
+    """
+    A method to put a rejected source file in quarantine, i.e. copy it under QUARANTINE_PREFIX in the processed bucket,
+    and also remove it from the src bucket if quarantine is 'move'.
+    :param minio_client: the MinIO client which handles the read / write operations.
+    :param csv_file: the name of the rejected file.
+    :param quarantine: the quarantine's mode, one of QUARANTINE_MODES ('off', 'copy' or 'move').
+    :return: the name of the copy in quarantine, or None if the quarantine is off or the copy failed.
+    """
+    assert quarantine in QUARANTINE_MODES
+    if quarantine == 'off':
+        return None
+    quarantine_object = QUARANTINE_PREFIX + csv_file
+    try:
+        copy_object_minio(minio_client, SRC_DATA_BUCKET, csv_file, PROCESSED_DATA_BUCKET, quarantine_object)
+    except Exception as e:
+        warnings.warn(f'The file {csv_file} could not be put in quarantine: {e}')
+        return None
+    if quarantine == 'move':
+        remove_objects_minio(minio_client, SRC_DATA_BUCKET, [csv_file])
+    return quarantine_object
+
+
+def reject_source_minio(minio_client: Minio, csv_file: str, etag: str, size: int, reason: str,
+                        quarantine: str = QUARANTINE) -> tuple:
+    """
+    A method to reject an invalid source file: it is put in quarantine (see quarantine_source_minio), and its entry
+    for source_rejects is returned, so the runs and the event driven processing record their rejects the same way.
+    :param minio_client: the MinIO client which handles the read / write operations.
+    :param csv_file: the name of the rejected file.
+    :param etag: the etag of the rejected file.
+    :param size: the size of the rejected file.
+    :param reason: the reason of the rejection.
+    :param quarantine: the quarantine's mode, one of QUARANTINE_MODES ('off', 'copy' or 'move').
+    :return: the entry (object_name, etag, size, reason, quarantine_object) for update_source_rejects.
+    """
+    return csv_file, etag, size, reason, quarantine_source_minio(minio_client, csv_file, quarantine)
+
+
+def upload_output_rows_minio(minio_client: Minio, object_name: str, headers: List[str],
+                             rows: Iterable[List[str]]) -> int:
+    """
+    A method to upload rows as a csv file to the processed bucket. The rows are streamed into a buffer which stays in
+    memory up to OUTPUT_SPOOL_MAX_SIZE bytes and spills to a temporary file past that. The buffer is then uploaded over
+    the existing object (in parts of OUTPUT_PART_SIZE bytes for large files), so readers see either the previous or the
+    new file, and concurrent runs do not share any local file.
+    :param minio_client: the MinIO client which handles the write operations.
+    :param object_name: the name of the uploaded object.
+    :param headers: the headers of the csv file.
+    :param rows: the rows of the csv file.
+    :return: the number of rows written (without the headers).
+    """
+    with tempfile.SpooledTemporaryFile(max_size=OUTPUT_SPOOL_MAX_SIZE) as output:
+        write_csv_rows(output, [headers])
+        count = write_csv_rows(output, rows)
+        length = output.tell()
+        output.seek(0)
+        minio_client.put_object(PROCESSED_DATA_BUCKET, object_name, output, length, content_type='text/csv',
+                                part_size=OUTPUT_PART_SIZE)
+    return count
+
+
+def upload_parquet_minio(minio_client: Minio, parquet_writer: OutputParquetWriter, parquet: str) -> None:
+    """
+    A method to upload the Parquet snapshot written by parquet_writer, either as one file OUTPUT_PARQUET_NAME, or as
+    files partitioned by birth decade under OUTPUT_PARQUET_PREFIX (the partitions which do not exist anymore are removed
+    after the upload).
+    :param minio_client: the MinIO client which handles the write operations.
+    :param parquet_writer: the writer which received all the output rows.
+    :param parquet: the Parquet snapshot's mode, 'file' or 'partitioned'.
+    :return: None.
+    """
+    with INGESTION_STAGE_SECONDS.time(stage='parquet_upload'):
+        written = []
+        for partition, parquet_file, length in parquet_writer.finish():
+            object_name = OUTPUT_PARQUET_PREFIX + partition if partition else OUTPUT_PARQUET_NAME
+            with parquet_file:
+                minio_client.put_object(PROCESSED_DATA_BUCKET, object_name, parquet_file, length,
+                                        content_type='application/vnd.apache.parquet', part_size=OUTPUT_PART_SIZE)
+            written.append(object_name)
+        if parquet == 'partitioned':
+            stale = [minio_object.object_name for minio_object in
+                     list_objects_minio(minio_client, PROCESSED_DATA_BUCKET, OUTPUT_PARQUET_PREFIX)
+                     if minio_object.object_name not in written]
+            remove_objects_minio(minio_client, PROCESSED_DATA_BUCKET, stale)
+
+
+def get_parquet_writer(parquet: str) -> Union[OutputParquetWriter, None]:
+    """
+    A method to get a writer of the Parquet snapshot in a given mode.
+    :param parquet: the Parquet snapshot's mode, one of OUTPUT_PARQUET_MODES ('file', 'partitioned' or 'off').
+    :return: the writer, or None if the snapshot is off or pyarrow is not installed.
+    """
+    assert parquet in OUTPUT_PARQUET_MODES
+    if parquet != 'off' and is_parquet_available():
+        return OutputParquetWriter(partitioned=parquet == 'partitioned')
+    return None
+
+
+def publish_output_minio(db_info: dict, minio_client: Minio, parquet: str = OUTPUT_PARQUET,
+                         layout: str = OUTPUT_LAYOUT) -> None:
+    """
+    A method to publish the output in MinIO from the database. With the 'full' layout, output.csv is regenerated from
+    the rows of the users whose source files are in the manifest (see upload_output_rows_minio). The same stream of
+    rows also feeds a typed Parquet snapshot (see OutputParquetWriter) if pyarrow is installed. With the 'delta' layout,
+    only the rows which changed since the last publication are uploaded (see publish_output_delta_minio), and there is
+    no Parquet snapshot. In both cases, the published changes are then forgotten by the database.
+    :param db_info: a dictionary containing the postgres database info.
+    :param minio_client: the MinIO client which handles the write operations.
+    :param parquet: the Parquet snapshot's mode, one of OUTPUT_PARQUET_MODES ('file', 'partitioned' or 'off').
+    :param layout: the output's layout, one of OUTPUT_LAYOUTS ('full' or 'delta').
+    :return: None.
+    """
+    assert layout in OUTPUT_LAYOUTS
+    if layout == 'delta':
+        publish_output_delta_minio(db_info, minio_client)
+        return
+    version = get_output_changes_version(db_info)
+    parquet_writer = get_parquet_writer(parquet)
+    with INGESTION_STAGE_SECONDS.time(stage='output_upload'):
+        rows = iter_db_output_rows(db_info)
+        upload_output_rows_minio(minio_client, OUTPUT_FILE_NAME, OUTPUT_HEADERS,
+                                 parquet_writer.tee(rows) if parquet_writer is not None else rows)
+    if parquet_writer is not None:
+        upload_parquet_minio(minio_client, parquet_writer, parquet)
+    clear_output_changes(db_info, version)
+
+
+def get_output_manifest_minio(minio_client: Minio) -> Union[dict, None]:
+    """
+    A method to get the manifest of the output in the 'delta' layout. It has the sequence number of the latest
+    published object, the name of the base snapshot and its number of rows, the names of the deltas applied on top of
+    the base in order and their total number of rows, and the names of the objects retired by the latest compaction.
+    :param minio_client: the MinIO client which reads the data.
+    :return: the manifest as a dictionary, or None if the output was never published in the 'delta' layout.
+    """
+    contents = read_bytes_object_minio(minio_client, PROCESSED_DATA_BUCKET, OUTPUT_DELTA_MANIFEST_NAME)
+    return json.loads(contents) if contents else None
+
+
+def put_output_manifest_minio(minio_client: Minio, manifest: dict) -> None:
+    """
+    A method to upload the manifest of the output in the 'delta' layout (see get_output_manifest_minio). Uploading the
+    manifest is what makes a new base or delta visible to the readers.
+    :param minio_client: the MinIO client which handles the write operations.
+    :param manifest: the manifest as a dictionary.
+    :return: None.
+    """
+    contents = json.dumps(manifest).encode()
+    minio_client.put_object(PROCESSED_DATA_BUCKET, OUTPUT_DELTA_MANIFEST_NAME, io.BytesIO(contents), len(contents),
+                            content_type='application/json')
+
+
+def needs_output_compaction(manifest: Union[dict, None], changes: int) -> bool:
+    """
+    A method to check if the deltas should be folded into a new base, i.e. if there is no base yet, if there would be
+    more than OUTPUT_MAX_DELTAS deltas, or if the deltas would hold more than OUTPUT_MAX_DELTA_RATIO of the base's rows.
+    :param manifest: the manifest of the output (see get_output_manifest_minio), or None.
+    :param changes: the number of rows of the next delta.
+    :return: a boolean representing if a compaction is needed.
+    """
+    if manifest is None:
+        return True
+    return len(manifest['deltas']) + 1 > OUTPUT_MAX_DELTAS or \
+        manifest['delta_rows'] + changes > OUTPUT_MAX_DELTA_RATIO * manifest['base_rows']
+
+
+def remove_parquet_minio(minio_client: Minio) -> None:
+    """
+    A method to remove the Parquet snapshot from MinIO, either as one file or partitioned (see upload_parquet_minio).
+    :param minio_client: the MinIO client which handles the write operations.
+    :return: None.
+    """
+    partitions = [minio_object.object_name for minio_object in
+                  list_objects_minio(minio_client, PROCESSED_DATA_BUCKET, OUTPUT_PARQUET_PREFIX)]
+    remove_objects_minio(minio_client, PROCESSED_DATA_BUCKET, [OUTPUT_PARQUET_NAME] + partitions)
+
+
+def publish_output_delta_minio(db_info: dict, minio_client: Minio) -> None:
+    """
+    A method to publish the output in the 'delta' layout: a base snapshot output/base-<sequence>.csv, plus a delta
+    output/delta-<sequence>.csv per publication holding only the users whose rows changed since the previous one (an
+    'upsert' op with the new row, or a 'delete' op with the user_id). So the volume written by a run follows the number
+    of changed users rather than the size of the dataset. Once needs_output_compaction says so, the base is instead
+    rewritten from the database, folding the deltas. Each object is uploaded before the manifest which refers to it;
+    the objects of the previous generation are kept until the next compaction, for the readers which still hold the
+    previous manifest. No Parquet snapshot is written in this layout, since it would be stale between two compactions,
+    so a snapshot left by the 'full' layout is removed when the base is rewritten.
+    :param db_info: a dictionary containing the postgres database info.
+    :param minio_client: the MinIO client which handles the write operations.
+    :return: None.
+    """
+    changes, version = get_output_changes(db_info)
+    manifest = get_output_manifest_minio(minio_client)
+    if manifest is not None and not changes:
+        return
+    sequence = manifest['sequence'] + 1 if manifest is not None else 1
+    with INGESTION_STAGE_SECONDS.time(stage='output_upload'):
+        if needs_output_compaction(manifest, len(changes)):
+            base = f'{OUTPUT_DELTA_PREFIX}base-{sequence:08d}.csv'
+            base_rows = upload_output_rows_minio(minio_client, base, OUTPUT_HEADERS, iter_db_output_rows(db_info))
+            retired = [manifest['base']] + manifest['deltas'] if manifest is not None else []
+            put_output_manifest_minio(minio_client, {'sequence': sequence, 'base': base, 'base_rows': base_rows,
+                                                     'deltas': [], 'delta_rows': 0, 'retired': retired})
+            if manifest is not None:
+                remove_objects_minio(minio_client, PROCESSED_DATA_BUCKET, manifest['retired'])
+            remove_parquet_minio(minio_client)
+        else:
+            delta = f'{OUTPUT_DELTA_PREFIX}delta-{sequence:08d}.csv'
+            upload_output_rows_minio(minio_client, delta, OUTPUT_DELTA_HEADERS,
+                                     (['upsert'] + row if row is not None else ['delete', user_id, '', '', '', '']
+                                      for user_id, row in changes))
+            put_output_manifest_minio(minio_client, {**manifest, 'sequence': sequence,
+                                                     'deltas': manifest['deltas'] + [delta],
+                                                     'delta_rows': manifest['delta_rows'] + len(changes)})
+    clear_output_changes(db_info, version)
+
+
+def iter_output_rows_minio(minio_client: Minio) -> Iterator[List[str]]:
+    """
+    A method to stream the consolidated output rows of the 'delta' layout, i.e. the base snapshot with the deltas
+    applied in order. Only the deltas are held in memory (their size is bounded by the compaction), the base is
+    streamed. The rows keep the base's order, and the users added by the deltas follow, ordered by user_id.
+    :param minio_client: the MinIO client which reads the data.
+    :return: an iterator of the output rows [user_id, first_name, last_name, birthts, img_path], or no rows if the
+    output was never published in the 'delta' layout.
+    """
+    manifest = get_output_manifest_minio(minio_client)
+    if manifest is None:
+        return
+    changes = {}
+    for delta in manifest['deltas']:
+        for row in itertools.islice(iter_rows_csv_minio(minio_client, PROCESSED_DATA_BUCKET, delta), 1, None):
+            changes[row[1]] = row[1:] if row[0] == 'upsert' else None
+    for row in itertools.islice(iter_rows_csv_minio(minio_client, PROCESSED_DATA_BUCKET, manifest['base']), 1, None):
+        if row[0] in changes:
+            row = changes.pop(row[0])
+        if row is not None:
+            yield row
+    for user_id in sorted(changes):
+        if changes[user_id] is not None:
+            yield changes[user_id]
+
+
+def consolidate_output_minio(minio_client: Minio) -> int:
+    """
+    A method to write the consolidated output of the 'delta' layout (see iter_output_rows_minio) as output.csv, for the
+    readers which expect a single file.
+    :param minio_client: the MinIO client which handles the read / write operations.
+    :return: the number of rows written.
+    """
+    with INGESTION_STAGE_SECONDS.time(stage='output_consolidate'):
+        return upload_output_rows_minio(minio_client, OUTPUT_FILE_NAME, OUTPUT_HEADERS,
+                                        iter_output_rows_minio(minio_client))
+
+
+def process_all_data_minio(db_info: dict, minio_client: Minio, with_print: bool = False,
+                           batch_size: int = DB_BATCH_SIZE, full: bool = False, concurrency: int = FETCH_CONCURRENCY,
+                           progress: Union[Callable[[int, int, int, int], None], None] = None,
+                           parquet: str = OUTPUT_PARQUET, processes: int = PARSE_PROCESSES,
+                           layout: str = OUTPUT_LAYOUT, shards: Union[Collection[int], None] = None,
+                           shard_count: int = 1, publish: bool = True, quarantine: str = QUARANTINE,
+                           resync: str = RESYNC) -> Tuple[int, int]:
     """
     The main method for running the whole data processing from src in MinIO to output.csv and the postgres database. It
-    first creates a temp output csv file locally (not in MinIO). Then it puts all the data processing results in that
-    temp file. When it is done processing all files, it deletes the output.csv file in MinIO and uploads the temp file
-    as the new output.csv file in MinIO. Finally it removes the temp file locally.
+    lists the src bucket once and compares the listing with the manifest of the previously processed files (their
+    etags, sizes and matching images), so that only the added or changed files are downloaded and processed. The files
+    are fetched and validated by a pool of concurrency threads, while their results are consumed in the listing order
+    by a single writer: the valid rows are buffered and written to the database in batches of batch_size rows, together
+    with their manifest entries. Files which were removed (or became invalid) are dropped from the manifest. The invalid
+    files are recorded in source_rejects with their etag and the reason of their rejection (and optionally put in
+    quarantine), so they are skipped by the next runs until they change. A file which could not be fetched is counted as
+    an error, but it is neither recorded nor put in quarantine, and its manifest entry is kept, so it is retried by the
+    next run. In a resync (e.g. an initial load, or to recover the database), all the files are processed, and their
+    rows are spooled to temporary files instead of being written in batches, then loaded at once with COPY and merged
+    in one transaction (see resync_users_copy); a file which could not be fetched fails the resync, since its users
+    would be taken for missing ones. Finally,
+    if anything changed, the dataset version is bumped (invalidating the cached responses) and the output is published
+    from the database so that it contains all the users whose files are in the manifest (see publish_output_minio).
     :param with_print: a boolean to indicate if the method should print while processing.
     :param minio_client: the MinIO client which handles the read / write operations.
     :param db_info: a dictionary containing the postgres database info.
+    :param batch_size: the number of rows written to the database at once.
+    :param full: a boolean to indicate that all the files should be processed regardless of the manifest.
+    :param concurrency: the number of files fetched and validated at the same time.
+    :param progress: a function called after each file with the number of files done (the unchanged files count as
+    done), the total number of files, the number of successfully processed files and the number of errors.
+    :param parquet: the mode of the Parquet snapshot published alongside output.csv (see publish_output_minio).
+    :param processes: the number of worker processes parsing and validating the files (see
+    get_users_rows_processes_minio), or 0 to parse them in the fetching threads.
+    :param layout: the output's layout, one of OUTPUT_LAYOUTS ('full' or 'delta').
+    :param shards: the shards (see get_source_shard) whose csv files are processed, or None to process all of them.
+    The files of the other shards are left to the other replicas of the app (see coordination.py).
+    :param shard_count: the number of shards.
+    :param publish: a boolean to indicate if the output is published after the run.
+    :param quarantine: the quarantine's mode of the rejected files (see quarantine_source_minio).
+    :param resync: the resync's mode, one of RESYNC_MODES: 'off' for a normal run, 'merge' to resync the database with
+    all the files, detaching the users whose files do not exist anymore (or are invalid), or 'replace' to also delete
+    those users. A resync can not be sharded.
     :return: a tuple of two integers. The first is the successfully processed files, the other is for the total number
-    of csv files in the src.
+    of csv files in the src (in the given shards).
     """
-    create_temp_minio()
-    src_csv_files = get_files_with_extension_minio(minio_client, SRC_DATA_BUCKET, '.csv')
-    success = 0
-    for csv_file in src_csv_files:
-        processed, msg = proc_csv_file_minio(db_info, minio_client, csv_file)
-        if processed:
-            success += 1
-            if with_print:
-                print(f"The file {csv_file} was successfully processed.", msg)
+    assert resync in RESYNC_MODES and (resync == 'off' or shards is None)
+    full = full or resync != 'off'
+    with INGESTION_RUN_SECONDS.time(), ExitStack() as stack:
+        resync_files = [stack.enter_context(tempfile.SpooledTemporaryFile(max_size=RESYNC_SPOOL_MAX_SIZE))
+                        for _ in range(2 if resync != 'off' else 0)]
+        with INGESTION_STAGE_SECONDS.time(stage='list'):
+            csv_objects, img_etags = list_src_objects_minio(minio_client)
+        with INGESTION_STAGE_SECONDS.time(stage='manifest'):
+            manifest = get_source_objects(db_info)
+            source_rejects = get_source_rejects(db_info)
+        if shards is not None:
+            csv_objects, manifest, source_rejects = [
+                {csv_file: entry for csv_file, entry in objects.items()
+                 if get_source_shard(csv_file, shard_count) in shards}
+                for objects in [csv_objects, manifest, source_rejects]]
+        batch_files = [csv_file for csv_file, entry in manifest.items() if entry[2] == BATCH_IMG_ETAG]
+        with INGESTION_STAGE_SECONDS.time(stage='manifest'):
+            source_users = get_source_users_images(db_info, batch_files) if batch_files and not full else {}
+        changed, removed = diff_source_objects(csv_objects, img_etags, manifest, full, source_rejects, source_users)
+        changed_set = set(changed)
+        success = len([csv_file for csv_file in manifest if csv_file in csv_objects and csv_file not in changed_set])
+        INGESTION_FILES.inc(success, result='unchanged')
+        files_done = len(csv_objects) - len(changed)
+        errors = files_done - success
+        INGESTION_FILES.inc(errors, result='rejected_unchanged')
+        if with_print and errors:
+            print(f"{errors} files were skipped since they were rejected before and did not change.")
+        if progress is not None:
+            progress(files_done, len(csv_objects), success, errors)
+        db_rows, processed_objects = [], []
+        rejected_objects, cleared_rejects = [], []
+        if processes > 0:
+            results = get_users_rows_processes_minio(minio_client, changed, img_etags, concurrency, processes)
         else:
-            if with_print:
-                print(f"The file {csv_file} was not processed. The following error occurred: {msg}")
-    try:
-        minio_client.remove_object(PROCESSED_DATA_BUCKET, OUTPUT_FILE_NAME)
-    except:
-        pass
-    minio_client.fput_object(PROCESSED_DATA_BUCKET, OUTPUT_FILE_NAME, OUTPUT_TEMP_FILE_PATH)
-    os.remove(OUTPUT_TEMP_FILE_PATH)
-    return success, len(src_csv_files)
+            results = imap_bounded(lambda csv_file: get_user_rows_or_error_minio(minio_client, csv_file, img_etags),
+                                   changed, concurrency)
+        for csv_file, result in zip(changed, results):
+            if isinstance(result, Exception):
+                if resync_files:
+                    raise result
+                errors += 1
+                INGESTION_FILES.inc(result='fetch_error')
+                if with_print:
+                    print(f"The file {csv_file} could not be fetched, it is retried in the next run: {result}")
+                files_done += 1
+                if progress is not None:
+                    progress(files_done, len(csv_objects), success, errors)
+                continue
+            processed, msg, rows, rejects = result
+            if processed:
+                success += 1
+                INGESTION_FILES.inc(result='processed')
+                INGESTION_ROWS.inc(len(rows), result='accepted')
+                INGESTION_ROWS.inc(len(rejects), result='rejected')
+                etag, size, last_modified = csv_objects[csv_file]
+                img_etag = get_manifest_img_etag(csv_file, [row[0] for row in rows], img_etags)
+                db_rows.extend(row + [csv_file] for row in rows)
+                processed_objects.append((csv_file, etag, size, last_modified, img_etag))
+                if csv_file in source_rejects:
+                    cleared_rejects.append(csv_file)
+                if len(db_rows) >= batch_size:
+                    if resync_files:
+                        write_csv_rows(resync_files[0], db_rows)
+                        write_csv_rows(resync_files[1], processed_objects)
+                    else:
+                        with INGESTION_STAGE_SECONDS.time(stage='db_upsert'):
+                            update_db_batch(db_info, db_rows, processed_objects)
+                    db_rows, processed_objects = [], []
+                if with_print:
+                    print(f"The file {csv_file} was successfully processed.")
+                    if rejects:
+                        print(format_rejects_src(len(rows), rejects))
+            else:
+                if csv_file in manifest:
+                    removed.append(csv_file)
+                etag, size, _ = csv_objects[csv_file]
+                rejected_objects.append(reject_source_minio(minio_client, csv_file, etag, size, msg, quarantine))
+                errors += 1
+                INGESTION_FILES.inc(result='invalid')
+                if with_print:
+                    print(f"The file {csv_file} was not processed. The following error occurred: {msg}")
+            files_done += 1
+            if progress is not None:
+                progress(files_done, len(csv_objects), success, errors)
+        with INGESTION_STAGE_SECONDS.time(stage='db_upsert'):
+            if resync_files:
+                write_csv_rows(resync_files[0], db_rows)
+                write_csv_rows(resync_files[1], processed_objects)
+                changed_users, missing_users = resync_users_copy(db_info, *resync_files, resync == 'replace')
+                if with_print:
+                    print(f"The resync added or changed {changed_users} users, and "
+                          f"{'deleted' if resync == 'replace' else 'detached'} {missing_users} users.")
+            else:
+                update_db_batch(db_info, db_rows, processed_objects, removed)
+            removed_rejects = [csv_file for csv_file in source_rejects if csv_file not in csv_objects]
+            if rejected_objects or cleared_rejects or removed_rejects:
+                update_source_rejects(db_info, rejected_objects, cleared_rejects, removed_rejects)
+        if changed or removed:
+            bump_dataset_version()
+        output_name = OUTPUT_DELTA_MANIFEST_NAME if layout == 'delta' else OUTPUT_FILE_NAME
+        if publish and (changed or removed or
+                        get_object_info_minio(minio_client, PROCESSED_DATA_BUCKET, output_name) is None):
+            publish_output_minio(db_info, minio_client, parquet, layout)
+    return success, len(csv_objects)
@@ -0,0 +1,198 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Union
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_registry = []
+
+
+def format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = '') -> str:
+    """
+    A method to format the labels of a metric's sample in the Prometheus text format, e.g. {stage="fetch"}.
+    :param label_names: the names of the labels.
+    :param label_values: the values of the labels in the same order.
+    :param extra: an additional formatted label appended to the others (e.g. le="0.5").
+    :return: the formatted labels, or an empty string if there are no labels.
+    """
+    labels = [name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+              for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Metric:
+    """
+    The base of the metrics exposed in the Prometheus text format. Each metric has a name, a help text and the names of
+    its labels, and keeps one value per combination of label values. Metrics register themselves when they are created,
+    in the global registry rendered by /metrics unless another registry is given.
+    """
+    type_name = ''
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                 registry: Union[List['Metric'], None] = None):
+        """
+        :param name: the name of the metric.
+        :param help_text: the description of the metric.
+        :param label_names: the names of the metric's labels.
+        :param registry: the list of metrics the metric is added to (the global registry if None).
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+        (_registry if registry is None else registry).append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """
+        A method to get the label values of a sample in the order of the metric's label names.
+        :param labels: the labels as a dictionary.
+        :return: a tuple of the label values.
+        """
+        assert set(labels) == set(self.label_names)
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> List[str]:
+        """
+        A method to get the metric's samples in the Prometheus text format.
+        :return: a list of lines.
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """
+        A method to render the metric in the Prometheus text format.
+        :return: the metric's help, type and samples.
+        """
+        return '\n'.join([f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.type_name}',
+                          *self.samples()])
+
+
+class Counter(Metric):
+    """
+    A metric counting events, e.g. the processed files.
+    """
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        A method to increase the counter.
+        :param amount: the increase.
+        :param labels: the labels of the sample.
+        :return: None.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f'{self.name}{format_labels(self.label_names, key)} {value}'
+                    for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    """
+    A metric whose value can go up and down, e.g. the connections in use.
+    """
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        """
+        A method to set the value of the gauge.
+        :param value: the new value.
+        :param labels: the labels of the sample.
+        :return: None.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f'{self.name}{format_labels(self.label_names, key)} {value}'
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    """
+    A metric sampling durations (in seconds) into cumulative buckets, alongside their sum and count.
+    """
+    type_name = 'histogram'
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, registry: Union[List[Metric], None] = None):
+        """
+        :param name: the name of the metric.
+        :param help_text: the description of the metric.
+        :param label_names: the names of the metric's labels.
+        :param buckets: the upper bounds of the buckets in increasing order.
+        :param registry: the list of metrics the metric is added to (the global registry if None).
+        """
+        super().__init__(name, help_text, label_names, registry)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        A method to add an observation to the histogram.
+        :param value: the observed value.
+        :param labels: the labels of the sample.
+        :return: None.
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        A context manager observing the duration of its block.
+        :param labels: the labels of the sample.
+        :return: None.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    le = 'le="+Inf"' if bound == math.inf else f'le="{bound}"'
+                    lines.append(f'{self.name}_bucket{format_labels(self.label_names, key, le)} {count}')
+                lines.append(f'{self.name}_sum{format_labels(self.label_names, key)} {total}')
+                lines.append(f'{self.name}_count{format_labels(self.label_names, key)} {counts[-1]}')
+        return lines
+
+
+def render_metrics(registry: Union[List[Metric], None] = None) -> str:
+    """
+    A method to render all the registered metrics in the Prometheus text format.
+    :param registry: the list of metrics rendered (the global registry if None).
+    :return: the metrics as a string.
+    """
+    return '\n'.join(metric.render() for metric in (_registry if registry is None else registry)) + '\n'
+
+
+INGESTION_STAGE_SECONDS = Histogram('ingestion_stage_seconds', 'Time spent in each stage of the data processing.',
+                                    ('stage',))
+INGESTION_RUN_SECONDS = Histogram('ingestion_run_seconds', 'Time spent in a whole data processing run.')
+INGESTION_FILES = Counter('ingestion_files_total', 'Source csv files processed, by result.', ('result',))
+INGESTION_ROWS = Counter('ingestion_rows_total', 'Users rows read from the processed csv files, by result.',
+                         ('result',))
+DATA_GET_SECONDS = Histogram('data_get_request_seconds', 'Latency of GET /data requests, by filter combination.',
+                             ('filters',))
+DB_POOL = Gauge('db_pool', 'Statistics of the postgres connection pool.', ('stat',))
+DATA_CACHE = Gauge('data_cache', 'Statistics of the GET /data responses cache.', ('stat',))
+APP_STARTUP_SECONDS = Gauge('app_startup_seconds', 'Time the app took to start, by phase (import, ready).', ('phase',))
@@ -1,29 +1,42 @@
+from __future__ import annotations
 import io
-from typing import List
+from typing import TYPE_CHECKING, Iterator, List, Union
 
-from data_processing.helpers import get_extension
-from minio import Minio
+from data_processing.helpers import get_extension, iter_decoded_lines, iter_csv_rows_stripped
+
+if TYPE_CHECKING:
+    from minio import Minio
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def get_object_info_minio(minio_client: Minio, bucket: str, minio_object: str):
+    """
+    A method to get the information (etag, size, last_modified) of an object in MinIO without downloading it.
+    :param minio_client: the MinIO client which reads the data.
+    :param bucket: the MinIO bucket name.
+    :param minio_object: the MinIO object name
+    :return: the object's information, or None if the object does not exist. An error is raised if the information
+    could not be fetched for another reason (e.g. the server is not reachable or the credentials are wrong).
+    """
+    try:
+        return minio_client.stat_object(bucket, minio_object)
+    except Exception as e:
+        if is_missing_object_error(e):
+            return None
+        raise
 
 
 def is_file_exist_minio(minio_client: Minio, minio_bucket: str, minio_object: str) -> bool:
     """
-    a helper method to check if an object exist in a MinIO bucket.
+    a helper method to check if an object exist in a MinIO bucket. Only the object's information is requested, the
+    object itself is not downloaded.
     :param minio_client: the MinIO client which reads the data.
     :param minio_bucket: the MinIO bucket name.
     :param minio_object: the MinIO object name
     :return: a boolean value representing the object exists or not.
     """
-    response = None
-    try:
-        response = minio_client.get_object(minio_bucket, minio_object)
-    except:
-        if response is not None:
-            response.close()
-            response.release_conn()
-        return False
-    response.close()
-    response.release_conn()
-    return True
+    return get_object_info_minio(minio_client, minio_bucket, minio_object) is not None
 
 
 def read_file_object_minio(minio_client: Minio, minio_bucket: str, minio_object: str) -> str:
@@ -49,6 +62,81 @@ def read_file_object_minio(minio_client: Minio, minio_bucket: str, minio_object:
     return res
 
 
+def is_missing_object_error(error: Exception) -> bool:
+    """
+    A helper method to check if an error raised by the MinIO client means that the requested object does not exist.
+    :param error: the error.
+    :return: a boolean value representing if the object does not exist.
+    """
+    return getattr(error, 'code', None) == 'NoSuchKey'
+
+
+def read_bytes_object_minio(minio_client: Minio, minio_bucket: str, minio_object: str) -> bytes:
+    """
+    A helper method to read the contents of an object in MinIO as bytes.
+    :param minio_client: the MinIO client which reads the data.
+    :param minio_bucket: the MinIO bucket name.
+    :param minio_object: the MinIO object name
+    :return: the contents of the object, or empty bytes if the object does not exist. An error is raised if the object
+    could not be fetched for another reason (e.g. the server is not reachable).
+    """
+    try:
+        response = minio_client.get_object(minio_bucket, minio_object)
+    except Exception as e:
+        if is_missing_object_error(e):
+            return b''
+        raise
+    try:
+        return response.data
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def list_objects_minio(minio_client: Minio, bucket: str, prefix: Union[str, None] = None) -> list:
+    """
+    A method to list all the objects in a given bucket with their information (name, etag, size, last_modified).
+    :param minio_client: the MinIO client which reads the data.
+    :param bucket: the targeted bucket.
+    :param prefix: if given, only the objects whose names start with it are listed (recursively).
+    :return: a list of the objects in the bucket. An error is raised if the bucket could not be listed (e.g. the server
+    is not reachable), so a failed listing is never taken for an empty bucket.
+    """
+    if prefix is None:
+        return list(minio_client.list_objects(bucket))
+    return list(minio_client.list_objects(bucket, prefix=prefix, recursive=True))
+
+
+def remove_objects_minio(minio_client: Minio, bucket: str, object_names: List[str]) -> None:
+    """
+    A method to remove some objects from a bucket. The objects which do not exist are ignored.
+    :param minio_client: the MinIO client which handles the write operations.
+    :param bucket: the targeted bucket.
+    :param object_names: the names of the objects.
+    :return: None.
+    """
+    for object_name in object_names:
+        try:
+            minio_client.remove_object(bucket, object_name)
+        except:
+            pass
+
+
+def copy_object_minio(minio_client: Minio, bucket: str, object_name: str, target_bucket: str, target_name: str) \
+        -> None:
+    """
+    A method to copy an object on the MinIO server, without downloading it.
+    :param minio_client: the MinIO client which handles the write operations.
+    :param bucket: the bucket of the copied object.
+    :param object_name: the name of the copied object.
+    :param target_bucket: the bucket of the copy.
+    :param target_name: the name of the copy.
+    :return: None.
+    """
+    from minio.commonconfig import CopySource
+    minio_client.copy_object(target_bucket, target_name, CopySource(bucket, object_name))
+
+
 def get_files_with_extension_minio(minio_client: Minio, bucket: str, extension: str) -> List[str]:
     """
     A method to get all the files in a given bucket with the given extension.
@@ -57,10 +145,7 @@ def get_files_with_extension_minio(minio_client: Minio, bucket: str, extension:
     :param extension: the desired extension of the files.
     :return: a list of strings containing the object names of the files in the given bucket which match the extension.
     """
-    try:
-        all_files = list(minio_client.list_objects(bucket))
-    except:
-        return []
+    all_files = list_objects_minio(minio_client, bucket)
     files_with_extension = []
     for file in all_files:
         if get_extension(file.object_name) == extension:
@@ -96,6 +181,34 @@ def create_file_minio(minio_client: Minio, bucket: str, file_name: str, file_con
         pass
 
 
+def iter_rows_csv_minio(minio_client: Minio, bucket: str, file_name: str, chunk_size: int = READ_CHUNK_SIZE) \
+        -> Iterator[List[str]]:
+    """
+    A method to stream the rows of a csv file in MinIO. The object is downloaded chunk_size bytes at a time and the
+    chunks are decoded incrementally and parsed by the csv module (so quoted fields are supported), so the memory used
+    depends on the size of a row and not of the file. The consumer can stop early (e.g. once the file is known to be
+    invalid): the connection is released when the iterator is exhausted or closed.
+    :param minio_client: the MinIO client which reads the data.
+    :param bucket: the bucket where the file object is located.
+    :param file_name: the name of the object/file.
+    :param chunk_size: the number of bytes read at once.
+    :return: an iterator of the file's rows in order (including the headers), without the empty rows. Each row is a
+    list itself of the row items, stripped of their surrounding spaces. If the object does not exist, there are no rows.
+    An error is raised if the object could not be fetched for another reason (e.g. the server is not reachable).
+    """
+    try:
+        response = minio_client.get_object(bucket, file_name)
+    except Exception as e:
+        if is_missing_object_error(e):
+            return
+        raise
+    try:
+        yield from iter_csv_rows_stripped(iter_decoded_lines(response.stream(chunk_size)))
+    finally:
+        response.close()
+        response.release_conn()
+
+
 def get_rows_csv_minio(minio_client: Minio, bucket: str, file_name: str) -> List[List[str]]:
     """
     A method to get the contents of a csv file in MinIO.
@@ -104,16 +217,7 @@ def get_rows_csv_minio(minio_client: Minio, bucket: str, file_name: str) -> List
     :param file_name: the name of the object/file.
     :return: a list of the file's rows in order (including the headers). Each row is a list itself of the row items.
     """
-    file_lines = read_file_object_minio(minio_client, bucket, file_name).split('\n')
-    rows = []
-    for line in file_lines:
-        if line == '':
-            continue
-        temp = line.split(',')
-        for i in range(len(temp)):
-            temp[i] = temp[i].strip()
-        rows.append(temp)
-    return rows
+    return list(iter_rows_csv_minio(minio_client, bucket, file_name))
 
 
 # if __name__ == '__main__':
@@ -0,0 +1,178 @@
+from __future__ import annotations
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, List, Union
+from urllib.parse import unquote_plus
+from data_processing.main import *
+
+if TYPE_CHECKING:
+    from minio import Minio
+
+EVENTS = ('s3:ObjectCreated:*', 's3:ObjectRemoved:*')
+EVENTS_BATCH_WINDOW = 2.0
+EVENTS_BATCH_MAX_SIZE = 500
+RECONCILE_RETRY_TIME = 10 * 60
+LISTEN_RETRY_TIME = 5
+RECONCILE = None
+
+
+def get_event_user_ids(event: dict) -> List[str]:
+    """
+    A method to get the ids of the users affected by a MinIO bucket notification, i.e. the users whose csv file or image
+    was created or removed.
+    :param event: the notification as returned by the MinIO client, a dictionary with a list of 'Records'.
+    :return: a list of the affected users' ids in order, without duplicates.
+    """
+    user_ids = []
+    for record in event.get('Records', []):
+        object_name = unquote_plus(record.get('s3', {}).get('object', {}).get('key', ''))
+        if get_extension(object_name) in ['.csv', IMG_EXTENSION] and get_filename(object_name) not in user_ids:
+            user_ids.append(get_filename(object_name))
+    return user_ids
+
+
+class BucketEventsIngestion:
+    """
+    Event driven data processing. A listener thread subscribes to the put / delete notifications of the src bucket and
+    queues the affected users' ids, while a worker thread coalesces the queued ids into micro-batches: it waits up to
+    batch_window seconds (or batch_max_size users) after the first id of a batch, processes each affected user once with
+    proc_csv_file_minio, and publishes the output once per batch. A full reconcile runs when the ingestion starts,
+    when the notifications stream is restored after dropping, and every reconcile_time seconds while it is down. The
+    micro-batches are processed while holding lock, so they never run concurrently with the other data processing jobs
+    sharing it (see IngestionJobs.run_lock).
+    """
+
+    def __init__(self, db_info: dict, minio_client: Minio, reconcile: Callable[[], object],
+                 batch_window: float = EVENTS_BATCH_WINDOW, batch_max_size: int = EVENTS_BATCH_MAX_SIZE,
+                 reconcile_time: float = RECONCILE_RETRY_TIME, with_print: bool = False,
+                 parquet: str = OUTPUT_PARQUET, layout: str = OUTPUT_LAYOUT, quarantine: str = QUARANTINE,
+                 lock: Union[threading.Lock, None] = None):
+        """
+        :param db_info: a dictionary containing the postgres database info.
+        :param minio_client: the MinIO client which handles the read / write operations.
+        :param reconcile: a function running the whole data processing (e.g. process_all_data_minio).
+        :param batch_window: the number of seconds to wait for more notifications after the first one of a batch.
+        :param batch_max_size: the maximum number of users in a batch.
+        :param reconcile_time: the number of seconds between full reconciles while the notifications stream is down.
+        :param with_print: a boolean to indicate if the ingestion should print while processing.
+        :param parquet: the mode of the Parquet snapshot published alongside output.csv (see publish_output_minio).
+        :param layout: the output's layout, 'full' or 'delta' (see publish_output_minio).
+        :param quarantine: the quarantine's mode of the rejected files (see quarantine_source_minio).
+        :param lock: the lock held while processing a micro-batch, shared with the reconcile's runner (e.g.
+        IngestionJobs.run_lock). If not given, a lock of this ingestion is used.
+        """
+        self.db_info = db_info
+        self.minio_client = minio_client
+        self.reconcile = reconcile
+        self.batch_window = batch_window
+        self.batch_max_size = batch_max_size
+        self.reconcile_time = reconcile_time
+        self.with_print = with_print
+        self.parquet = parquet
+        self.layout = layout
+        self.quarantine = quarantine
+        self.lock = lock if lock is not None else threading.Lock()
+        self.stream_up = False
+        self._queue = queue.Queue()
+
+    def start(self) -> None:
+        """
+        A method to start the listener and the worker threads in the background.
+        :return: None.
+        """
+        self._queue.put(RECONCILE)
+        threading.Thread(target=self.listen, daemon=True).start()
+        threading.Thread(target=self.work, daemon=True).start()
+
+    def listen(self) -> None:
+        """
+        A method for listening to the src bucket notifications and queueing the affected users' ids. When the stream
+        drops, it keeps trying to subscribe again, and queues a full reconcile once it is restored.
+        :return: None.
+        """
+        was_down = False
+        while True:
+            try:
+                with self.minio_client.listen_bucket_notification(SRC_DATA_BUCKET, events=EVENTS) as events:
+                    self.stream_up = True
+                    if was_down:
+                        self._queue.put(RECONCILE)
+                        was_down = False
+                    for event in events:
+                        for user_id in get_event_user_ids(event):
+                            self._queue.put(user_id)
+            except Exception as e:
+                if self.with_print:
+                    print(f"The notifications stream of {SRC_DATA_BUCKET} dropped. The following error occurred: {e}")
+            self.stream_up = False
+            was_down = True
+            time.sleep(LISTEN_RETRY_TIME)
+
+    def next_batch(self, timeout: float) -> Union[List[str], None]:
+        """
+        A method to get the next micro-batch of queued users' ids.
+        :param timeout: the number of seconds to wait for the first id of the batch.
+        :return: the list of users' ids without duplicates (it contains RECONCILE if a full reconcile was requested), or
+        None if nothing was queued during the timeout.
+        """
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return None
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return list(dict.fromkeys(batch))
+
+    def process_batch(self, user_ids: List[str]) -> None:
+        """
+        A method to process the csv files of a micro-batch of users, then bump the dataset version and publish the
+        output once. The lock is held while processing the batch. A file which could not be fetched is skipped.
+        :param user_ids: the affected users' ids.
+        :return: None.
+        """
+        with self.lock:
+            for user_id in user_ids:
+                csv_file = user_id + '.csv'
+                try:
+                    processed, msg = proc_csv_file_minio(self.db_info, self.minio_client, csv_file, self.quarantine)
+                except Exception as e:
+                    if self.with_print:
+                        print(f"The file {csv_file} could not be fetched, it is retried by the next reconcile: {e}")
+                    continue
+                if self.with_print:
+                    if processed:
+                        print(f"The file {csv_file} was successfully processed.", msg)
+                    else:
+                        print(f"The file {csv_file} was not processed. The following error occurred: {msg}")
+            bump_dataset_version()
+            publish_output_minio(self.db_info, self.minio_client, self.parquet, self.layout)
+
+    def work(self) -> None:
+        """
+        A method for processing the queued micro-batches forever. While the notifications stream is down, it runs a
+        full reconcile every reconcile_time seconds instead.
+        :return: None.
+        """
+        last_reconcile = time.monotonic()
+        while True:
+            batch = self.next_batch(timeout=self.reconcile_time)
+            try:
+                if batch is not None and RECONCILE in batch:
+                    self.reconcile()
+                    last_reconcile = time.monotonic()
+                elif batch is not None:
+                    self.process_batch(batch)
+                if not self.stream_up and time.monotonic() - last_reconcile >= self.reconcile_time:
+                    self.reconcile()
+                    last_reconcile = time.monotonic()
+            except Exception as e:
+                if self.with_print:
+                    print(f"The ingestion batch was not processed. The following error occurred: {e}")
@@ -0,0 +1,139 @@
+import importlib.util
+import tempfile
+from typing import Iterable, Iterator, List, Tuple
+
+PARQUET_BATCH_ROWS = 64 * 1024
+PARQUET_SPOOL_MAX_SIZE = 64 * 1024 * 1024
+PARQUET_COMPRESSION = 'zstd'
+PARTITION_COLUMN = 'birth_decade'
+
+
+def is_parquet_available() -> bool:
+    """
+    A method to check if pyarrow, which writes the Parquet files, is installed. pyarrow itself is only imported once a
+    snapshot is written, so importing this module stays cheap.
+    :return: a boolean representing if Parquet files can be written.
+    """
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def get_output_schema():
+    """
+    A method to get the schema of the output Parquet files: the birthts is an int64, the names are dictionary encoded,
+    and has_image tells if the user has an image.
+    :return: the pyarrow schema.
+    """
+    import pyarrow as pa
+    names = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([('user_id', pa.string()), ('first_name', names), ('last_name', names),
+                      ('birthts', pa.int64()), ('img_path', pa.string()), ('has_image', pa.bool_())])
+
+
+def rows_to_record_batch(rows: List[List[str]]):
+    """
+    A method to convert output rows to a typed record batch (see get_output_schema).
+    :param rows: the output rows [user_id, first_name, last_name, birthts, img_path].
+    :return: the pyarrow record batch.
+    """
+    import pyarrow as pa
+    user_ids, first_names, last_names, birthts, img_paths = (list(column) for column in zip(*rows))
+    return pa.record_batch([pa.array(user_ids, pa.string()),
+                            pa.array(first_names, pa.string()).dictionary_encode(),
+                            pa.array(last_names, pa.string()).dictionary_encode(),
+                            pa.array([int(value) for value in birthts], pa.int64()),
+                            pa.array(img_paths, pa.string()),
+                            pa.array([img_path != '' for img_path in img_paths], pa.bool_())],
+                           schema=get_output_schema())
+
+
+class OutputParquetWriter:
+    """
+    A writer of the output rows as a Parquet snapshot, in one file or partitioned by the users' birth decade (one file
+    per decade, in hive style directories birth_decade=<year>). The rows are converted to typed record batches of
+    PARQUET_BATCH_ROWS rows, each written as a row group, so readers can project columns and skip row groups using their
+    statistics. The files are written to buffers which stay in memory up to PARQUET_SPOOL_MAX_SIZE bytes and spill to
+    temporary files past that.
+    """
+
+    def __init__(self, partitioned: bool = False, batch_rows: int = PARQUET_BATCH_ROWS):
+        """
+        :param partitioned: a boolean to indicate if the snapshot is partitioned by birth decade.
+        :param batch_rows: the number of rows in each record batch.
+        """
+        assert is_parquet_available(), 'pyarrow is required to write Parquet files.'
+        self.partitioned = partitioned
+        self.batch_rows = batch_rows
+        self.rows = 0
+        self._buffer = []
+        self._files = {}
+
+    def _get_writer(self, partition: str):
+        """
+        A method to get the Parquet writer of a partition, creating it on the first use.
+        :param partition: the relative path of the partition's file.
+        :return: the Parquet writer.
+        """
+        import pyarrow.parquet as pq
+        if partition not in self._files:
+            output = tempfile.SpooledTemporaryFile(max_size=PARQUET_SPOOL_MAX_SIZE)
+            writer = pq.ParquetWriter(output, get_output_schema(), compression=PARQUET_COMPRESSION)
+            self._files[partition] = (output, writer)
+        return self._files[partition][1]
+
+    def flush(self) -> None:
+        """
+        A method to write the buffered rows.
+        :return: None.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        if not self._buffer:
+            return
+        batch = rows_to_record_batch(self._buffer)
+        self._buffer = []
+        if not self.partitioned:
+            self._get_writer('').write_batch(batch)
+            return
+        decades = pc.multiply(pc.divide(pc.year(batch.column(3).cast(pa.timestamp('ms'))), 10), 10)
+        for decade in pc.unique(decades).to_pylist():
+            self._get_writer(f'{PARTITION_COLUMN}={decade}/part-0.parquet') \
+                .write_batch(batch.filter(pc.equal(decades, decade)))
+
+    def add(self, row: List[str]) -> None:
+        """
+        A method to add an output row to the snapshot.
+        :param row: the output row [user_id, first_name, last_name, birthts, img_path].
+        :return: None.
+        """
+        self._buffer.append(row)
+        self.rows += 1
+        if len(self._buffer) >= self.batch_rows:
+            self.flush()
+
+    def tee(self, rows: Iterable[List[str]]) -> Iterator[List[str]]:
+        """
+        A method to add the rows of a stream to the snapshot while passing them on, so the snapshot is written from the
+        same stream as another output (e.g. output.csv).
+        :param rows: the output rows.
+        :return: an iterator of the same rows.
+        """
+        for row in rows:
+            self.add(row)
+            yield row
+
+    def finish(self) -> List[Tuple[str, object, int]]:
+        """
+        A method to write the remaining rows and close the Parquet files. An empty snapshot is one file without rows.
+        :return: a list of tuples (the file's relative path, the file object positioned at its start, its length). The
+        relative path is empty if the snapshot is not partitioned. The caller closes the file objects.
+        """
+        self.flush()
+        if not self._files and not self.partitioned:
+            self._get_writer('')
+        files = []
+        for partition, (output, writer) in self._files.items():
+            writer.close()
+            length = output.tell()
+            output.seek(0)
+            files.append((partition, output, length))
+        return files
@@ -1,102 +1,609 @@
+import threading
+import time
+import uuid
+import warnings
+from contextlib import contextmanager
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Tuple, TypeVar, Union
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
 
+DB_POOL_MIN_SIZE = 1
+DB_POOL_MAX_SIZE = 10
+DB_POOL_TIMEOUT = 30
+DB_RETRIES = 1
+DB_STREAM_ITERSIZE = 2000
+T = TypeVar('T')
 
-def get_db_connection_cursor(db_info: dict):
+
+class DBPoolTimeoutError(Exception):
+    """
+    Raised when no connection in the pool became available within the pool's timeout.
+    """
+
+
+class DBConnectionPool:
+    """
+    A thread-safe pool of connections to the postgres database. Connections are opened lazily up to max_size, kept open
+    for reuse, and a borrower waits (up to timeout seconds) when all of them are in use. A connection found broken
+    (closed, or with a lost server connection) is discarded instead of being returned to the pool, so the next borrow
+    opens a fresh one.
+    """
+
+    def __init__(self, db_info: dict, min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT):
+        """
+        :param db_info: a dictionary containing the database info like its name host, user, password, etc.
+        :param min_size: the number of connections opened when the pool is created.
+        :param max_size: the maximum number of connections open at the same time.
+        :param timeout: the number of seconds a borrower waits for a free connection before giving up.
+        """
+        assert 0 <= min_size <= max_size and max_size > 0
+        self.db_info = db_info
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = []
+        self._in_use = 0
+        self._stats = {'connections_created': 0, 'connections_discarded': 0, 'borrows': 0, 'waits': 0,
+                       'timeouts': 0}
+        for _ in range(min_size):
+            self._idle.append(self._connect())
+
+    def _connect(self):
+        """
+        a method to open a new connection to the postgres database.
+        :return: the new connection.
+        """
+        conn = psycopg2.connect(dbname=self.db_info['db_name'], user=self.db_info['db_user'],
+                                password=self.db_info['db_password'], host=self.db_info['db_host'],
+                                port=self.db_info.get('db_port', 5432))
+        with self._lock:
+            self._stats['connections_created'] += 1
+        return conn
+
+    @staticmethod
+    def _is_broken(conn) -> bool:
+        """
+        a method to check if a connection can not be used anymore.
+        :param conn: the connection to check.
+        :return: a boolean representing if the connection is broken.
+        """
+        return conn.closed != 0 or conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+
+    def get_conn(self):
+        """
+        a method to borrow a connection from the pool. It waits for a free slot if all the connections are in use.
+        :return: a connection to the postgres database. It must be given back with put_conn.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['waits'] += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                raise DBPoolTimeoutError(f'No database connection became available within {self.timeout} seconds.')
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    conn = self._connect()
+                elif self._is_broken(conn):
+                    self._discard(conn)
+                    conn = None
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._stats['borrows'] += 1
+        return conn
+
+    def put_conn(self, conn, broken: bool = False) -> None:
+        """
+        a method to give a borrowed connection back to the pool.
+        :param conn: the borrowed connection.
+        :param broken: a boolean indicating that the connection failed and should be discarded.
+        :return: None.
+        """
+        if not broken and not self._is_broken(conn) and \
+                conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        if broken or self._is_broken(conn):
+            self._discard(conn)
+        else:
+            with self._lock:
+                self._idle.append(conn)
+        with self._lock:
+            self._in_use -= 1
+        self._slots.release()
+
+    def _discard(self, conn) -> None:
+        """
+        a method to close a connection without returning it to the pool.
+        :param conn: the connection to discard.
+        :return: None.
+        """
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._stats['connections_discarded'] += 1
+
+    def close_all(self) -> None:
+        """
+        a method to close all the idle connections in the pool.
+        :return: None.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def get_stats(self) -> dict:
+        """
+        a method to get the current state of the pool and its counters.
+        :return: a dictionary containing the pool's sizes and counters.
+        """
+        with self._lock:
+            return {'min_size': self.min_size, 'max_size': self.max_size, 'in_use': self._in_use,
+                    'idle': len(self._idle), **self._stats}
+
+
+_db_pools = {}
+_db_pools_lock = threading.Lock()
+
+
+def get_db_pool_key(db_info: dict) -> tuple:
     """
-    a method to get a connection to the postgres database given its information.
+    a method to get the key of the shared connection pool of the postgres database, i.e. its connection parameters.
+    :param db_info: a dictionary containing the postgres database info.
+    :return: a tuple of the database's name, user, password, host and port.
+    """
+    return (db_info['db_name'], db_info['db_user'], db_info['db_password'], db_info['db_host'],
+            db_info.get('db_port', 5432))
+
+
+def get_db_pool(db_info: dict) -> DBConnectionPool:
+    """
+    a method to get the shared connection pool of the postgres database given its information. The pool is created on
+    the first call, and its sizes are taken from db_info['db_pool_min_size'] and db_info['db_pool_max_size'] if they
+    exist.
     :param db_info: a dictionary containing the database info like its name host, user, password, etc.
+    :return: the connection pool of the database.
+    """
+    key = get_db_pool_key(db_info)
+    with _db_pools_lock:
+        pool = _db_pools.get(key, None)
+        if pool is None:
+            pool = DBConnectionPool(db_info, int(db_info.get('db_pool_min_size', DB_POOL_MIN_SIZE)),
+                                    int(db_info.get('db_pool_max_size', DB_POOL_MAX_SIZE)),
+                                    float(db_info.get('db_pool_timeout', DB_POOL_TIMEOUT)))
+            _db_pools[key] = pool
+    return pool
+
+
+def get_db_pool_stats(db_info: dict, create: bool = True) -> dict:
+    """
+    a method to get the statistics of the shared connection pool of the postgres database.
+    :param db_info: a dictionary containing the postgres database info.
+    :param create: a boolean to indicate if the pool is created (and connects to the database) when it does not exist
+    yet. Otherwise, no statistics are returned for a pool which does not exist.
+    :return: a dictionary containing the pool's sizes and counters.
+    """
+    if not create:
+        key = get_db_pool_key(db_info)
+        with _db_pools_lock:
+            pool = _db_pools.get(key, None)
+        return {} if pool is None else pool.get_stats()
+    return get_db_pool(db_info).get_stats()
+
+
+@contextmanager
+def db_connection(db_info: dict):
+    """
+    a context manager to borrow a connection from the shared pool. The transaction is committed when the block ends
+    successfully, and rolled back otherwise. Broken connections are discarded when they are given back.
+    :param db_info: a dictionary containing the postgres database info.
     :return: a connection to the postgres database.
     """
-    conn = psycopg2.connect(dbname=db_info['db_name'], user=db_info['db_user'],
-                            password=db_info['db_password'], host=db_info['db_host'])
-    cur = conn.cursor()
-    return conn, cur
+    pool = get_db_pool(db_info)
+    conn = pool.get_conn()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        pool.put_conn(conn)
+        raise
+    else:
+        pool.put_conn(conn)
+
+
+def execute_db(db_info: dict, operation: Callable[..., T], retries: int = DB_RETRIES) -> T:
+    """
+    a method to run an operation on a cursor borrowed from the shared pool in one transaction. If the connection turns
+    out to be broken, the operation is retried on a new connection.
+    :param db_info: a dictionary containing the postgres database info.
+    :param operation: a function taking a cursor and returning the operation's result.
+    :param retries: the number of times the operation is retried after a connection error.
+    :return: the operation's result.
+    """
+    for attempt in range(retries + 1):
+        try:
+            with db_connection(db_info) as conn:
+                with conn.cursor() as cur:
+                    return operation(cur)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if attempt == retries:
+                raise
+            time.sleep(0.1 * (attempt + 1))
+
+
+def run_db_command(db_info: dict, command: str, params=None, fetch: bool = False):
+    """
+    a method to run a single sql command on a connection borrowed from the shared pool.
+    :param db_info: a dictionary containing the postgres database info.
+    :param command: the sql command.
+    :param params: the parameters of the command (if any).
+    :param fetch: a boolean to indicate if the rows returned by the command should be fetched.
+    :return: the fetched rows if fetch is True, None otherwise.
+    """
+    def operation(cur):
+        cur.execute(command, params)
+        return cur.fetchall() if fetch else None
+    return execute_db(db_info, operation)
 
 
 def init_db(db_info: dict) -> None:
     """
-    a method for initiating the database. It mainly creates the users table.
+    a method for initiating the database. It mainly creates the users table and its indexes, the source_objects table
+    which is the manifest of the source objects processed successfully, and the output_changes table which records the
+    users whose output rows changed since the output was last published, the source_rejects table which records the
+    source objects which were rejected as invalid, and the ingestion_leases table which coordinates the replicas of the
+    app (see coordination.py). A users table created by an older version
+    is migrated in place: the duplicated users are removed (keeping the latest row) before adding the
+    unique constraint on user_id, and the birthts column is converted from text to bigint. A birthts written as a
+    decimal number with an integral value (e.g. 1.2e12) is converted, while the users whose birthts is not an integer
+    of at most 18 digits are moved to the users_invalid_birthts table, and a warning is issued with their number.
     :param db_info: a dictionary containing the postgres database info.
     :return: None.
     """
-    conn, cur = get_db_connection_cursor(db_info)
-    command = """CREATE TABLE IF NOT EXISTS users(
+    commands = ["""CREATE TABLE IF NOT EXISTS users(
                 id SERIAL PRIMARY KEY NOT NULL,
                 user_id varchar (50) NOT NULL,
                 first_name varchar (50) NOT NULL,
                 last_name varchar (50) NOT NULL,
-                birthts varchar (50) NOT NULL,
-                img_path varchar (250) NOT NULL
-            );"""
-    cur.execute(command)
-    conn.commit()
-    cur.close()
-    conn.close()
+                birthts bigint NOT NULL,
+                img_path varchar (250) NOT NULL,
+                CONSTRAINT users_user_id_key UNIQUE (user_id)
+            );""",
+                """DO $$
+                DECLARE
+                    invalid_users bigint;
+                BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'users_user_id_key') THEN
+                        DELETE FROM users a USING users b WHERE a.user_id = b.user_id AND a.id < b.id;
+                        ALTER TABLE users ADD CONSTRAINT users_user_id_key UNIQUE (user_id);
+                    END IF;
+                    IF (SELECT data_type FROM information_schema.columns
+                        WHERE table_name = 'users' AND column_name = 'birthts') <> 'bigint' THEN
+                        CREATE TABLE IF NOT EXISTS users_invalid_birthts (LIKE users);
+                        WITH invalid AS (
+                            DELETE FROM users WHERE NOT CASE
+                                WHEN trim(birthts) ~ '^[+-]?[0-9]{1,18}$' THEN true
+                                WHEN trim(birthts) ~ '^[+-]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][+-]?[0-9]{1,2})?$'
+                                    THEN trim(birthts)::numeric % 1 = 0 AND abs(trim(birthts)::numeric) < 1e18
+                                ELSE false END
+                            RETURNING *)
+                        INSERT INTO users_invalid_birthts SELECT * FROM invalid;
+                        GET DIAGNOSTICS invalid_users = ROW_COUNT;
+                        IF invalid_users > 0 THEN
+                            RAISE WARNING '% users whose birthts is not an integer were moved to %.', invalid_users,
+                                'users_invalid_birthts';
+                        END IF;
+                        UPDATE users SET birthts = trim(birthts)::numeric::bigint::text
+                            WHERE trim(birthts) !~ '^[+-]?[0-9]{1,18}$';
+                        ALTER TABLE users ALTER COLUMN birthts TYPE bigint USING trim(birthts)::bigint;
+                    END IF;
+                END $$;""",
+                """CREATE INDEX IF NOT EXISTS users_birthts_idx ON users (birthts);""",
+                """CREATE INDEX IF NOT EXISTS users_user_id_c_idx ON users (user_id COLLATE "C");""",
+                """CREATE INDEX IF NOT EXISTS users_has_image_birthts_idx ON users ((img_path <> ''), birthts);""",
+                """ALTER TABLE users ADD COLUMN IF NOT EXISTS source_object varchar (250);""",
+                """CREATE INDEX IF NOT EXISTS users_source_object_idx ON users (source_object);""",
+                """CREATE TABLE IF NOT EXISTS source_objects(
+                object_name varchar (250) PRIMARY KEY NOT NULL,
+                etag varchar (100) NOT NULL,
+                size bigint NOT NULL,
+                last_modified timestamptz,
+                img_etag varchar (100) NOT NULL
+            );""",
+                """CREATE TABLE IF NOT EXISTS output_changes(
+                user_id varchar (50) PRIMARY KEY NOT NULL,
+                version bigserial NOT NULL
+            );""",
+                """CREATE TABLE IF NOT EXISTS source_rejects(
+                object_name varchar (250) PRIMARY KEY NOT NULL,
+                etag varchar (100) NOT NULL,
+                size bigint NOT NULL,
+                reason text NOT NULL,
+                quarantine_object varchar (300),
+                rejected_at timestamptz NOT NULL DEFAULT now()
+            );""",
+                """CREATE TABLE IF NOT EXISTS ingestion_leases(
+                name varchar (100) PRIMARY KEY NOT NULL,
+                holder varchar (100) NOT NULL,
+                expires_at timestamptz NOT NULL
+            );"""]
+
+    def operation(cur):
+        notices = len(cur.connection.notices)
+        for command in commands:
+            cur.execute(command)
+        for notice in cur.connection.notices[notices:]:
+            if notice.startswith('WARNING:'):
+                warnings.warn(notice[len('WARNING:'):].strip())
+    execute_db(db_info, operation)
 
 
-def update_users_row(db_info: dict, id: int, values: tuple) -> None:
+def upsert_users_rows_cursor(cur, rows: List[tuple]) -> None:
+    """
+    a method to add or update many rows of the users table in one statement using a given cursor. Rows whose user_id
+    already exists in the table are updated, and the others are added. If the same user_id appears more than once, its
+    last row is used.
+    :param cur: the cursor which runs the statement.
+    :param rows: the rows to write. Each row is [user_id, first_name, last_name, birthts, img-path] optionally followed
+    by the name of the source object the row was read from.
+    :return: None.
     """
-    A method to update an existing row in the database.
+    rows = list({row[0]: (row[0], row[1], row[2], int(row[3]), row[4], row[5] if len(row) > 5 else None)
+                 for row in rows}.values())
+    if not rows:
+        return
+    command = """INSERT INTO users(user_id, first_name, last_name, birthts, img_path, source_object) VALUES %s
+                 ON CONFLICT (user_id) DO UPDATE SET first_name = EXCLUDED.first_name,
+                 last_name = EXCLUDED.last_name, birthts = EXCLUDED.birthts, img_path = EXCLUDED.img_path,
+                 source_object = COALESCE(EXCLUDED.source_object, users.source_object);"""
+    psycopg2.extras.execute_values(cur, command, rows, page_size=len(rows))
+
+
+def upsert_users_rows(db_info: dict, rows: List[tuple]) -> None:
+    """
+    a method to add or update many rows of the users table in one statement. Rows whose user_id already exists in the
+    table are updated, and the others are added. If the same user_id appears more than once, its last row is used.
     :param db_info: a dictionary containing the postgres database info.
-    :param id: the id in the users table we want
-    :param values: the new values that should be in the row [user_id, first_name, last_name, birthts, img-path].
+    :param rows: the rows to write. Each row is [user_id, first_name, last_name, birthts, img-path] optionally followed
+    by the name of the source object the row was read from.
     :return: None.
     """
-    conn, cur = get_db_connection_cursor(db_info)
-    command = """UPDATE users SET first_name = %s, last_name = %s, birthts = %s, img_path = %s 
-    WHERE id = %s;"""
-    cur.execute(command, [*values[1:], id])
-    conn.commit()
-    cur.close()
-    conn.close()
+    execute_db(db_info, lambda cur: upsert_users_rows_cursor(cur, rows))
 
 
-def add_users_row(db_info: dict, values: tuple):
+def update_db(db_info: dict, *values) -> None:
     """
-    a method for adding a new row to the users table.
+    a method to update the database by either adding a new row to the users or updating an existing row.
     :param db_info: a dictionary containing the postgres database info.
     :param values: the new values that should be in the row [user_id, first_name, last_name, birthts, img-path].
     :return: None.
     """
-    conn, cur = get_db_connection_cursor(db_info)
-    command = """INSERT INTO users(user_id, first_name, last_name, birthts, img_path) 
-                                   VALUES(%s, %s, %s, %s, %s);"""
-    cur.execute(command, values)
-    conn.commit()
-    cur.close()
-    conn.close()
+    upsert_users_rows(db_info, [values])
 
 
-def get_users_ids(db_info: dict):
+def get_source_objects(db_info: dict, object_names: Union[List[str], None] = None) -> dict:
     """
-    a method to get id, user_id for all users in the users table.
+    a method to get the manifest of the source objects which were processed successfully.
     :param db_info: a dictionary containing the postgres database info.
-    :return:
+    :param object_names: if given, only the manifest entries of these objects are returned.
+    :return: a dictionary with the object name as the key, and a tuple (etag, size, img_etag) as the value. img_etag is
+    the etag of the matching image, or an empty string if the user had no image.
     """
-    conn, cur = get_db_connection_cursor(db_info)
-    command = """SELECT id, user_id FROM users;"""
-    cur.execute(command)
-    conn.commit()
-    res = cur.fetchall()
-    cur.close()
-    conn.close()
-    return res
+    command = """SELECT object_name, etag, size, img_etag FROM source_objects"""
+    params = None
+    if object_names is not None:
+        command += """ WHERE object_name = ANY(%s)"""
+        params = [list(object_names)]
+    res = run_db_command(db_info, command + ";", params, fetch=True)
+    return {row[0]: (row[1], row[2], row[3]) for row in res}
 
 
-def update_db(db_info: dict, *values) -> None:
+def get_source_users_images(db_info: dict, object_names: List[str]) -> Dict[str, Dict[str, bool]]:
     """
-    a method to update the database by either adding a new row to the users or updating an existing row.
+    a method to get the users read from some source objects, with the existence of their image in their current row.
     :param db_info: a dictionary containing the postgres database info.
-    :param values: the new values that should be in the row [user_id, first_name, last_name, birthts, img-path].
+    :param object_names: the names of the source objects.
+    :return: a dictionary with the object name as the key, and a dictionary as the value with the users' ids as keys
+    and booleans representing if the user has an image as values.
+    """
+    res = run_db_command(db_info, """SELECT source_object, user_id, img_path <> '' FROM users
+                                     WHERE source_object = ANY(%s);""", [list(object_names)], fetch=True)
+    users = {}
+    for object_name, user_id, has_image in res:
+        users.setdefault(object_name, {})[user_id] = has_image
+    return users
+
+
+def get_users_source_objects(db_info: dict, user_ids: List[str]) -> Dict[str, str]:
+    """
+    a method to get the source objects which the current rows of some users were read from.
+    :param db_info: a dictionary containing the postgres database info.
+    :param user_ids: the users' ids.
+    :return: a dictionary with the users' ids as keys and the names of their source objects as values. The users who do
+    not exist, or whose source object is not known, are left out.
+    """
+    res = run_db_command(db_info, """SELECT user_id, source_object FROM users
+                                     WHERE user_id = ANY(%s) AND source_object IS NOT NULL;""", [list(user_ids)],
+                         fetch=True)
+    return {user_id: source_object for user_id, source_object in res}
+
+
+def update_db_batch(db_info: dict, rows: List[tuple], source_objects: List[tuple],
+                    removed_objects: Iterable[str] = ()) -> None:
+    """
+    a method to write the results of processing a batch of source objects in one transaction: the users' rows are
+    upserted, the processed objects are recorded in the manifest, and the removed objects are dropped from it. The users
+    which were read from a processed object before but are not in it anymore (e.g. a user removed from a batch file) are
+    detached from the object, so they are not part of the output anymore. Every user whose output row may have changed
+    (the upserted users and the users of the processed and removed objects) is recorded in output_changes.
+    :param db_info: a dictionary containing the postgres database info.
+    :param rows: the users' rows [user_id, first_name, last_name, birthts, img-path, source_object].
+    :param source_objects: the processed objects' manifest entries (object_name, etag, size, last_modified, img_etag).
+    :param removed_objects: the names of the objects which should not be in the manifest anymore.
     :return: None.
     """
-    user_ids = get_users_ids(db_info)
-    for id, user_id in user_ids:
-        if values[0] == user_id:
-            update_users_row(db_info, id, values)
-            break
+    source_objects = list({entry[0]: tuple(entry) for entry in source_objects}.values())
+    removed_objects = list(removed_objects)
+
+    def operation(cur):
+        if source_objects or removed_objects:
+            cur.execute("""INSERT INTO output_changes(user_id) SELECT user_id FROM users WHERE source_object = ANY(%s)
+                           ON CONFLICT (user_id) DO UPDATE SET version = nextval('output_changes_version_seq');""",
+                        [[entry[0] for entry in source_objects] + removed_objects])
+        if source_objects:
+            cur.execute("""UPDATE users SET source_object = NULL WHERE source_object = ANY(%s);""",
+                        [[entry[0] for entry in source_objects]])
+        upsert_users_rows_cursor(cur, rows)
+        if rows:
+            command = """INSERT INTO output_changes(user_id) VALUES %s
+                         ON CONFLICT (user_id) DO UPDATE SET version = nextval('output_changes_version_seq');"""
+            user_ids = list({(row[0],) for row in rows})
+            psycopg2.extras.execute_values(cur, command, user_ids, page_size=len(user_ids))
+        if source_objects:
+            command = """INSERT INTO source_objects(object_name, etag, size, last_modified, img_etag) VALUES %s
+                         ON CONFLICT (object_name) DO UPDATE SET etag = EXCLUDED.etag, size = EXCLUDED.size,
+                         last_modified = EXCLUDED.last_modified, img_etag = EXCLUDED.img_etag;"""
+            psycopg2.extras.execute_values(cur, command, source_objects, page_size=len(source_objects))
+        if removed_objects:
+            cur.execute("""DELETE FROM source_objects WHERE object_name = ANY(%s);""", [removed_objects])
+    execute_db(db_info, operation)
+
+
+def resync_users_copy(db_info: dict, users_file: IO[bytes], source_objects_file: IO[bytes],
+                      delete_missing: bool = False) -> Tuple[int, int]:
+    """
+    a method to rebuild the users table and the manifest from a full run over the source objects in one transaction.
+    The rows are loaded with COPY FROM STDIN into temporary staging tables, then merged with set-based statements: the
+    users are upserted (only the rows whose values changed are written, and recorded in output_changes), the users
+    which are not in the staging table are detached from their source objects (or deleted if delete_missing is True),
+    and the manifest is replaced by the staged one. So a full load costs a few statements instead of one per batch.
+    :param db_info: a dictionary containing the postgres database info.
+    :param users_file: a binary file of csv rows [user_id, first_name, last_name, birthts, img-path, source_object]
+    (see write_csv_rows). If the same user_id appears more than once, its last row is used.
+    :param source_objects_file: a binary file of csv rows (object_name, etag, size, last_modified, img_etag), the
+    manifest entries of the processed objects.
+    :param delete_missing: a boolean to indicate if the users which are not in users_file are deleted.
+    :return: a tuple of two integers. The first is the number of added or changed users, the other is the number of
+    detached or deleted users.
+    """
+    commands = ["""CREATE TEMP TABLE users_staging(
+                seq bigserial NOT NULL,
+                user_id varchar (50) NOT NULL,
+                first_name varchar (50) NOT NULL,
+                last_name varchar (50) NOT NULL,
+                birthts bigint NOT NULL,
+                img_path varchar (250) NOT NULL,
+                source_object varchar (250)
+            ) ON COMMIT DROP;""",
+                """CREATE TEMP TABLE source_objects_staging(
+                LIKE source_objects INCLUDING DEFAULTS
+            ) ON COMMIT DROP;"""]
+    upsert_command = """WITH upserted AS (
+                 INSERT INTO users(user_id, first_name, last_name, birthts, img_path, source_object)
+                 SELECT DISTINCT ON (user_id) user_id, first_name, last_name, birthts, img_path, source_object
+                 FROM users_staging ORDER BY user_id, seq DESC
+                 ON CONFLICT (user_id) DO UPDATE SET first_name = EXCLUDED.first_name,
+                 last_name = EXCLUDED.last_name, birthts = EXCLUDED.birthts, img_path = EXCLUDED.img_path,
+                 source_object = EXCLUDED.source_object
+                 WHERE (users.first_name, users.last_name, users.birthts, users.img_path, users.source_object)
+                 IS DISTINCT FROM (EXCLUDED.first_name, EXCLUDED.last_name, EXCLUDED.birthts, EXCLUDED.img_path,
+                 EXCLUDED.source_object)
+                 RETURNING user_id)
+                 INSERT INTO output_changes(user_id) SELECT user_id FROM upserted
+                 ON CONFLICT (user_id) DO UPDATE SET version = nextval('output_changes_version_seq');"""
+    missing_condition = """NOT EXISTS (SELECT 1 FROM users_staging s WHERE s.user_id = users.user_id)"""
+    if delete_missing:
+        missing_command = f"""DELETE FROM users WHERE {missing_condition} RETURNING user_id"""
     else:
-        add_users_row(db_info, values)
+        missing_command = f"""UPDATE users SET source_object = NULL
+                              WHERE source_object IS NOT NULL AND {missing_condition} RETURNING user_id"""
+
+    def operation(cur):
+        for command in commands:
+            cur.execute(command)
+        users_file.seek(0)
+        cur.copy_expert("""COPY users_staging(user_id, first_name, last_name, birthts, img_path, source_object)
+                           FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (first_name, last_name, img_path));""",
+                        users_file)
+        source_objects_file.seek(0)
+        cur.copy_expert("""COPY source_objects_staging(object_name, etag, size, last_modified, img_etag)
+                           FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (img_etag));""", source_objects_file)
+        cur.execute("""CREATE INDEX ON users_staging (user_id);""")
+        cur.execute("""ANALYZE users_staging;""")
+        cur.execute(upsert_command)
+        changed = cur.rowcount
+        cur.execute(f"""WITH missing AS ({missing_command})
+                        INSERT INTO output_changes(user_id) SELECT user_id FROM missing
+                        ON CONFLICT (user_id) DO UPDATE SET version = nextval('output_changes_version_seq');""")
+        missing = cur.rowcount
+        cur.execute("""INSERT INTO source_objects(object_name, etag, size, last_modified, img_etag)
+                       SELECT DISTINCT ON (object_name) object_name, etag, size, last_modified, img_etag
+                       FROM source_objects_staging
+                       ON CONFLICT (object_name) DO UPDATE SET etag = EXCLUDED.etag, size = EXCLUDED.size,
+                       last_modified = EXCLUDED.last_modified, img_etag = EXCLUDED.img_etag;""")
+        cur.execute("""DELETE FROM source_objects o WHERE NOT EXISTS
+                       (SELECT 1 FROM source_objects_staging s WHERE s.object_name = o.object_name);""")
+        return changed, missing
+    return execute_db(db_info, operation)
+
+
+def get_source_rejects(db_info: dict) -> Dict[str, tuple]:
+    """
+    A method to get the source objects which were rejected as invalid, with the reason of their rejection.
+    :param db_info: a dictionary containing the postgres database info.
+    :return: a dictionary with the objects' names as keys (ordered by name) and tuples (etag, size, reason,
+    quarantine_object, rejected_at) as values, where quarantine_object is the name of the object's copy in quarantine
+    (or None).
+    """
+    command = """SELECT object_name, etag, size, reason, quarantine_object, rejected_at FROM source_rejects
+                 ORDER BY object_name;"""
+    return {row[0]: tuple(row[1:]) for row in run_db_command(db_info, command, fetch=True)}
+
+
+def update_source_rejects(db_info: dict, rejected: Iterable[tuple] = (), cleared: Iterable[str] = (),
+                          removed: Iterable[str] = ()) -> None:
+    """
+    A method to record the source objects rejected by a run, and forget the ones which are not rejected anymore, in one
+    transaction.
+    :param db_info: a dictionary containing the postgres database info.
+    :param rejected: the rejected objects' entries (object_name, etag, size, reason, quarantine_object).
+    :param cleared: the names of the objects which were processed successfully.
+    :param removed: the names of the objects which do not exist anymore. The objects which were moved to quarantine are
+    kept, since their removal is expected.
+    :return: None.
+    """
+    rejected = list({entry[0]: tuple(entry) for entry in rejected}.values())
+    cleared, removed = list(cleared), list(removed)
+
+    def operation(cur):
+        if rejected:
+            command = """INSERT INTO source_rejects(object_name, etag, size, reason, quarantine_object) VALUES %s
+                         ON CONFLICT (object_name) DO UPDATE SET etag = EXCLUDED.etag, size = EXCLUDED.size,
+                         reason = EXCLUDED.reason, quarantine_object = EXCLUDED.quarantine_object,
+                         rejected_at = now();"""
+            psycopg2.extras.execute_values(cur, command, rejected, page_size=len(rejected))
+        if cleared:
+            cur.execute("""DELETE FROM source_rejects WHERE object_name = ANY(%s);""", [cleared])
+        if removed:
+            cur.execute("""DELETE FROM source_rejects WHERE object_name = ANY(%s) AND quarantine_object IS NULL;""",
+                        [removed])
+    execute_db(db_info, operation)
 
 
 def drop_users_table(db_info: dict) -> None:
@@ -105,35 +612,223 @@ def drop_users_table(db_info: dict) -> None:
     :param db_info: a dictionary containing the postgres database info.
     :return: None.
     """
-    conn, cur = get_db_connection_cursor(db_info)
     command = """DROP TABLE IF EXISTS users;"""
-    cur.execute(command)
-    conn.commit()
-    cur.close()
-    conn.close()
+    run_db_command(db_info, command)
 
 
-def get_db_all_users(db_info: dict) -> dict:
+def generate_users_query(is_image_exists: Union[bool, None] = None, min_birthts: Union[int, None] = None,
+                         max_birthts: Union[int, None] = None, after_user_id: Union[str, None] = None,
+                         limit: Union[int, None] = None) -> Tuple[str, list]:
+    """
+    A method to generate the parameterized query selecting the users which match some filters, ordered by user_id.
+    The None filters are ignored. The user_ids are compared in the "C" collation, i.e. by code point, which is the
+    order of the in-memory read model (see UsersReadModel), so the JSON and the NDJSON pages agree whatever the
+    database's collation.
+    :param is_image_exists: a boolean flag to filter the users according to the existence of their images.
+    :param min_birthts: the minimum birth date (milliseconds timestamp) of the returned users.
+    :param max_birthts: the maximum birth date (milliseconds timestamp) of the returned users.
+    :param after_user_id: only the users whose user_id comes after this one are returned (keyset pagination).
+    :param limit: the maximum number of returned users.
+    :return: a tuple of two elements, the query and its parameters.
+    """
+    where, params = [], []
+    if is_image_exists is not None:
+        where.append("(img_path <> '') = %s")
+        params.append(is_image_exists)
+    if min_birthts is not None:
+        where.append("birthts >= %s")
+        params.append(min_birthts)
+    if max_birthts is not None:
+        where.append("birthts <= %s")
+        params.append(max_birthts)
+    if after_user_id is not None:
+        where.append("user_id COLLATE \"C\" > %s")
+        params.append(after_user_id)
+    command = "SELECT user_id, first_name, last_name, birthts, img_path FROM users"
+    if where:
+        command += " WHERE " + " AND ".join(where)
+    command += " ORDER BY user_id COLLATE \"C\""
+    if limit is not None:
+        command += " LIMIT %s"
+        params.append(limit)
+    return command + ";", params
+
+
+def users_row_to_dict(row: tuple) -> dict:
+    """
+    A method to convert a row selected by generate_users_query to the user's values as a dictionary.
+    :param row: the selected row (user_id, first_name, last_name, birthts, img_path).
+    :return: a dictionary of the user's values without the user_id.
     """
-    A method to convert the postgres database content to a dictionary with the user_id as the primary key. For example,
-    the returned dictionary will contain the value of user_id as a key and other columns as the key's value, i.e. the
-    returned value = {'10': {'first_name': 'ahmad', 'last_name': 'smith', 'birthts': '7685476260, 'img_path': '10.png'}}
+    return {
+        'first_name': row[1],
+        'last_name': row[2],
+        'birthts': str(row[3]),
+        'img_path': row[4]
+    }
+
+
+def get_db_users(db_info: dict, is_image_exists: Union[bool, None] = None, min_birthts: Union[int, None] = None,
+                 max_birthts: Union[int, None] = None, after_user_id: Union[str, None] = None,
+                 limit: Union[int, None] = None) -> dict:
+    """
+    A method to get the users in the postgres database which match some filters as a dictionary with the user_id as the
+    primary key. For example, the returned dictionary will contain the value of user_id as a key and other columns as
+    the key's value, i.e. the returned value = {'10': {'first_name': 'ahmad', 'last_name': 'smith',
+    'birthts': '7685476260', 'img_path': '10.png'}}. The filters are applied by the database, and the None filters are
+    ignored. The users are ordered by user_id.
     :param db_info: a dictionary containing the postgres database info.
+    :param is_image_exists: a boolean flag to filter the users according to the existence of their images.
+    :param min_birthts: the minimum birth date (milliseconds timestamp) of the returned users.
+    :param max_birthts: the maximum birth date (milliseconds timestamp) of the returned users.
+    :param after_user_id: only the users whose user_id comes after this one are returned (keyset pagination).
+    :param limit: the maximum number of returned users.
     :return: a dictionary in the format previously explained.
     """
-    conn, cur = get_db_connection_cursor(db_info)
-    command = """SELECT * FROM users;"""
-    cur.execute(command)
-    conn.commit()
-    res = cur.fetchall()
-    cur.close()
-    conn.close()
-    ret_dict = {}
-    for row in res:
-        ret_dict[row[1]] = {
-            'first_name': row[2],
-            'last_name': row[3],
-            'birthts': row[4],
-            'img_path': row[5]
-        }
-    return ret_dict
+    command, params = generate_users_query(is_image_exists, min_birthts, max_birthts, after_user_id, limit)
+    res = run_db_command(db_info, command, params, fetch=True)
+    return {row[0]: users_row_to_dict(row) for row in res}
+
+
+def iter_db_command(db_info: dict, command: str, params=None, itersize: int = DB_STREAM_ITERSIZE) -> Iterator[tuple]:
+    """
+    A method to stream the rows returned by a sql query. The rows are read through a server-side (named) cursor,
+    itersize rows at a time, so the memory used does not depend on the number of rows. The borrowed connection is held
+    until the iteration ends or the iterator is closed.
+    :param db_info: a dictionary containing the postgres database info.
+    :param command: the sql query.
+    :param params: the parameters of the query (if any).
+    :param itersize: the number of rows fetched from the server at once.
+    :return: an iterator of the returned rows.
+    """
+    with db_connection(db_info) as conn:
+        with conn.cursor(name=f'stream_{uuid.uuid4().hex}') as cur:
+            cur.itersize = itersize
+            cur.execute(command, params)
+            for row in cur:
+                yield row
+
+
+def iter_db_users(db_info: dict, is_image_exists: Union[bool, None] = None, min_birthts: Union[int, None] = None,
+                  max_birthts: Union[int, None] = None, after_user_id: Union[str, None] = None,
+                  limit: Union[int, None] = None, itersize: int = DB_STREAM_ITERSIZE) -> Iterator[Tuple[str, dict]]:
+    """
+    A method to stream the users in the postgres database which match some filters through a server-side cursor.
+    :param db_info: a dictionary containing the postgres database info.
+    :param is_image_exists: a boolean flag to filter the users according to the existence of their images.
+    :param min_birthts: the minimum birth date (milliseconds timestamp) of the returned users.
+    :param max_birthts: the maximum birth date (milliseconds timestamp) of the returned users.
+    :param after_user_id: only the users whose user_id comes after this one are returned (keyset pagination).
+    :param limit: the maximum number of returned users.
+    :param itersize: the number of rows fetched from the server at once.
+    :return: an iterator of tuples of two elements, the user_id and the user's values as a dictionary.
+    """
+    command, params = generate_users_query(is_image_exists, min_birthts, max_birthts, after_user_id, limit)
+    for row in iter_db_command(db_info, command, params, itersize):
+        yield row[0], users_row_to_dict(row)
+
+
+def iter_db_output_rows(db_info: dict, itersize: int = DB_STREAM_ITERSIZE) -> Iterator[List[str]]:
+    """
+    A method to stream the rows of the output csv file, i.e. the users whose source objects are in the manifest,
+    ordered by the source object name.
+    :param db_info: a dictionary containing the postgres database info.
+    :param itersize: the number of rows fetched from the server at once.
+    :return: an iterator of the output rows [user_id, first_name, last_name, birthts, img_path].
+    """
+    command = """SELECT u.user_id, u.first_name, u.last_name, u.birthts, u.img_path FROM users u
+                 JOIN source_objects s ON s.object_name = u.source_object ORDER BY s.object_name, u.user_id;"""
+    for row in iter_db_command(db_info, command, itersize=itersize):
+        yield [row[0], row[1], row[2], str(row[3]), row[4]]
+
+
+def get_output_changes_version(db_info: dict) -> int:
+    """
+    A method to get the version of the latest change of the output rows (see update_db_batch).
+    :param db_info: a dictionary containing the postgres database info.
+    :return: the version, or 0 if there are no changes.
+    """
+    res = run_db_command(db_info, """SELECT COALESCE(max(version), 0) FROM output_changes;""", fetch=True)
+    return res[0][0]
+
+
+def get_output_changes(db_info: dict) -> Tuple[List[Tuple[str, Union[List[str], None]]], int]:
+    """
+    A method to get the users whose output rows changed since the output was last published, with their current output
+    rows.
+    :param db_info: a dictionary containing the postgres database info.
+    :return: a tuple of two elements. The first is a list of tuples (user_id, the output row [user_id, first_name,
+    last_name, birthts, img_path], or None if the user is not part of the output anymore) ordered by user_id. The second
+    is the version of the latest change (to be passed to clear_output_changes).
+    """
+    command = """SELECT c.user_id, c.version, u.first_name, u.last_name, u.birthts, u.img_path, s.object_name
+                 FROM output_changes c LEFT JOIN users u ON u.user_id = c.user_id
+                 LEFT JOIN source_objects s ON s.object_name = u.source_object ORDER BY c.user_id;"""
+    res = run_db_command(db_info, command, fetch=True)
+    changes = [(row[0], [row[0], row[2], row[3], str(row[4]), row[5]] if row[6] is not None else None) for row in res]
+    return changes, max([row[1] for row in res], default=0)
+
+
+def clear_output_changes(db_info: dict, version: int) -> None:
+    """
+    A method to forget the changes of the output rows up to a version, once they were published.
+    :param db_info: a dictionary containing the postgres database info.
+    :param version: the version of the latest published change.
+    :return: None.
+    """
+    run_db_command(db_info, """DELETE FROM output_changes WHERE version <= %s;""", [version])
+
+
+def get_data_generation(db_info: dict) -> int:
+    """
+    A method to get the generation of the users' data shared by all the replicas of the app. It grows every time an
+    output row changes (it is the last version handed out by output_changes, see update_db_batch), so a replica can
+    tell that another one changed the data.
+    :param db_info: a dictionary containing the postgres database info.
+    :return: the generation.
+    """
+    res = run_db_command(db_info, """SELECT CASE WHEN is_called THEN last_value ELSE 0 END
+                                     FROM output_changes_version_seq;""", fetch=True)
+    return res[0][0]
+
+
+def acquire_lease(db_info: dict, name: str, holder: str, ttl: float) -> bool:
+    """
+    A method to acquire (or renew) a lease, i.e. a named lock held by one holder until it expires. The lease is granted
+    if it is free, expired, or already held by the same holder, and it then expires ttl seconds later. The expiry is
+    computed by the database's clock, so the replicas do not need synchronized clocks.
+    :param db_info: a dictionary containing the postgres database info.
+    :param name: the lease's name.
+    :param holder: the id of the holder (e.g. the replica's id).
+    :param ttl: the number of seconds the lease is held before it expires.
+    :return: a boolean representing if the holder holds the lease.
+    """
+    command = """INSERT INTO ingestion_leases(name, holder, expires_at)
+                 VALUES (%s, %s, now() + %s * interval '1 second')
+                 ON CONFLICT (name) DO UPDATE SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+                 WHERE ingestion_leases.holder = EXCLUDED.holder OR ingestion_leases.expires_at < now()
+                 RETURNING holder;"""
+    return len(run_db_command(db_info, command, [name, holder, ttl], fetch=True)) > 0
+
+
+def get_leases(db_info: dict, prefix: str = '') -> Dict[str, str]:
+    """
+    A method to get the holders of the leases which did not expire.
+    :param db_info: a dictionary containing the postgres database info.
+    :param prefix: only the leases whose names start with the prefix are returned.
+    :return: a dictionary with the leases' names as keys and their holders as values.
+    """
+    command = """SELECT name, holder FROM ingestion_leases WHERE expires_at >= now() AND starts_with(name, %s);"""
+    return dict(run_db_command(db_info, command, [prefix], fetch=True))
+
+
+def release_leases(db_info: dict, holder: str, names: Iterable[str]) -> None:
+    """
+    A method to release some leases of a holder, so other holders can acquire them right away.
+    :param db_info: a dictionary containing the postgres database info.
+    :param holder: the id of the holder.
+    :param names: the leases' names. The leases which are held by other holders are left as they are.
+    :return: None.
+    """
+    run_db_command(db_info, """DELETE FROM ingestion_leases WHERE holder = %s AND name = ANY(%s);""",
+                   [holder, list(names)])
@@ -0,0 +1,75 @@
+import heapq
+import itertools
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterator, Union
+
+
+class UsersReadModel:
+    """
+    An immutable in-memory index of the users, built once per dataset version, which answers the /data filters without
+    querying the database. The users are kept ordered by user_id, alongside a compact sorted array of their birthts
+    with the parallel positions of their rows, and a map of the users who have an image. A birthts range is then two
+    binary searches, so a filtered request costs O(log N + k) for the k users in the range, instead of a scan.
+    """
+
+    def __init__(self, users: Dict[str, dict]):
+        """
+        :param users: the users as returned by get_db_users, i.e. a dictionary with the user_id as the key and the
+        user's values as the value.
+        """
+        self.users = users
+        self.user_ids = sorted(users)
+        self.values = [users[user_id] for user_id in self.user_ids]
+        birthts = [int(values['birthts']) for values in self.values]
+        order = sorted(range(len(birthts)), key=birthts.__getitem__)
+        self.birthts = array('q', (birthts[position] for position in order))
+        self.positions = array('q', order)
+        self.has_image = bytearray(values['img_path'] != '' for values in self.values)
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def iter_positions(self, is_image_exists: Union[bool, None] = None, min_birthts: Union[int, None] = None,
+                       max_birthts: Union[int, None] = None, after_user_id: Union[str, None] = None,
+                       limit: Union[int, None] = None) -> Iterator[int]:
+        """
+        A method to get the positions (in user_id order) of the users which match some filters. The None filters are
+        ignored.
+        :param is_image_exists: a boolean flag to filter the users according to the existence of their images.
+        :param min_birthts: the minimum birth date (milliseconds timestamp) of the returned users.
+        :param max_birthts: the maximum birth date (milliseconds timestamp) of the returned users.
+        :param after_user_id: only the users whose user_id comes after this one are returned.
+        :param limit: the maximum number of returned users.
+        :return: an iterator of the positions in increasing order.
+        """
+        start = bisect_right(self.user_ids, after_user_id) if after_user_id is not None else 0
+        if min_birthts is None and max_birthts is None:
+            positions = range(start, len(self.user_ids))
+        else:
+            low = bisect_left(self.birthts, min_birthts) if min_birthts is not None else 0
+            high = bisect_right(self.birthts, max_birthts) if max_birthts is not None else len(self.birthts)
+            positions = (position for position in self.positions[low:high] if position >= start)
+        if is_image_exists is not None:
+            positions = (position for position in positions if self.has_image[position] == is_image_exists)
+        if min_birthts is None and max_birthts is None:
+            return itertools.islice(positions, limit)
+        return iter(sorted(positions) if limit is None else heapq.nsmallest(limit, positions))
+
+    def select(self, is_image_exists: Union[bool, None] = None, min_birthts: Union[int, None] = None,
+               max_birthts: Union[int, None] = None, after_user_id: Union[str, None] = None,
+               limit: Union[int, None] = None) -> dict:
+        """
+        A method to get the users which match some filters, in the same format and order as get_db_users.
+        :param is_image_exists: a boolean flag to filter the users according to the existence of their images.
+        :param min_birthts: the minimum birth date (milliseconds timestamp) of the returned users.
+        :param max_birthts: the maximum birth date (milliseconds timestamp) of the returned users.
+        :param after_user_id: only the users whose user_id comes after this one are returned.
+        :param limit: the maximum number of returned users.
+        :return: a dictionary with the user_id as the key and the user's values as the value.
+        """
+        if is_image_exists is None and min_birthts is None and max_birthts is None and after_user_id is None \
+                and limit is None:
+            return self.users
+        positions = self.iter_positions(is_image_exists, min_birthts, max_birthts, after_user_id, limit)
+        return {self.user_ids[position]: self.values[position] for position in positions}
@@ -0,0 +1,319 @@
+import csv
+import datetime
+import hashlib
+import io
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Tuple, Union
+from unittest import mock
+
+
+class FakeS3Error(Exception):
+    """
+    The error raised by FakeMinio when a bucket or an object does not exist. Like the S3Error of the Minio client, it
+    has the error's code (e.g. 'NoSuchKey').
+    """
+
+    def __init__(self, message: str, code: str = 'InternalError'):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeResponse:
+    """
+    A stand-in of the urllib3 response returned by Minio.get_object.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self._stream = io.BytesIO(data)
+
+    def read(self, amt: Union[int, None] = None) -> bytes:
+        return self._stream.read(amt)
+
+    def stream(self, amt: int = 64 * 1024) -> Iterator[bytes]:
+        while True:
+            chunk = self._stream.read(amt)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self) -> None:
+        pass
+
+    def release_conn(self) -> None:
+        pass
+
+
+class FakeMinio:
+    """
+    An in-memory stand-in of the parts of the Minio client API used by minio_handler.py (make_bucket, bucket_exists,
+    list_objects, stat_object, get_object, put_object, copy_object and remove_object). Each request can optionally
+    sleep for latency seconds, to mimic the round trip to a MinIO server.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        """
+        :param latency: the number of seconds each request waits before it is served.
+        """
+        self.latency = latency
+        self.requests = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _request(self, bucket: str) -> Dict[str, tuple]:
+        """
+        A method to count a request, wait for the latency and get the objects of a bucket.
+        :param bucket: the bucket name.
+        :return: a dictionary with the objects' names as keys and tuples (data, etag, last_modified) as values.
+        """
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if bucket not in self._buckets:
+            raise FakeS3Error(f'The bucket {bucket} does not exist.', 'NoSuchBucket')
+        return self._buckets[bucket]
+
+    def make_bucket(self, bucket: str) -> None:
+        self._buckets.setdefault(bucket, {})
+
+    def bucket_exists(self, bucket: str) -> bool:
+        return bucket in self._buckets
+
+    def put_object(self, bucket: str, object_name: str, data, length: int, content_type: str = '', **kwargs) -> None:
+        contents = data.read(length) if length >= 0 else data.read()
+        self._request(bucket)[object_name] = (contents, hashlib.md5(contents).hexdigest(),
+                                              datetime.datetime.now(datetime.timezone.utc))
+
+    def copy_object(self, bucket: str, object_name: str, source) -> None:
+        objects = self._request(source.bucket_name)
+        if source.object_name not in objects:
+            raise FakeS3Error(f'The object {source.object_name} does not exist.', 'NoSuchKey')
+        self._request(bucket)[object_name] = objects[source.object_name]
+
+    def remove_object(self, bucket: str, object_name: str) -> None:
+        self._request(bucket).pop(object_name, None)
+
+    def stat_object(self, bucket: str, object_name: str) -> SimpleNamespace:
+        objects = self._request(bucket)
+        if object_name not in objects:
+            raise FakeS3Error(f'The object {object_name} does not exist.', 'NoSuchKey')
+        data, etag, last_modified = objects[object_name]
+        return SimpleNamespace(bucket_name=bucket, object_name=object_name, etag=etag, size=len(data),
+                               last_modified=last_modified)
+
+    def get_object(self, bucket: str, object_name: str) -> FakeResponse:
+        objects = self._request(bucket)
+        if object_name not in objects:
+            raise FakeS3Error(f'The object {object_name} does not exist.', 'NoSuchKey')
+        return FakeResponse(objects[object_name][0])
+
+    def list_objects(self, bucket: str, prefix: Union[str, None] = None, recursive: bool = False) \
+            -> Iterator[SimpleNamespace]:
+        for object_name in sorted(self._request(bucket)):
+            if prefix is None or object_name.startswith(prefix):
+                data, etag, last_modified = self._buckets[bucket][object_name]
+                yield SimpleNamespace(bucket_name=bucket, object_name=object_name, etag=etag, size=len(data),
+                                      last_modified=last_modified)
+
+
+class FakeDB:
+    """
+    An in-memory stand-in of the users table, the source_objects manifest, the output_changes, source_rejects and
+    ingestion_leases tables, with the same semantics as the postgres_handler.py functions used by the data processing
+    and the /data endpoint. The leases expire according to time.monotonic.
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.source_objects = {}
+        self.output_changes = {}
+        self.source_rejects = {}
+        self.leases = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def _record_change(self, user_id: str) -> None:
+        self._version += 1
+        self.output_changes[user_id] = self._version
+
+    def get_source_objects(self, db_info: dict, object_names: Union[List[str], None] = None) -> dict:
+        with self._lock:
+            return {name: (etag, size, img_etag) for name, (etag, size, _, img_etag) in self.source_objects.items()
+                    if object_names is None or name in object_names}
+
+    def get_source_users_images(self, db_info: dict, object_names: List[str]) -> Dict[str, Dict[str, bool]]:
+        with self._lock:
+            users = {}
+            for user_id, (_, _, _, img_path, source_object) in self.users.items():
+                if source_object in object_names:
+                    users.setdefault(source_object, {})[user_id] = img_path != ''
+            return users
+
+    def get_users_source_objects(self, db_info: dict, user_ids: List[str]) -> Dict[str, str]:
+        with self._lock:
+            return {user_id: self.users[user_id][4] for user_id in user_ids
+                    if user_id in self.users and self.users[user_id][4] is not None}
+
+    def update_db_batch(self, db_info: dict, rows: List[tuple], source_objects: List[tuple],
+                        removed_objects=()) -> None:
+        with self._lock:
+            processed = set(entry[0] for entry in source_objects)
+            for user_id, values in self.users.items():
+                if values[4] in processed or values[4] in removed_objects:
+                    self._record_change(user_id)
+                if values[4] in processed:
+                    self.users[user_id] = values[:4] + (None,)
+            for row in rows:
+                self._record_change(row[0])
+                user_id, first_name, last_name, birthts, img_path = row[:5]
+                source_object = row[5] if len(row) > 5 else None
+                if source_object is None and user_id in self.users:
+                    source_object = self.users[user_id][4]
+                self.users[user_id] = (first_name, last_name, int(birthts), img_path, source_object)
+            for name, etag, size, last_modified, img_etag in source_objects:
+                self.source_objects[name] = (etag, size, last_modified, img_etag)
+            for name in removed_objects:
+                self.source_objects.pop(name, None)
+
+    def resync_users_copy(self, db_info: dict, users_file, source_objects_file,
+                          delete_missing: bool = False) -> Tuple[int, int]:
+        users_file.seek(0)
+        source_objects_file.seek(0)
+        rows = {row[0]: (row[1], row[2], int(row[3]), row[4], row[5] or None)
+                for row in csv.reader(io.StringIO(users_file.read().decode()))}
+        source_objects = {row[0]: (row[1], int(row[2]), row[3] or None, row[4])
+                          for row in csv.reader(io.StringIO(source_objects_file.read().decode()))}
+        with self._lock:
+            changed = missing = 0
+            for user_id, values in rows.items():
+                if self.users.get(user_id, None) != values:
+                    self.users[user_id] = values
+                    self._record_change(user_id)
+                    changed += 1
+            for user_id in [user_id for user_id, values in self.users.items()
+                            if user_id not in rows and (delete_missing or values[4] is not None)]:
+                if delete_missing:
+                    del self.users[user_id]
+                else:
+                    self.users[user_id] = self.users[user_id][:4] + (None,)
+                self._record_change(user_id)
+                missing += 1
+            self.source_objects = source_objects
+            return changed, missing
+
+    def get_output_changes_version(self, db_info: dict) -> int:
+        with self._lock:
+            return max(self.output_changes.values(), default=0)
+
+    def get_output_changes(self, db_info: dict) -> Tuple[List[Tuple[str, Union[List[str], None]]], int]:
+        with self._lock:
+            changes = []
+            for user_id in sorted(self.output_changes):
+                values = self.users.get(user_id, None)
+                row = None
+                if values is not None and values[4] in self.source_objects:
+                    row = [user_id, values[0], values[1], str(values[2]), values[3]]
+                changes.append((user_id, row))
+            return changes, max(self.output_changes.values(), default=0)
+
+    def clear_output_changes(self, db_info: dict, version: int) -> None:
+        with self._lock:
+            self.output_changes = {user_id: user_version for user_id, user_version in self.output_changes.items()
+                                   if user_version > version}
+
+    def get_source_rejects(self, db_info: dict) -> dict:
+        with self._lock:
+            return {name: self.source_rejects[name] for name in sorted(self.source_rejects)}
+
+    def update_source_rejects(self, db_info: dict, rejected=(), cleared=(), removed=()) -> None:
+        with self._lock:
+            for name, etag, size, reason, quarantine_object in rejected:
+                self.source_rejects[name] = (etag, size, reason, quarantine_object,
+                                             datetime.datetime.now(datetime.timezone.utc))
+            for name in cleared:
+                self.source_rejects.pop(name, None)
+            for name in removed:
+                if name in self.source_rejects and self.source_rejects[name][3] is None:
+                    del self.source_rejects[name]
+
+    def get_data_generation(self, db_info: dict) -> int:
+        with self._lock:
+            return self._version
+
+    def acquire_lease(self, db_info: dict, name: str, holder: str, ttl: float) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            current = self.leases.get(name, None)
+            if current is not None and current[0] != holder and current[1] >= now:
+                return False
+            self.leases[name] = (holder, now + ttl)
+            return True
+
+    def get_leases(self, db_info: dict, prefix: str = '') -> Dict[str, str]:
+        with self._lock:
+            now = time.monotonic()
+            return {name: holder for name, (holder, expires_at) in self.leases.items()
+                    if expires_at >= now and name.startswith(prefix)}
+
+    def release_leases(self, db_info: dict, holder: str, names) -> None:
+        with self._lock:
+            for name in names:
+                if self.leases.get(name, (None,))[0] == holder:
+                    del self.leases[name]
+
+    def _select_users(self, is_image_exists: Union[bool, None] = None, min_birthts: Union[int, None] = None,
+                      max_birthts: Union[int, None] = None, after_user_id: Union[str, None] = None,
+                      limit: Union[int, None] = None) -> List[Tuple[str, dict]]:
+        with self._lock:
+            user_ids = sorted(self.users)
+            selected = []
+            for user_id in user_ids:
+                first_name, last_name, birthts, img_path, _ = self.users[user_id]
+                if (is_image_exists is not None and (img_path != '') != is_image_exists) or \
+                        (min_birthts is not None and birthts < min_birthts) or \
+                        (max_birthts is not None and birthts > max_birthts) or \
+                        (after_user_id is not None and user_id <= after_user_id):
+                    continue
+                selected.append((user_id, {'first_name': first_name, 'last_name': last_name, 'birthts': str(birthts),
+                                           'img_path': img_path}))
+                if limit is not None and len(selected) >= limit:
+                    break
+            return selected
+
+    def get_db_users(self, db_info: dict, **filters) -> dict:
+        return dict(self._select_users(**filters))
+
+    def iter_db_users(self, db_info: dict, itersize: int = 0, **filters) -> Iterator[Tuple[str, dict]]:
+        return iter(self._select_users(**filters))
+
+    def iter_db_output_rows(self, db_info: dict, itersize: int = 0) -> Iterator[List[str]]:
+        with self._lock:
+            rows = sorted((values[4], user_id, values) for user_id, values in self.users.items()
+                          if values[4] in self.source_objects)
+        for _, user_id, (first_name, last_name, birthts, img_path, _) in rows:
+            yield [user_id, first_name, last_name, str(birthts), img_path]
+
+
+@contextmanager
+def patch_db(fake_db: FakeDB, *modules):
+    """
+    A context manager replacing the postgres_handler.py functions imported by the given modules (e.g.
+    data_processing.main and app) with the ones of fake_db.
+    :param fake_db: the in-memory database.
+    :param modules: the modules whose postgres functions are replaced.
+    :return: None.
+    """
+    names = ['get_source_objects', 'update_db_batch', 'iter_db_output_rows', 'get_db_users', 'iter_db_users',
+             'get_output_changes', 'get_output_changes_version', 'clear_output_changes', 'get_data_generation',
+             'acquire_lease', 'get_leases', 'release_leases', 'get_source_rejects', 'update_source_rejects',
+             'resync_users_copy', 'get_source_users_images', 'get_users_source_objects']
+    with ExitStack() as stack:
+        for module in modules:
+            for name in names:
+                if hasattr(module, name):
+                    stack.enter_context(mock.patch.object(module, name, getattr(fake_db, name)))
+        yield
@@ -0,0 +1,153 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+import unittest
+from contextlib import ExitStack
+from unittest import mock
+
+import app
+from data_processing import postgres_handler
+from data_processing.cache import LRUCache, bump_dataset_version
+from data_processing.metrics import DATA_GET_SECONDS
+from tests.fakes import FakeDB, patch_db
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        app.get_compose_service.cache_clear()
+        self.addCleanup(app.get_compose_service.cache_clear)
+
+    def test_compose_fallback(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            compose_file = os.path.join(tmp_dir, 'docker-compose.yml')
+            with open(compose_file, 'w') as f:
+                f.write("services:\n  minio:\n    environment:\n      - MINIO_ACCESS_KEY=key\n    ports:\n"
+                        "      - 9100:9002\n")
+            with mock.patch.object(app, 'COMPOSE_FILE', compose_file):
+                self.assertEqual(app.get_compose_port('minio', '9000'), '9002')
+                self.assertEqual(app.get_compose_port('db', '5432'), '5432')
+                self.assertEqual(app.get_config('Minio_access_key', 'minio', 'MINIO_ACCESS_KEY', 'default'), 'key')
+        with mock.patch.object(app, 'COMPOSE_FILE', os.path.join(tmp_dir, 'missing.yml')):
+            app.get_compose_service.cache_clear()
+            self.assertEqual(app.get_compose_port('minio', '9000'), '9000')
+
+
+class TestMetricsRequest(unittest.TestCase):
+
+    def test_database_down(self):
+        db_info = {'db_name': 'missing', 'db_user': 'user', 'db_password': 'password', 'db_host': '127.0.0.1',
+                   'db_port': 1}
+        with mock.patch.object(app, 'db_info', db_info):
+            response = app.app.test_client().get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE data_cache gauge', response.get_data(as_text=True))
+        self.assertNotIn(postgres_handler.get_db_pool_key(db_info), postgres_handler._db_pools)
+
+
+class TestDataGet(unittest.TestCase):
+    """
+    The tests of GET /data, run against the in-memory stand-in of postgres.
+    """
+
+    def setUp(self):
+        self.fake_db = FakeDB()
+        stack = ExitStack()
+        self.addCleanup(stack.close)
+        stack.enter_context(patch_db(self.fake_db, app))
+        stack.enter_context(mock.patch.object(app, 'db_info', {}))
+        self.fake_db.update_db_batch({}, [[user_id, 'a', 'b', '946674000000', img_path, 'batch.csv']
+                                          for user_id, img_path in [('1', '1.png'), ('2', ''), ('3', '3.png')]], [])
+        app.clear_data_caches()
+        self.client = app.app.test_client()
+
+    def test_invalid_arguments(self):
+        for arg in ['min_age', 'max_age']:
+            for value in ['inf', '-inf', 'nan', 'twenty']:
+                for data_format in ['json', 'ndjson']:
+                    response = self.client.get('/data', query_string={arg: value, 'format': data_format})
+                    self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/data', query_string={'min_age': '1e3'}).get_json(), {})
+        self.assertEqual(len(self.client.get('/data', query_string={'max_age': '1e3'}).get_json()), 3)
+
+    def test_pages(self):
+        response = self.client.get('/data', query_string={'limit': '2'})
+        self.assertListEqual(list(response.get_json()), ['1', '2'])
+        cursor = response.headers['X-Next-Cursor']
+        response = self.client.get('/data', query_string={'limit': '2', 'after': cursor})
+        self.assertListEqual(list(response.get_json()), ['3'])
+        self.assertNotIn('X-Next-Cursor', response.headers)
+        self.assertListEqual(list(self.client.get('/data', query_string={'after': cursor}).get_json()), ['3'])
+        response = self.client.get('/data', query_string={'limit': '3'})
+        self.assertEqual(len(response.get_json()), 3)
+        self.assertNotIn('X-Next-Cursor', response.headers)
+        for query_string in [{'limit': '0'}, {'limit': str(app.MAX_PAGE_LIMIT + 1)}, {'limit': 'two'},
+                             {'after': 'not a cursor'}]:
+            self.assertEqual(self.client.get('/data', query_string=query_string).status_code, 400)
+
+    def test_ndjson(self):
+        response = self.client.get('/data', query_string={'format': 'ndjson', 'is_image_exists': 'True'})
+        self.assertEqual(response.mimetype, app.NDJSON_MIMETYPE)
+        self.assertListEqual([json.loads(line) for line in response.get_data(as_text=True).splitlines()],
+                             [{'user_id': user_id, 'first_name': 'a', 'last_name': 'b', 'birthts': '946674000000',
+                               'img_path': user_id + '.png'} for user_id in ['1', '3']])
+        cursor = self.client.get('/data', query_string={'limit': '1'}).headers['X-Next-Cursor']
+        response = self.client.get('/data', query_string={'limit': '1', 'after': cursor},
+                                   headers={'Accept': app.NDJSON_MIMETYPE})
+        self.assertListEqual([json.loads(line)['user_id'] for line in response.get_data(as_text=True).splitlines()],
+                             ['2'])
+
+    def test_ndjson_latency(self):
+        def iter_db_users(db_info, **filters):
+            time.sleep(0.05)
+            yield from self.fake_db.iter_db_users(db_info, **filters)
+        def get_count_total():
+            counts, total = DATA_GET_SECONDS._values.get(('format',), ([0], 0.0))
+            return counts[-1], total
+        count, total = get_count_total()
+        with mock.patch.object(app, 'iter_db_users', side_effect=iter_db_users):
+            response = self.client.get('/data', query_string={'format': 'ndjson'}, buffered=False)
+            self.assertEqual(get_count_total()[0], count)
+            self.assertEqual(len(response.get_data(as_text=True).splitlines()), 3)
+            response.close()
+        new_count, new_total = get_count_total()
+        self.assertEqual(new_count, count + 1)
+        self.assertGreaterEqual(new_total - total, 0.05)
+
+    def test_etag(self):
+        response = self.client.get('/data')
+        etag = response.headers['ETag']
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertListEqual(list(response.get_json()), ['1', '2', '3'])
+        response = self.client.get('/data', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(response.get_data(), b'')
+        response = self.client.get('/data', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(gzip.decompress(response.get_data()), self.client.get('/data').get_data())
+        self.assertNotEqual(self.client.get('/data?is_image_exists=True').headers['ETag'], etag)
+        bump_dataset_version()
+        app.clear_data_caches()
+        self.assertEqual(self.client.get('/data').headers['ETag'], etag)
+        self.fake_db.update_db_batch({}, [['4', 'c', 'd', '5', '', '4.csv']], [])
+        response = self.client.get('/data', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertListEqual(list(response.get_json()), ['1', '2', '3', '4'])
+
+    def test_read_model_cached(self):
+        with mock.patch.object(app, 'data_cache', LRUCache(1)), \
+                mock.patch.object(app, 'get_db_users', side_effect=self.fake_db.get_db_users) as get_db_users:
+            for query_string in [{}, {'is_image_exists': 'True'}, {'limit': '1'}, {}]:
+                self.assertEqual(self.client.get('/data', query_string=query_string).status_code, 200)
+            self.assertEqual(get_db_users.call_count, 1)
+            self.fake_db.update_db_batch({}, [['4', 'c', 'd', '5', '', '4.csv']], [])
+            self.assertEqual(len(self.client.get('/data').get_json()), 4)
+            self.assertEqual(get_db_users.call_count, 2)
@@ -0,0 +1,44 @@
+import unittest
+import warnings
+from tests.fakes import *
+from benchmarks.sources import *
+from benchmarks.run import compare_results
+import data_processing.main as main
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_generate_sources(self):
+        sources = dict(generate_sources(100, invalid_ratio=0.2, image_ratio=0.5, seed=1))
+        self.assertDictEqual(sources, dict(generate_sources(100, invalid_ratio=0.2, image_ratio=0.5, seed=1)))
+        self.assertEqual(len([name for name in sources if name.endswith('.csv')]), 100)
+        self.assertTrue(0 < len([name for name in sources if name.endswith('.png')]) < 100)
+
+    def test_process_all_data_minio_fakes(self):
+        minio_client, fake_db = FakeMinio(), FakeDB()
+        sources = dict(generate_sources(50, invalid_ratio=0.2, image_ratio=0.5, seed=2))
+        put_sources_minio(minio_client, sources.items())
+        valid = len([name for name, contents in sources.items()
+                     if name.endswith('.csv') and main.check_csv_rows_src(
+                         [[value.strip() for value in line.split(',')] for line in contents.decode().splitlines()])[0]])
+        with warnings.catch_warnings(), patch_db(fake_db, main):
+            warnings.simplefilter('ignore')
+            self.assertTupleEqual(main.process_all_data_minio({}, minio_client, parquet='off'), (valid, 50))
+            requests = minio_client.requests
+            self.assertTupleEqual(main.process_all_data_minio({}, minio_client, parquet='off'), (valid, 50))
+            self.assertEqual(minio_client.requests - requests, 2)
+        output = minio_client.get_object(main.PROCESSED_DATA_BUCKET, main.OUTPUT_FILE_NAME).data.decode()
+        self.assertEqual(len(output.splitlines()), valid + 1)
+
+    def test_compare_results(self):
+        baseline = [{'scenario': 'a', 'users': 10, 'median_seconds': 1.0},
+                    {'scenario': 'b', 'users': 10, 'median_seconds': 1.0}]
+        results = [{'scenario': 'a', 'users': 10, 'median_seconds': 1.1},
+                   {'scenario': 'b', 'users': 10, 'median_seconds': 1.5},
+                   {'scenario': 'c', 'users': 10, 'median_seconds': 9.0}]
+        regressions = compare_results(results, baseline, tolerance=0.2)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('b (10 users)'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+from unittest import mock
+from data_processing.cache import *
+
+
+class TestCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = LRUCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertDictEqual(cache.get_stats(), {'size': 2, 'max_size': 2, 'hits': 3, 'misses': 1, 'evictions': 1})
+
+    def test_ttl(self):
+        cache = LRUCache(max_size=2, ttl=10)
+        with mock.patch('time.monotonic', return_value=100):
+            cache.put('a', 1)
+        with mock.patch('time.monotonic', return_value=105):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('time.monotonic', return_value=111):
+            self.assertEqual(cache.get('a', 'expired'), 'expired')
+
+    def test_dataset_version(self):
+        version = get_dataset_version()
+        self.assertEqual(get_dataset_version(), version)
+        new_version = bump_dataset_version()
+        self.assertNotEqual(new_version, version)
+        self.assertEqual(get_dataset_version(), new_version)
@@ -0,0 +1,119 @@
+import threading
+import unittest
+import warnings
+from unittest import mock
+from tests.fakes import *
+from benchmarks.sources import *
+import data_processing.main as main
+import data_processing.coordination as coordination
+from data_processing.cache import get_dataset_version
+
+
+class TestCoordination(unittest.TestCase):
+    def test_claim_shards(self):
+        fake_db = FakeDB()
+        with patch_db(fake_db, coordination), mock.patch('time.monotonic', return_value=100):
+            first = coordination.IngestionCoordinator({}, shard_count=8, lease_ttl=10, replica_id='a')
+            second = coordination.IngestionCoordinator({}, shard_count=8, lease_ttl=10, replica_id='b')
+            self.assertListEqual(first.claim_shards(), list(range(8)))
+            self.assertListEqual(second.claim_shards(), [])
+            self.assertEqual(len(first.claim_shards()), 4)
+            self.assertEqual(len(second.claim_shards()), 4)
+            self.assertListEqual(sorted(first.shards + second.shards), list(range(8)))
+            self.assertTrue(first.hold_lease(coordination.PUBLISHER_LEASE))
+            self.assertFalse(second.hold_lease(coordination.PUBLISHER_LEASE))
+        with patch_db(fake_db, coordination), mock.patch('time.monotonic', return_value=105):
+            second.renew()
+        with patch_db(fake_db, coordination), mock.patch('time.monotonic', return_value=112):
+            self.assertListEqual(second.claim_shards(), list(range(8)))
+            self.assertTrue(second.hold_lease(coordination.PUBLISHER_LEASE))
+            second.stop()
+            self.assertDictEqual(fake_db.get_leases({}), {})
+
+    def test_process_shards_minio(self):
+        minio_client, fake_db = FakeMinio(), FakeDB()
+        put_sources_minio(minio_client, generate_sources(60, invalid_ratio=0, image_ratio=0.5))
+        with warnings.catch_warnings(), patch_db(fake_db, main, coordination):
+            warnings.simplefilter('ignore')
+            replicas = [coordination.IngestionCoordinator({}, shard_count=4, replica_id=replica_id)
+                        for replica_id in ['a', 'b']]
+            for replica in replicas:
+                replica.renew()
+            results = [coordination.process_shards_minio({}, minio_client, replica, parquet='off')
+                       for replica in replicas]
+            self.assertEqual(sum(success for success, _ in results), 60)
+            self.assertTrue(all(0 < total < 60 for _, total in results))
+            self.assertDictEqual(fake_db.output_changes, {})
+            self.assertDictEqual(fake_db.get_leases({}, coordination.PUBLISHER_LEASE), {})
+        output = minio_client.get_object(main.PROCESSED_DATA_BUCKET, main.OUTPUT_FILE_NAME).data.decode()
+        self.assertEqual(len(output.splitlines()), 61)
+
+    def test_publish_after_other_runs(self):
+        minio_client, fake_db = FakeMinio(), FakeDB()
+        put_sources_minio(minio_client, generate_sources(60, invalid_ratio=0, image_ratio=0.5))
+        with warnings.catch_warnings(), patch_db(fake_db, main, coordination):
+            warnings.simplefilter('ignore')
+            first, second = [coordination.IngestionCoordinator({}, shard_count=4, replica_id=replica_id)
+                             for replica_id in ['a', 'b']]
+            for replica in [first, second]:
+                replica.renew()
+            self.assertTrue(second.begin_run())
+            success, _ = coordination.process_shards_minio({}, minio_client, first, parquet='off')
+            self.assertEqual(len(fake_db.output_changes), success)
+            self.assertIsNone(main.get_object_info_minio(minio_client, main.PROCESSED_DATA_BUCKET,
+                                                         main.OUTPUT_FILE_NAME))
+            second.end_run()
+            self.assertTrue(second.hold_lease(coordination.PUBLISHER_LEASE))
+            publish = threading.Thread(target=coordination.process_shards_minio, args=({}, minio_client, first),
+                                       kwargs={'parquet': 'off'})
+            publish.start()
+            publish.join(0.2)
+            self.assertTrue(publish.is_alive())
+            second.end_publish()
+            publish.join(5)
+            self.assertFalse(publish.is_alive())
+            self.assertDictEqual(fake_db.output_changes, {})
+        output = minio_client.get_object(main.PROCESSED_DATA_BUCKET, main.OUTPUT_FILE_NAME).data.decode()
+        self.assertEqual(len(output.splitlines()), success + 1)
+
+    def test_heartbeat(self):
+        fake_db = FakeDB()
+        with patch_db(fake_db, coordination):
+            coordinator = coordination.IngestionCoordinator({}, shard_count=2, lease_ttl=0.03, replica_id='a')
+            coordination.sync_dataset_version({})
+            version = get_dataset_version()
+            fake_db.update_db_batch({}, [['1', 'a', 'b', '5', '', '1.csv']], [])
+            errors = [OSError('down')]
+
+            def renew():
+                if errors:
+                    raise errors.pop()
+                coordinator.stop()
+            with mock.patch.object(coordinator, 'renew', side_effect=renew):
+                with self.assertWarnsRegex(UserWarning, 'could not be renewed'):
+                    coordinator.heartbeat()
+            self.assertNotEqual(get_dataset_version(), version)
+
+    def test_resync_lease(self):
+        minio_client, fake_db = FakeMinio(), FakeDB()
+        put_sources_minio(minio_client, generate_sources(20, invalid_ratio=0, image_ratio=0.5))
+        with warnings.catch_warnings(), patch_db(fake_db, main, coordination):
+            warnings.simplefilter('ignore')
+            first, second = [coordination.IngestionCoordinator({}, shard_count=4, replica_id=replica_id)
+                             for replica_id in ['a', 'b']]
+            self.assertTrue(second.begin_run())
+            resync = threading.Thread(target=first.begin_resync, args=(0.01,))
+            resync.start()
+            resync.join(0.2)
+            self.assertTrue(resync.is_alive())
+            second.end_run()
+            resync.join(5)
+            self.assertFalse(resync.is_alive())
+            self.assertFalse(second.begin_run())
+            self.assertTupleEqual(coordination.process_shards_minio({}, minio_client, second, parquet='off'), (0, 0))
+            self.assertRaises(RuntimeError, coordination.process_resync_minio, {}, minio_client, second, parquet='off')
+            first.end_resync()
+            self.assertTupleEqual(coordination.process_resync_minio({}, minio_client, first, parquet='off'), (20, 20))
+            self.assertEqual(len(fake_db.users), 20)
+            self.assertDictEqual(fake_db.get_leases({}, coordination.RUN_LEASE_PREFIX), {})
+            self.assertEqual(coordination.process_shards_minio({}, minio_client, second, parquet='off')[0], 20)
@@ -1,5 +1,16 @@
+import threading
 import unittest
+import warnings
+from contextlib import ExitStack
+from typing import Iterable, List, Tuple, Union
+from unittest import mock
 from data_processing.main import *
+import data_processing.main as main
+from data_processing.jobs import IngestionJobs
+from data_processing.notifications import BucketEventsIngestion
+from data_processing.parquet_handler import is_parquet_available
+from tests.fakes import FakeDB, FakeMinio, FakeS3Error, patch_db
+from benchmarks.sources import format_rows, generate_sources, put_sources_minio
 
 
 class TestHelpers(unittest.TestCase):
@@ -27,4 +38,367 @@ class TestHelpers(unittest.TestCase):
         self.assertTupleEqual(check_values_types_src(['f', 'y', '20 2']), (False, "The value 20 2 does not follow birthts's condition"))
         self.assertTupleEqual(check_values_types_src(['f', 'y', '20O']), (False, "The value 20O does not follow birthts's condition"))
         self.assertTupleEqual(check_values_types_src(['f', 'y', 'asd']), (False, "The value asd does not follow birthts's condition"))
+        for birthts in ['99999999999999999999', '1_000', '0', '\u0661\u0662']:
+            self.assertFalse(check_values_types_src(['f', 'y', birthts])[0])
+        self.assertTupleEqual(check_values_types_src([' ' + 'a' * 50 + ' ', 'y', '1']), (True, ''))
+        self.assertFalse(check_values_types_src(['f', 'a' * 51, '1'])[0])
 
+
+    def test_diff_source_objects(self):
+        csv_objects = {'1.csv': ('a', 10, None), '2.csv': ('b', 20, None), '3.csv': ('c', 30, None)}
+        img_etags = {'1.png': 'i1', '3.png': 'i3'}
+        manifest = {'1.csv': ('a', 10, 'i1'), '2.csv': ('b', 20, 'i2'), '3.csv': ('x', 30, 'i3'), '4.csv': ('d', 5, '')}
+        self.assertTupleEqual(diff_source_objects(csv_objects, img_etags, manifest), (['2.csv', '3.csv'], ['4.csv']))
+        self.assertTupleEqual(diff_source_objects(csv_objects, img_etags, manifest, full=True),
+                              (['1.csv', '2.csv', '3.csv'], ['4.csv']))
+        self.assertTupleEqual(diff_source_objects(csv_objects, img_etags, {}), (['1.csv', '2.csv', '3.csv'], []))
+        manifest = {'1.csv': ('a', 10, BATCH_IMG_ETAG), '2.csv': ('b', 20, BATCH_IMG_ETAG)}
+        source_users = {'1.csv': {'1': True, '4': False}, '2.csv': {'3': False}}
+        self.assertTupleEqual(diff_source_objects(csv_objects, img_etags, manifest, source_users=source_users),
+                              (['2.csv', '3.csv'], []))
+
+    def test_get_event_user_ids(self):
+        from data_processing.notifications import get_event_user_ids
+        event = {'Records': [{'s3': {'object': {'key': '0001.csv'}}}, {'s3': {'object': {'key': '0001.png'}}},
+                             {'s3': {'object': {'key': 'with+space.csv'}}}, {'s3': {'object': {'key': 'a.txt'}}}]}
+        self.assertListEqual(get_event_user_ids(event), ['0001', 'with space'])
+        self.assertListEqual(get_event_user_ids({'Records': []}), [])
+
+    def test_process_all_data(self):
+        import tempfile
+        from unittest import mock
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as processed:
+            src += '/'
+            for user_id, contents in [('1', 'first_name,last_name,birthts\nIvan,Ivanov,946674000000\n'),
+                                      ('2', 'first_name,last_name,birthts\nPetr,Petrov,abc\n'),
+                                      ('3', 'first_name,last_name,birthts\nOlga,Ivanova,-5\n')]:
+                with open(src + user_id + '.csv', 'w') as f:
+                    f.write(contents)
+            open(src + '3.png', 'w').close()
+            with mock.patch('data_processing.main.SRC_DATA_PATH', src), \
+                    mock.patch('data_processing.main.OUTPUT_FILE_PATH', processed + '/output.csv'), \
+                    self.assertWarns(UserWarning):
+                self.assertTupleEqual(process_all_data(), (2, 3))
+            rows = sorted(get_rows_csv(processed + '/output.csv'))
+        self.assertListEqual(rows, [['1', 'Ivan', 'Ivanov', '946674000000', ''],
+                                    ['3', 'Olga', 'Ivanova', '-5', src + '3.png'], OUTPUT_HEADERS])
+
+    def test_check_batch_rows_src(self):
+        file_rows = [['user_id', ' first_name', ' last_name', ' birthts'],
+                     ['1', ' Ivan', ' Ivanov', ' 946674000000'],
+                     ['2', '', 'Petrov', '5'],
+                     ['3', 'Olga', 'Ivanova', '12a'],
+                     ['4', 'Anna', 'Smirnova'],
+                     [],
+                     ['1', 'Ivan', 'Petrov', '7'],
+                     ['5', 'Oleg', 'Sidorov', '-5']]
+        self.assertTupleEqual(check_batch_rows_src(file_rows), (
+            True, '', [['1', 'Ivan', 'Ivanov', '946674000000'], ['5', 'Oleg', 'Sidorov', '-5']],
+            [(2, "The value  does not follow first_name's condition"),
+             (3, "The value 12a does not follow birthts's condition"),
+             (4, "The number of elements in the values row does not match the header."),
+             (6, "The user_id 1 appears more than once in the file.")]))
+        file_rows = [BATCH_HEADERS, ['1', '', 'Ivanov', '5'], ['1', 'Ivan', 'Ivanov', '5']]
+        self.assertTupleEqual(check_batch_rows_src(file_rows), (
+            True, '', [['1', 'Ivan', 'Ivanov', '5']], [(1, "The value  does not follow first_name's condition")]))
+        file_rows = [BATCH_HEADERS, ['1' * 51, 'Ivan', 'Ivanov', '5'], ['2', 'a' * 50, 'b' * 51, '5'],
+                     ['3', 'a' * 50, 'b' * 50, '5']]
+        self.assertTupleEqual(check_batch_rows_src(file_rows), (
+            True, '', [['3', 'a' * 50, 'b' * 50, '5']],
+            [(1, f"The value {'1' * 51} does not follow user_id's condition"),
+             (2, f"The value {'b' * 51} does not follow last_name's condition")]))
+        self.assertFalse(check_batch_rows_src([['user_id', 'first_name', 'last_name']])[0])
+        self.assertTupleEqual(check_batch_rows_src([BATCH_HEADERS, []]),
+                              (False, "The file does not contain any user.", [], []))
+
+    def test_get_users_rows_src(self):
+        self.assertTupleEqual(get_users_rows_src('/src/7.csv', [ORG_HEADERS, ['Ivan', 'Ivanov', '1']]),
+                              (True, '', [['7', 'Ivan', 'Ivanov', '1']], []))
+        self.assertFalse(get_users_rows_src('/src/7.csv', [ORG_HEADERS, ['Ivan', 'Ivanov', '1'], ['a', 'b', '2']])[0])
+        self.assertFalse(get_users_rows_src(f"/src/{'7' * 51}.csv", [ORG_HEADERS, ['Ivan', 'Ivanov', '1']])[0])
+        self.assertTupleEqual(get_users_rows_src('/src/batch.csv', [BATCH_HEADERS, ['8', 'Anna', 'Smirnova', '3']]),
+                              (True, '', [['8', 'Anna', 'Smirnova', '3']], []))
+
+    def test_get_users_rows_src_stops_early(self):
+        read = []
+
+        def rows():
+            for row in [['name', 'last_name', 'birthts'], ['Ivan', 'Ivanov', '1']] + [['a', 'b', '2']] * 100:
+                read.append(row)
+                yield row
+        self.assertFalse(get_users_rows_src('/src/7.csv', rows())[0])
+        self.assertEqual(len(read), 3)
+        with mock.patch('data_processing.main.BATCH_VALIDATION_ROWS', 2):
+            file_rows = [BATCH_HEADERS, ['1', 'a', 'b', '1'], ['2', 'a', 'b', '2'], ['1', 'a', 'b', '3'],
+                         ['3', '', 'b', '4']]
+            self.assertTupleEqual(get_users_rows_src('/src/batch.csv', file_rows), (
+                True, '', [['1', 'a', 'b', '1'], ['2', 'a', 'b', '2']],
+                [(3, "The user_id 1 appears more than once in the file."),
+                 (4, "The value  does not follow first_name's condition")]))
+
+    def test_lazy_imports(self):
+        import subprocess
+        import sys
+        code = "import sys, data_processing.notifications; print(' '.join(m for m in ['pandas', 'pyarrow', 'minio'] " \
+               "if m in sys.modules))"
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), '')
+
+
+class TestProcessAllDataMinio(unittest.TestCase):
+    """
+    The tests of the data processing from MinIO, run against the in-memory stand-ins of MinIO and postgres.
+    """
+
+    def setUp(self):
+        self.stack = ExitStack()
+        self.addCleanup(self.stack.close)
+        self.stack.enter_context(warnings.catch_warnings())
+        warnings.simplefilter('ignore')
+        self.use_fakes()
+
+    def use_fakes(self, sources: Iterable[Tuple[str, bytes]] = ()) -> None:
+        """
+        A method to replace MinIO and postgres with new empty stand-ins, and put some source files in the src bucket.
+        :param sources: the source files as tuples (the file's name, its contents).
+        :return: None.
+        """
+        self.minio_client, self.fake_db = FakeMinio(), FakeDB()
+        self.stack.enter_context(patch_db(self.fake_db, main))
+        put_sources_minio(self.minio_client, sources)
+
+    def process(self, **options) -> Tuple[int, int]:
+        return main.process_all_data_minio({}, self.minio_client, **options)
+
+    def get_data(self, object_name: str, bucket: str = main.PROCESSED_DATA_BUCKET) -> bytes:
+        return self.minio_client.get_object(bucket, object_name).data
+
+    def list_names(self, bucket: str, prefix: Union[str, None] = None) -> List[str]:
+        return [minio_object.object_name for minio_object in self.minio_client.list_objects(bucket, prefix=prefix)]
+
+    def test_process_batch_files(self):
+        put_sources_minio(self.minio_client, generate_sources(30, invalid_ratio=0, image_ratio=0.5,
+                                                              users_per_file=20))
+        self.assertTupleEqual(self.process(), (2, 2))
+        self.assertEqual(len(self.get_data(main.OUTPUT_FILE_NAME).decode().splitlines()), 31)
+        put_sources_minio(self.minio_client, [('batch_1.csv', format_rows([main.BATCH_HEADERS, ['20', 'a', 'b', '1'],
+                                                                           ['21', '', 'b', '1']]))])
+        self.assertTupleEqual(self.process(), (2, 2))
+        output = self.get_data(main.OUTPUT_FILE_NAME).decode()
+        self.assertEqual(len(output.splitlines()), 22)
+        self.assertIn('20,a,b,1,', output)
+
+    def test_batch_files_images(self):
+        batch = format_rows([main.BATCH_HEADERS, ['20', 'a', 'b', '1'], ['21', 'c', 'd', '2']])
+        put_sources_minio(self.minio_client, [('batch_0.csv', batch), ('batch_1.csv', batch), ('20.png', b'20')])
+        self.assertTupleEqual(self.process(parquet='off'), (2, 2))
+        self.assertListEqual([values[3] for values in self.fake_db.users.values()], ['20.png', ''])
+        requests = self.minio_client.requests
+        self.process(parquet='off')
+        self.assertEqual(self.minio_client.requests - requests, 2)
+        put_sources_minio(self.minio_client, [('21.png', b'21')])
+        self.process(parquet='off')
+        self.assertEqual(self.fake_db.users['21'][3], '21.png')
+        self.minio_client.remove_object(main.SRC_DATA_BUCKET, '20.png')
+        self.process(parquet='off')
+        self.assertEqual(self.fake_db.users['20'][3], '')
+        self.assertIn('20,a,b,1,\r\n', self.get_data(main.OUTPUT_FILE_NAME).decode())
+        put_sources_minio(self.minio_client, [('20.png', b'20')])
+        self.assertTupleEqual(main.proc_csv_file_minio({}, self.minio_client, '20.csv'),
+                              (True, 'Processed 2 users and rejected 0 rows.'))
+        self.assertEqual(self.fake_db.users['20'][3], '20.png')
+        self.assertListEqual(list(self.fake_db.source_objects), ['batch_0.csv', 'batch_1.csv'])
+        self.assertFalse(main.proc_csv_file_minio({}, self.minio_client, '22.csv')[0])
+        requests = self.minio_client.requests
+        self.process(parquet='off')
+        self.assertEqual(self.minio_client.requests - requests, 2)
+
+    def test_processes(self):
+        sources = list(generate_sources(100, invalid_ratio=0.2, image_ratio=0.5, users_per_file=3))
+        outputs = []
+        for processes in [0, 2]:
+            self.use_fakes(sources)
+            outputs.append((self.process(parquet='off', processes=processes), self.get_data(main.OUTPUT_FILE_NAME)))
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_publish_parquet(self):
+        if not is_parquet_available():
+            self.skipTest('pyarrow is not installed.')
+        import io
+        import pyarrow.parquet as pq
+        put_sources_minio(self.minio_client, generate_sources(40, invalid_ratio=0, image_ratio=0.5))
+        self.process(parquet='partitioned')
+        partitions = self.list_names(main.PROCESSED_DATA_BUCKET, main.OUTPUT_PARQUET_PREFIX)
+        self.assertTrue(all(name.startswith('output_parquet/birth_decade=') for name in partitions))
+        self.minio_client.put_object(main.PROCESSED_DATA_BUCKET, 'output_parquet/birth_decade=1800/part-0.parquet',
+                                     io.BytesIO(b''), 0)
+        main.publish_output_minio({}, self.minio_client, parquet='partitioned')
+        self.assertListEqual(self.list_names(main.PROCESSED_DATA_BUCKET, main.OUTPUT_PARQUET_PREFIX), partitions)
+        main.publish_output_minio({}, self.minio_client, parquet='file')
+        table = pq.read_table(io.BytesIO(self.get_data(main.OUTPUT_PARQUET_NAME)))
+        output = self.get_data(main.OUTPUT_FILE_NAME).decode()
+        self.assertEqual(table.num_rows, 40)
+        self.assertEqual(str(table.schema.field('birthts').type), 'int64')
+        self.assertListEqual([[str(value) for value in row.values()][:5] for row in table.to_pylist()],
+                             [row.split(',') for row in output.splitlines()[1:]])
+        main.publish_output_minio({}, self.minio_client, parquet='file', layout='delta')
+        self.assertNotIn(main.OUTPUT_PARQUET_NAME, self.list_names(main.PROCESSED_DATA_BUCKET))
+        self.assertListEqual(self.list_names(main.PROCESSED_DATA_BUCKET, main.OUTPUT_PARQUET_PREFIX), [])
+
+    def test_publish_output_delta(self):
+        put_sources_minio(self.minio_client, generate_sources(40, invalid_ratio=0, image_ratio=0.5))
+        self.process(parquet='off', layout='delta')
+        manifest = main.get_output_manifest_minio(self.minio_client)
+        self.assertDictEqual({key: manifest[key] for key in ['sequence', 'base_rows', 'deltas', 'retired']},
+                             {'sequence': 1, 'base_rows': 40, 'deltas': [], 'retired': []})
+        self.assertDictEqual(self.fake_db.output_changes, {})
+        put_sources_minio(self.minio_client, [('03.csv', format_rows([main.ORG_HEADERS, ['a', 'b', '1']]))])
+        self.minio_client.remove_object(main.SRC_DATA_BUCKET, '05.csv')
+        self.process(parquet='off', layout='delta')
+        manifest = main.get_output_manifest_minio(self.minio_client)
+        self.assertListEqual(manifest['deltas'], ['output/delta-00000002.csv'])
+        delta = self.get_data(manifest['deltas'][0]).decode()
+        self.assertListEqual(delta.splitlines()[1:], ['upsert,03,a,b,1,', 'delete,05,,,,'])
+        rows = list(main.iter_output_rows_minio(self.minio_client))
+        self.assertEqual(len(rows), 39)
+        self.assertIn(['03', 'a', 'b', '1', ''], rows)
+        self.assertCountEqual(rows, list(self.fake_db.iter_db_output_rows({})))
+        self.assertEqual(main.consolidate_output_minio(self.minio_client), 39)
+        self.assertEqual(len(self.get_data(main.OUTPUT_FILE_NAME).decode().splitlines()), 40)
+        with mock.patch.object(main, 'OUTPUT_MAX_DELTAS', 0):
+            for name in ['06.csv', '07.csv']:
+                self.minio_client.remove_object(main.SRC_DATA_BUCKET, name)
+                self.process(parquet='off', layout='delta')
+        manifest = main.get_output_manifest_minio(self.minio_client)
+        self.assertEqual(manifest['base'], 'output/base-00000004.csv')
+        self.assertListEqual(manifest['retired'], ['output/base-00000003.csv'])
+        self.assertListEqual(self.list_names(main.PROCESSED_DATA_BUCKET, main.OUTPUT_DELTA_PREFIX),
+                             ['output/base-00000003.csv', 'output/base-00000004.csv', 'output/manifest.json'])
+        self.assertEqual(len(list(main.iter_output_rows_minio(self.minio_client))), 37)
+
+    def test_source_rejects(self):
+        put_sources_minio(self.minio_client, [
+            ('01.csv', format_rows([main.ORG_HEADERS, ['a', 'b', '1']])),
+            ('02.csv', format_rows([main.ORG_HEADERS, ['', 'b', '2']])),
+            ('03.csv', format_rows([['name'] + main.ORG_HEADERS[1:], ['a', 'b', '3']]))])
+        self.assertTupleEqual(self.process(parquet='off', quarantine='copy'), (1, 3))
+        self.assertListEqual(list(self.fake_db.source_rejects), ['02.csv', '03.csv'])
+        self.assertEqual(self.fake_db.source_rejects['02.csv'][3], 'quarantine/02.csv')
+        self.assertEqual(self.get_data('quarantine/03.csv'), self.get_data('03.csv', main.SRC_DATA_BUCKET))
+        requests = self.minio_client.requests
+        self.assertTupleEqual(self.process(parquet='off', quarantine='copy'), (1, 3))
+        self.assertEqual(self.minio_client.requests - requests, 2)
+        put_sources_minio(self.minio_client, [('02.csv', format_rows([main.ORG_HEADERS, ['a', 'b', '2']]))])
+        self.assertTupleEqual(self.process(parquet='off', quarantine='move'), (2, 3))
+        self.assertListEqual(list(self.fake_db.source_rejects), ['03.csv'])
+        put_sources_minio(self.minio_client, [('04.csv', format_rows([main.ORG_HEADERS, ['a', '', '4']]))])
+        self.assertTupleEqual(self.process(parquet='off', quarantine='move'), (2, 4))
+        self.assertNotIn('04.csv', self.list_names(main.SRC_DATA_BUCKET))
+        self.process(parquet='off', quarantine='move')
+        self.assertListEqual(list(self.fake_db.source_rejects), ['03.csv', '04.csv'])
+        put_sources_minio(self.minio_client, [('05.csv', format_rows([main.ORG_HEADERS, ['a', 'b', '5x']]))])
+        self.process(parquet='off', quarantine='off')
+        self.assertIsNone(self.fake_db.source_rejects['05.csv'][3])
+        for name in ['03.csv', '05.csv']:
+            self.minio_client.remove_object(main.SRC_DATA_BUCKET, name)
+        self.process(parquet='off', quarantine='off')
+        self.assertListEqual(list(self.fake_db.source_rejects), ['03.csv', '04.csv'])
+
+    def test_source_rejects_events(self):
+        put_sources_minio(self.minio_client, [('01.csv', format_rows([main.ORG_HEADERS, ['', 'b', '1']]))])
+        events = BucketEventsIngestion({}, self.minio_client, lambda: None, parquet='off', quarantine='move')
+        events.process_batch(['01'])
+        self.assertEqual(self.fake_db.source_rejects['01.csv'][3], 'quarantine/01.csv')
+        self.assertNotIn('01.csv', self.list_names(main.SRC_DATA_BUCKET))
+        events.process_batch(['01'])
+        self.assertListEqual(list(self.fake_db.source_rejects), ['01.csv'])
+        self.assertEqual(self.get_data('quarantine/01.csv'), format_rows([main.ORG_HEADERS, ['', 'b', '1']]))
+
+    def test_resync(self):
+        sources = list(generate_sources(60, invalid_ratio=0.2, image_ratio=0.5, users_per_file=4, seed=3))
+        outputs = []
+        for resync in ['off', 'merge']:
+            self.use_fakes(sources)
+            result = self.process(batch_size=7, parquet='off', resync=resync)
+            outputs.append((result, self.get_data(main.OUTPUT_FILE_NAME), self.fake_db.users,
+                            list(self.fake_db.source_objects)))
+        self.assertEqual(outputs[0], outputs[1])
+        self.process(parquet='off', publish=False, resync='merge')
+        self.assertDictEqual(self.fake_db.output_changes, {})
+        self.minio_client.remove_object(main.SRC_DATA_BUCKET, 'batch_0.csv')
+        self.process(parquet='off', publish=False, resync='merge')
+        detached = [user_id for user_id, values in self.fake_db.users.items() if values[4] is None]
+        self.assertTrue(detached)
+        self.assertCountEqual(self.fake_db.output_changes, detached)
+        self.assertNotIn('batch_0.csv', self.fake_db.source_objects)
+        self.process(parquet='off', resync='replace')
+        self.assertFalse(set(detached) & set(self.fake_db.users))
+        self.assertEqual(len(self.fake_db.users), len(outputs[0][2]) - len(detached))
+
+    def test_events_batch_waits_for_job(self):
+        put_sources_minio(self.minio_client, [('1.csv', format_rows([main.ORG_HEADERS, ['a', 'b', '1']]))])
+        started, release = threading.Event(), threading.Event()
+
+        def run(progress, **options):
+            started.set()
+            release.wait(5)
+            return 0, 0
+
+        jobs = IngestionJobs(run)
+        events = BucketEventsIngestion({}, self.minio_client, jobs.run_and_wait, parquet='off', lock=jobs.run_lock)
+        job, _ = jobs.submit()
+        started.wait(5)
+        batch = threading.Thread(target=events.process_batch, args=(['1'],))
+        batch.start()
+        batch.join(0.2)
+        self.assertTrue(batch.is_alive())
+        self.assertDictEqual(self.fake_db.users, {})
+        release.set()
+        batch.join(5)
+        self.assertEqual(jobs.wait(job['id'], timeout=5)['status'], 'succeeded')
+        self.assertListEqual(list(self.fake_db.users), ['1'])
+
+    def test_fetch_failure(self):
+        sources = [('01.csv', format_rows([main.ORG_HEADERS, ['a', 'b', '1']])),
+                   ('02.csv', format_rows([main.ORG_HEADERS, ['c', 'd', '2']]))]
+        get_object = self.minio_client.get_object
+
+        def flaky_get_object(bucket: str, object_name: str):
+            if object_name == '02.csv':
+                raise FakeS3Error('The connection was reset.')
+            return get_object(bucket, object_name)
+
+        for processes in [0, 2]:
+            self.use_fakes(sources)
+            get_object = self.minio_client.get_object
+            with mock.patch.object(self.minio_client, 'get_object', side_effect=flaky_get_object):
+                self.assertTupleEqual(self.process(parquet='off', processes=processes, quarantine='move'), (1, 2))
+                self.assertDictEqual(self.fake_db.source_rejects, {})
+                self.assertIn('02.csv', self.list_names(main.SRC_DATA_BUCKET))
+                self.assertListEqual(self.list_names(main.PROCESSED_DATA_BUCKET, main.QUARANTINE_PREFIX), [])
+                users = dict(self.fake_db.users)
+                self.assertRaises(FakeS3Error, self.process, parquet='off', processes=processes, resync='replace')
+                self.assertDictEqual(self.fake_db.users, users)
+            self.assertTupleEqual(self.process(parquet='off', processes=processes, quarantine='move'), (2, 2))
+            self.assertListEqual(list(self.fake_db.users), ['01', '02'])
+
+    def test_listing_failure(self):
+        put_sources_minio(self.minio_client, generate_sources(10, invalid_ratio=0, image_ratio=0.5))
+        self.process(parquet='off')
+        users, output = dict(self.fake_db.users), self.get_data(main.OUTPUT_FILE_NAME)
+        with mock.patch.object(self.minio_client, 'list_objects', side_effect=FakeS3Error('unreachable')):
+            for resync in ['off', 'replace']:
+                self.assertRaises(FakeS3Error, self.process, parquet='off', resync=resync)
+        self.assertDictEqual(self.fake_db.users, users)
+        self.assertEqual(self.get_data(main.OUTPUT_FILE_NAME), output)
+
+    def test_object_info(self):
+        put_sources_minio(self.minio_client, [('01.csv', format_rows([main.ORG_HEADERS, ['a', 'b', '1']]))])
+        self.assertEqual(main.get_object_info_minio(self.minio_client, main.SRC_DATA_BUCKET, '01.csv').size, 39)
+        self.assertIsNone(main.get_object_info_minio(self.minio_client, main.SRC_DATA_BUCKET, '02.csv'))
+        self.process(parquet='off')
+        with mock.patch.object(self.minio_client, 'stat_object', side_effect=FakeS3Error('Access denied.')):
+            self.assertRaises(FakeS3Error, main.get_object_info_minio, self.minio_client, main.SRC_DATA_BUCKET,
+                              '01.csv')
+            self.assertRaises(FakeS3Error, main.proc_csv_file_minio, {}, self.minio_client, '01.csv')
+        self.assertListEqual(list(self.fake_db.users), ['01'])
@@ -61,3 +61,50 @@ class TestHelpers(unittest.TestCase):
         self.assertEqual(years_to_ms(10), 315569520000)
         self.assertRaises(Exception, years_to_ms, -3.2)
         self.assertRaises(ValueError, years_to_ms, '1w')
+
+    def test_page_cursor(self):
+        for key in ['0001', 'user with space', 'ünïcode', '']:
+            self.assertEqual(decode_page_cursor(encode_page_cursor(key)), key)
+        self.assertNotIn('=', encode_page_cursor('1'))
+        self.assertRaises(TypeError, decode_page_cursor, 100)
+
+    def test_imap_bounded(self):
+        items = list(range(50))
+        for workers in [0, 1, 4]:
+            self.assertListEqual(list(imap_bounded(lambda x: x * x, items, workers)), [x * x for x in items])
+        self.assertListEqual(list(imap_bounded(lambda x: x, [], 4)), [])
+        self.assertListEqual(list(imap_bounded(lambda x: -x, items, 8, max_pending=3)), [-x for x in items])
+
+    def test_write_csv_rows(self):
+        import io
+        output = io.BytesIO()
+        rows = [['user_id', 'first_name'], ['1', 'with, comma'], ['2', 'ünïcode']] * 3
+        self.assertEqual(write_csv_rows(output, rows, flush_rows=2), 9)
+        expected_lines = ['user_id,first_name', '1,"with, comma"', '2,ünïcode'] * 3
+        self.assertEqual(output.getvalue().decode(), '\r\n'.join(expected_lines) + '\r\n')
+
+    def test_iter_decoded_lines(self):
+        import csv
+        data = '\ufefffirst_name,last_name\n"Ivan, Jr",Ïvanov\r\n"multi\nline",x'.encode()
+        for size in [1, 2, 5, len(data)]:
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            self.assertListEqual(list(csv.reader(iter_decoded_lines(chunks))),
+                                 [['first_name', 'last_name'], ['Ivan, Jr', 'Ïvanov'], ['multi\nline', 'x']])
+        self.assertListEqual(list(iter_decoded_lines([b'ab', b'c', b'd\ne', b'f\n\ng'])), ['abcd\n', 'ef\n', '\n', 'g'])
+        self.assertListEqual(list(iter_decoded_lines([])), [])
+        self.assertRaises(UnicodeDecodeError, list, iter_decoded_lines([b'\xff\n']))
+
+    def test_imap_processes(self):
+        import warnings
+        items = [-3, 1, -2, 5, -8, 0]
+        for processes in [0, 2]:
+            self.assertListEqual(list(imap_processes(abs, items, processes)), [abs(x) for x in items])
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertListEqual(list(imap_processes(lambda x: x * 2, items, 2)), [x * 2 for x in items])
+        self.assertEqual(len(caught), 1)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertRaises(TypeError, list, imap_processes(abs, ['a'], 2))
+            self.assertListEqual(list(imap_processes(abs, items, 2)), [abs(x) for x in items])
+        self.assertListEqual(caught, [])
@@ -0,0 +1,39 @@
+import threading
+import unittest
+from data_processing.jobs import *
+
+
+class TestIngestionJobs(unittest.TestCase):
+    def test_single_flight(self):
+        release = threading.Event()
+        calls = []
+
+        def run(progress, **options):
+            calls.append(options)
+            progress(1, 2, 1, 0)
+            release.wait(5)
+            return 2, 2
+
+        jobs = IngestionJobs(run)
+        job, created = jobs.submit(full=True)
+        self.assertTrue(created)
+        same_job, created = jobs.submit()
+        self.assertFalse(created)
+        self.assertEqual(same_job['id'], job['id'])
+        release.set()
+        finished = jobs.wait(job['id'], timeout=5)
+        self.assertEqual(finished['status'], 'succeeded')
+        self.assertEqual((finished['success'], finished['files_total']), (2, 2))
+        self.assertListEqual(calls, [{'full': True}])
+        self.assertTrue(jobs.submit()[1])
+
+    def test_failed_job(self):
+        def run(progress, **options):
+            raise ValueError('no bucket')
+
+        jobs = IngestionJobs(run, max_finished_jobs=1)
+        first = jobs.run_and_wait()
+        self.assertEqual(first['status'], 'failed')
+        self.assertEqual(first['error_message'], 'no bucket')
+        jobs.run_and_wait()
+        self.assertIsNone(jobs.get(first['id']))
@@ -0,0 +1,49 @@
+import unittest
+from data_processing.metrics import *
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = []
+    def test_format_labels(self):
+        self.assertEqual(format_labels((), ()), '')
+        self.assertEqual(format_labels(('stage',), ('fetch',)), '{stage="fetch"}')
+        self.assertEqual(format_labels(('filters',), ('a"b\\',), 'le="1"'), '{filters="a\\"b\\\\",le="1"}')
+
+    def test_counter(self):
+        counter = Counter('test_files_total', 'Test files.', ('result',), registry=self.registry)
+        counter.inc(result='processed')
+        counter.inc(2, result='processed')
+        counter.inc(result='invalid')
+        self.assertEqual(counter.render().split('\n'), ['# HELP test_files_total Test files.',
+                                                        '# TYPE test_files_total counter',
+                                                        'test_files_total{result="invalid"} 1',
+                                                        'test_files_total{result="processed"} 3'])
+
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', 'Test durations.', ('stage',), buckets=(0.5, 2), registry=self.registry)
+        histogram.observe(0.1, stage='fetch')
+        histogram.observe(1, stage='fetch')
+        histogram.observe(5, stage='fetch')
+        with histogram.time(stage='list'):
+            pass
+        lines = histogram.samples()
+        self.assertEqual(lines[:5], ['test_seconds_bucket{stage="fetch",le="0.5"} 1',
+                                     'test_seconds_bucket{stage="fetch",le="2"} 2',
+                                     'test_seconds_bucket{stage="fetch",le="+Inf"} 3',
+                                     'test_seconds_sum{stage="fetch"} 6.1',
+                                     'test_seconds_count{stage="fetch"} 3'])
+        self.assertEqual(lines[-1], 'test_seconds_count{stage="list"} 1')
+
+    def test_registry(self):
+        counter = Counter('test_registry_total', 'Test registry.', registry=self.registry)
+        gauge = Gauge('test_registry_gauge', 'Test registry.', registry=self.registry)
+        counter.inc()
+        gauge.set(2)
+        self.assertListEqual(self.registry, [counter, gauge])
+        self.assertEqual(render_metrics(self.registry), counter.render() + '\n' + gauge.render() + '\n')
+        self.assertNotIn('test_registry_total', render_metrics())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import io
+import os
+import unittest
+import warnings
+from unittest import mock
+import psycopg2.extensions
+from data_processing.postgres_handler import *
+from data_processing.helpers import write_csv_rows
+import data_processing.main as main
+from benchmarks.sources import generate_sources, put_sources_minio
+from tests.fakes import FakeMinio
+
+DB_INFO = {'db_name': 'test', 'db_user': 'user', 'db_password': 'password', 'db_host': 'localhost'}
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.info = mock.Mock(transaction_status=psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def rollback(self):
+        self.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class TestDBConnectionPool(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('psycopg2.connect', side_effect=lambda **kwargs: FakeConnection())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reuses_connections(self):
+        pool = DBConnectionPool(DB_INFO, min_size=0, max_size=2)
+        conn = pool.get_conn()
+        pool.put_conn(conn)
+        self.assertIs(pool.get_conn(), conn)
+        self.assertEqual(pool.get_stats()['connections_created'], 1)
+        self.assertEqual(pool.get_stats()['in_use'], 1)
+
+    def test_discards_broken_connections(self):
+        pool = DBConnectionPool(DB_INFO, min_size=1, max_size=1)
+        conn = pool.get_conn()
+        conn.close()
+        pool.put_conn(conn)
+        new_conn = pool.get_conn()
+        self.assertIsNot(new_conn, conn)
+        self.assertEqual(pool.get_stats()['connections_discarded'], 1)
+
+    def test_times_out_when_exhausted(self):
+        pool = DBConnectionPool(DB_INFO, min_size=0, max_size=1, timeout=0.01)
+        pool.get_conn()
+        self.assertRaises(DBPoolTimeoutError, pool.get_conn)
+        self.assertEqual(pool.get_stats()['timeouts'], 1)
+
+
+class TestPostgres(unittest.TestCase):
+    """
+    The tests which run against a real postgres database. They are skipped unless the environment variable DB_test_name
+    names a database dedicated to the tests (its tables are dropped), on the server given by DB_host, DB_port, DB_user
+    and DB_password.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        if os.getenv('DB_test_name') is None:
+            raise unittest.SkipTest('No postgres test database is configured (DB_test_name).')
+        cls.db_info = {'db_name': os.getenv('DB_test_name'), 'db_user': os.getenv('DB_user', 'postgres'),
+                       'db_password': os.getenv('DB_password', 'postgres'),
+                       'db_host': os.getenv('DB_host', 'localhost'), 'db_port': int(os.getenv('DB_port', 5432))}
+
+    def setUp(self):
+        run_db_command(self.db_info, """DROP TABLE IF EXISTS users, users_invalid_birthts, source_objects,
+                                        output_changes, source_rejects, ingestion_leases;""")
+
+    def test_init_db_migrates_legacy_users(self):
+        run_db_command(self.db_info, """CREATE TABLE users(id SERIAL PRIMARY KEY NOT NULL,
+                                        user_id varchar (50) NOT NULL, first_name varchar (50) NOT NULL,
+                                        last_name varchar (50) NOT NULL, birthts varchar (50) NOT NULL,
+                                        img_path varchar (250) NOT NULL);""")
+        for values in [('1', 'a', 'b', ' 5 ', ''), ('1', 'c', 'd', '6', ''),
+                       ('2', 'a', 'b', '99999999999999999999', ''), ('3', 'a', 'b', '1_000', ''),
+                       ('4', 'a', 'b', '-7', 'x.png'), ('5', 'a', 'b', ' 1.2e12', ''), ('6', 'a', 'b', '1.5', '')]:
+            run_db_command(self.db_info, """INSERT INTO users(user_id, first_name, last_name, birthts, img_path)
+                                            VALUES (%s, %s, %s, %s, %s);""", values)
+        with self.assertWarnsRegex(UserWarning, '3 users whose birthts is not an integer'):
+            init_db(self.db_info)
+        init_db(self.db_info)
+        self.assertDictEqual(get_db_users(self.db_info), {
+            '1': {'first_name': 'c', 'last_name': 'd', 'birthts': '6', 'img_path': ''},
+            '4': {'first_name': 'a', 'last_name': 'b', 'birthts': '-7', 'img_path': 'x.png'},
+            '5': {'first_name': 'a', 'last_name': 'b', 'birthts': '1200000000000', 'img_path': ''}})
+        invalid = run_db_command(self.db_info, """SELECT user_id, birthts FROM users_invalid_birthts
+                                                  ORDER BY user_id;""", fetch=True)
+        self.assertListEqual(invalid, [('2', '99999999999999999999'), ('3', '1_000'), ('6', '1.5')])
+
+    def test_upsert_users_rows(self):
+        init_db(self.db_info)
+        upsert_users_rows(self.db_info, [['1', 'a', 'b', '5', ''], ['2', 'c', 'd', '-6', '2.png', '2.csv'],
+                                         ['1', 'e', 'f', '7', '1.png']])
+        update_db(self.db_info, '3', 'g', 'h', '8', '')
+        upsert_users_rows(self.db_info, [['2', 'x', 'd', '-6', '', None]])
+        upsert_users_rows(self.db_info, [])
+        self.assertDictEqual(get_db_users(self.db_info), {
+            '1': {'first_name': 'e', 'last_name': 'f', 'birthts': '7', 'img_path': '1.png'},
+            '2': {'first_name': 'x', 'last_name': 'd', 'birthts': '-6', 'img_path': ''},
+            '3': {'first_name': 'g', 'last_name': 'h', 'birthts': '8', 'img_path': ''}})
+        self.assertDictEqual(get_users_source_objects(self.db_info, ['1', '2', '3']), {'2': '2.csv'})
+
+    def test_update_db_batch(self):
+        init_db(self.db_info)
+        update_db_batch(self.db_info, [['1', 'a', 'b', '5', '', '1.csv'], ['2', 'c', 'd', '6', '', 'batch.csv'],
+                                       ['3', 'e', 'f', '7', '3.png', 'batch.csv']],
+                        [('1.csv', 'e1', 10, None, ''), ('batch.csv', 'e2', 20, None, '*')])
+        self.assertCountEqual([user_id for user_id, _ in get_output_changes(self.db_info)[0]], ['1', '2', '3'])
+        clear_output_changes(self.db_info, get_output_changes_version(self.db_info))
+        generation = get_data_generation(self.db_info)
+        update_db_batch(self.db_info, [['3', 'x', 'f', '7', '', 'batch.csv']],
+                        [('batch.csv', 'e3', 15, None, ''), ('batch.csv', 'e4', 16, None, '')], ['1.csv'])
+        self.assertNotEqual(get_data_generation(self.db_info), generation)
+        self.assertCountEqual([user_id for user_id, _ in get_output_changes(self.db_info)[0]], ['1', '2', '3'])
+        self.assertDictEqual(get_source_objects(self.db_info), {'batch.csv': ('e4', 16, '')})
+        self.assertDictEqual(get_users_source_objects(self.db_info, ['1', '2', '3']), {'1': '1.csv', '3': 'batch.csv'})
+        self.assertListEqual(list(iter_db_output_rows(self.db_info)), [['3', 'x', 'f', '7', '']])
+
+    def test_get_source_users_images(self):
+        init_db(self.db_info)
+        update_db_batch(self.db_info, [['1', 'a', 'b', '5', '1.png', 'batch.csv'],
+                                       ['2', 'c', 'd', '6', '', 'batch.csv'], ['3', 'e', 'f', '7', '', '3.csv']], [])
+        self.assertDictEqual(get_source_users_images(self.db_info, ['batch.csv', 'other.csv']),
+                             {'batch.csv': {'1': True, '2': False}})
+        self.assertDictEqual(get_users_source_objects(self.db_info, ['1', '3', '4']), {'1': 'batch.csv', '3': '3.csv'})
+
+    def test_iter_db_users_order(self):
+        init_db(self.db_info)
+        user_ids = ['b', 'B', 'a-2', 'a1', '_z', '10', '9']
+        update_db_batch(self.db_info, [[user_id, 'a', 'b', '5', '', 'batch.csv'] for user_id in user_ids], [])
+        self.assertListEqual([user_id for user_id, _ in iter_db_users(self.db_info)], sorted(user_ids))
+        self.assertListEqual([user_id for user_id, _ in iter_db_users(self.db_info, after_user_id='B', limit=3)],
+                             sorted(user_ids)[3:6])
+
+    def test_resync_users_copy(self):
+        init_db(self.db_info)
+        update_db_batch(self.db_info, [['1', 'a', 'b', '5', '', '1.csv'], ['2', 'c', 'd', '6', '', 'batch.csv'],
+                                       ['3', 'e', 'f', '7', '', 'batch.csv']],
+                        [('1.csv', 'e1', 10, None, ''), ('batch.csv', 'e2', 20, None, '*'),
+                         ('old.csv', 'e0', 5, None, '')])
+        clear_output_changes(self.db_info, get_output_changes_version(self.db_info))
+        users_file, source_objects_file = io.BytesIO(), io.BytesIO()
+        write_csv_rows(users_file, [['1', 'a', 'b', '5', '', '1.csv'], ['2', 'x', 'd', '6', '', 'batch.csv'],
+                                    ['2', 'O"Neil, Jr', 'd', '6', '2.png', 'batch.csv'],
+                                    ['4', 'g', 'h', '-8', '', 'new.csv']])
+        write_csv_rows(source_objects_file, [('1.csv', 'e1', 10, None, ''),
+                                             ('batch.csv', 'e3', 30, '2026-01-01T00:00:00+00:00', '*'),
+                                             ('new.csv', 'e4', 5, None, '')])
+        self.assertTupleEqual(resync_users_copy(self.db_info, users_file, source_objects_file), (2, 1))
+        self.assertDictEqual(get_db_users(self.db_info), {
+            '1': {'first_name': 'a', 'last_name': 'b', 'birthts': '5', 'img_path': ''},
+            '2': {'first_name': 'O"Neil, Jr', 'last_name': 'd', 'birthts': '6', 'img_path': '2.png'},
+            '3': {'first_name': 'e', 'last_name': 'f', 'birthts': '7', 'img_path': ''},
+            '4': {'first_name': 'g', 'last_name': 'h', 'birthts': '-8', 'img_path': ''}})
+        self.assertListEqual(list(iter_db_output_rows(self.db_info)),
+                             [['1', 'a', 'b', '5', ''], ['2', 'O"Neil, Jr', 'd', '6', '2.png'],
+                              ['4', 'g', 'h', '-8', '']])
+        self.assertCountEqual([user_id for user_id, _ in get_output_changes(self.db_info)[0]], ['2', '3', '4'])
+        self.assertDictEqual(get_source_objects(self.db_info), {'1.csv': ('e1', 10, ''), 'batch.csv': ('e3', 30, '*'),
+                                                                'new.csv': ('e4', 5, '')})
+        self.assertTupleEqual(resync_users_copy(self.db_info, users_file, source_objects_file, delete_missing=True),
+                              (0, 1))
+        self.assertListEqual(sorted(get_db_users(self.db_info)), ['1', '2', '4'])
+
+    def test_process_all_data_resync(self):
+        init_db(self.db_info)
+        minio_client = FakeMinio()
+        put_sources_minio(minio_client, generate_sources(9, invalid_ratio=0.2, image_ratio=0.5))
+        put_sources_minio(minio_client, generate_sources(30, invalid_ratio=0.1, image_ratio=0.5, seed=1,
+                                                         users_per_file=10))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            incremental = main.process_all_data_minio(self.db_info, minio_client, parquet='off', processes=0)
+            users = get_db_users(self.db_info)
+            output = minio_client.get_object(main.PROCESSED_DATA_BUCKET, main.OUTPUT_FILE_NAME).data
+            run_db_command(self.db_info, "TRUNCATE users, source_objects, output_changes, source_rejects;")
+            self.assertTupleEqual(main.process_all_data_minio(self.db_info, minio_client, parquet='off',
+                                                              processes=0, resync='merge'), incremental)
+            self.assertDictEqual(get_db_users(self.db_info), users)
+            self.assertEqual(minio_client.get_object(main.PROCESSED_DATA_BUCKET, main.OUTPUT_FILE_NAME).data, output)
+            removed = sorted(get_source_objects(self.db_info))[0]
+            minio_client.remove_object(main.SRC_DATA_BUCKET, removed)
+            main.process_all_data_minio(self.db_info, minio_client, parquet='off', processes=0, resync='replace')
+        self.assertNotIn(removed, get_source_objects(self.db_info))
+        self.assertTrue(set(get_db_users(self.db_info)) < set(users))
@@ -0,0 +1,40 @@
+import random
+import unittest
+from data_processing.read_model import *
+
+
+class TestReadModel(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(0)
+        self.users = {str(i).zfill(3): {'first_name': f'first{i}', 'last_name': f'last{i}',
+                                        'birthts': str(rnd.randint(-1000, 1000)), 'img_path': rnd.choice(['', 'a.png'])}
+                      for i in range(200)}
+        self.model = UsersReadModel(dict(reversed(self.users.items())))
+
+    def select_scan(self, is_image_exists=None, min_birthts=None, max_birthts=None, after_user_id=None, limit=None):
+        selected = {}
+        for user_id in sorted(self.users):
+            values = self.users[user_id]
+            if (is_image_exists is not None and (values['img_path'] != '') != is_image_exists) or \
+                    (min_birthts is not None and int(values['birthts']) < min_birthts) or \
+                    (max_birthts is not None and int(values['birthts']) > max_birthts) or \
+                    (after_user_id is not None and user_id <= after_user_id):
+                continue
+            selected[user_id] = values
+            if limit is not None and len(selected) >= limit:
+                break
+        return selected
+
+    def test_select(self):
+        self.assertEqual(len(self.model), 200)
+        self.assertIs(self.model.select(), self.model.users)
+        for filters in [{'is_image_exists': True}, {'is_image_exists': False, 'limit': 7},
+                        {'min_birthts': -100, 'max_birthts': 300}, {'min_birthts': 1001}, {'max_birthts': -1000},
+                        {'min_birthts': 0, 'is_image_exists': True, 'after_user_id': '050', 'limit': 10},
+                        {'after_user_id': '198'}, {'after_user_id': '199', 'limit': 5}]:
+            selected = self.model.select(**filters)
+            self.assertListEqual(list(selected.items()), list(self.select_scan(**filters).items()), filters)
+
+    def test_empty(self):
+        model = UsersReadModel({})
+        self.assertDictEqual(model.select(min_birthts=0, is_image_exists=True, limit=1), {})